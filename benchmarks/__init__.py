@@ -0,0 +1,5 @@
+"""
+Benchmarks for the data pipeline. Run them from the root of the repository, e.g.
+
+    python -m benchmarks.read_data
+"""
@@ -0,0 +1,34 @@
+"""
+Compares the per-row age parsing previously used by the analysis module against the
+vectorized age parser on the detection timeline scaled to millions of rows
+"""
+import sys
+import time
+
+import numpy as np
+
+from src.age import parse_age
+from src.utils import read_data
+
+
+def run(rows: int = 2_000_000):
+    """
+    Prints the time taken by both parsers
+    """
+    age = read_data('Worldwide_Case_Detection_Timeline_Cleaned.csv', columns=['Age'])['Age']
+    age = age.iloc[np.arange(rows) % len(age)].reset_index(drop=True)
+
+    start = time.perf_counter()
+    np.ceil(age.fillna('0').apply(lambda x: np.array(x.split('-'), dtype=int).mean())).astype(int)
+    per_row = time.perf_counter() - start
+
+    start = time.perf_counter()
+    parse_age(age)
+    vectorized = time.perf_counter() - start
+
+    print(f"{rows:,} rows: per-row {per_row * 1e3:.0f} ms, vectorized {vectorized * 1e3:.0f} ms "
+          f"({per_row / vectorized:.0f}x)")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000)
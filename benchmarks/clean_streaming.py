@@ -0,0 +1,72 @@
+"""
+Compares the peak memory of cleaning the detection timeline in memory against streaming
+it in chunks, for raw timelines scaled to an increasing number of rows
+"""
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from src.clean import clean_data
+
+RAW_FILE = 'Worldwide_Case_Detection_Timeline.csv'
+
+
+def write_scaled(src: str, dst: str, copies: int):
+    """
+    Writes the CSV `src` to `dst` with its rows repeated `copies` times and returns the
+    number of rows written
+    """
+    assert isinstance(copies, int) and copies > 0
+
+    with open(src, 'rb') as f:
+        header = f.readline()
+        body = f.read()
+    with open(dst, 'wb') as f:
+        f.write(header)
+        for _ in range(copies):
+            f.write(body)
+    return body.count(b'\n') * copies
+
+
+def measure(func):
+    """
+    Returns the wall time in seconds and the peak traced memory in bytes of calling `func`.
+    Tracing slows allocations down a lot, so the time is taken from a separate untraced call.
+    """
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def run(scales=(1, 4, 16), chunksize: int = 50_000):
+    """
+    Prints time and peak memory of both cleaning modes for every scale
+    """
+    src = os.path.join(os.getcwd(), 'data', RAW_FILE)
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(workdir, 'data'))
+    try:
+        os.chdir(workdir)
+        print(f"{'rows':>12}{'in-memory (s)':>16}{'peak (MB)':>12}{'streaming (s)':>16}{'peak (MB)':>12}")
+        for copies in scales:
+            rows = write_scaled(src, os.path.join('data', RAW_FILE), copies)
+            mem_time, mem_peak = measure(lambda: clean_data(RAW_FILE))
+            stream_time, stream_peak = measure(lambda: clean_data(RAW_FILE, chunksize=chunksize))
+            print(f"{rows:>12,}{mem_time:>16.2f}{mem_peak / 2 ** 20:>12.1f}"
+                  f"{stream_time:>16.2f}{stream_peak / 2 ** 20:>12.1f}")
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,34 @@
+"""
+Compares per-row country lookups against the vectorized lookup of the country index on
+the detection timeline scaled to millions of rows
+"""
+import sys
+import time
+
+import numpy as np
+
+from src.countries import lookup_countries
+from src.utils import get_continent, read_data
+
+
+def run(rows: int = 1_000_000):
+    """
+    Prints the time taken by both lookups
+    """
+    countries = read_data('Worldwide_Case_Detection_Timeline_Cleaned.csv', columns=['Country'])['Country']
+    countries = countries.iloc[np.arange(rows) % len(countries)].reset_index(drop=True)
+
+    start = time.perf_counter()
+    countries.apply(get_continent)
+    per_row = time.perf_counter() - start
+
+    start = time.perf_counter()
+    lookup_countries(countries)
+    vectorized = time.perf_counter() - start
+
+    print(f"{rows:,} rows: per-row {per_row * 1e3:.0f} ms, vectorized {vectorized * 1e3:.0f} ms "
+          f"({per_row / vectorized:.0f}x)")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
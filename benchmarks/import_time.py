@@ -0,0 +1,84 @@
+"""
+Measures the cold start of the app: the time taken to import `main.py` and the modules it
+relies on, each in a fresh interpreter, against the budgets below. Also lists the heavy
+libraries pulled in by each import, which should only be loaded when a figure is built.
+
+    python -m benchmarks.import_time [repeat]
+
+Exits with status 1 when a module goes over its budget.
+"""
+import sys
+import statistics
+import subprocess
+
+# Cold start budget of each module, in seconds
+BUDGETS = {
+    'src.utils': 1.0,
+    'src.visualizations': 1.0,
+    'src.analysis': 1.0,
+    'main': 2.5,
+}
+
+HEAVY = ['streamlit', 'plotly', 'seaborn', 'matplotlib', 'wordcloud', 'geopy', 'pycountry_convert']
+
+
+def import_time(module: str) -> tuple:
+    """
+    Imports a module in a fresh interpreter
+
+    Parameters
+    ----------
+    module: str
+        The name of the module
+    Returns
+    -------
+        tuple: The cumulative import time in seconds and the heavy libraries imported, or
+        None and the error if the import failed
+    """
+    assert isinstance(module, str)
+
+    code = f"import sys, {module}; print(','.join(name for name in {HEAVY!r} if name in sys.modules))"
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True)
+    if result.returncode != 0:
+        return None, result.stderr.strip().splitlines()[-1]
+
+    # The lines read `import time: self [us] | cumulative | name`
+    for line in result.stderr.splitlines():
+        fields = [field.strip() for field in line.split('|')]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1]) / 1e6, result.stdout.strip()
+    return None, f"no import time reported for {module}"
+
+
+def run(repeat: int = 5) -> bool:
+    """
+    Prints the median cold import time of every module and whether it is within budget
+
+    Returns
+    -------
+        bool: Whether all the modules imported and are within their budget
+    """
+    within_budget = True
+    print(f"{'module':<22}{'import (s)':>12}{'budget (s)':>12}  heavy libraries loaded")
+    for module, budget in BUDGETS.items():
+        timings, heavy = [], ''
+        for _ in range(repeat):
+            seconds, heavy = import_time(module)
+            if seconds is None:
+                break
+            timings.append(seconds)
+
+        if len(timings) < repeat:
+            # A module which does not import fails the run, e.g. a missing dependency
+            within_budget = False
+            print(f"{module:<22}{'failed':>12}{budget:>12.2f}  {heavy}")
+            continue
+        median = statistics.median(timings)
+        within_budget &= median <= budget
+        flag = '' if median <= budget else '  OVER BUDGET'
+        print(f"{module:<22}{median:>12.3f}{budget:>12.2f}  {heavy or '-'}{flag}")
+    return within_budget
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run(*map(int, sys.argv[1:])) else 1)
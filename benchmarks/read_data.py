@@ -0,0 +1,49 @@
+"""
+Compares cold CSV loads against warm columnar loads for the datasets used by `main.py`
+"""
+import os
+import time
+
+from src import columnar
+from src.utils import read_data
+
+DATASETS = ['Monkey_Pox_Cases_Worldwide_Cleaned.csv',
+            'Daily_Country_Wise_Confirmed_Cases.csv',
+            'Worldwide_Case_Detection_Timeline_Cleaned.csv']
+
+
+def best_of(func, repeat: int = 5) -> float:
+    """
+    Returns the best wall time in seconds of `repeat` calls to `func`
+    """
+    assert callable(func) and isinstance(repeat, int) and repeat > 0
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run(repeat: int = 5):
+    """
+    Prints the cold (CSV) and warm (columnar) load times of every dataset
+    """
+    assert columnar.available(), "pyarrow is required for the columnar cache"
+
+    print(f"{'dataset':<50}{'csv (ms)':>12}{'columnar (ms)':>16}{'speedup':>10}")
+    for file in DATASETS:
+        cache_path = columnar.columnar_path(os.path.join(os.getcwd(), 'data', file))
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+
+        cold = best_of(lambda: read_data(file, use_cache=False), repeat)
+        # The first cached read builds the columnar copy
+        read_data(file)
+        warm = best_of(lambda: read_data(file), repeat)
+        print(f"{file:<50}{cold * 1e3:>12.1f}{warm * 1e3:>16.1f}{cold / warm:>9.1f}x")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,35 @@
+"""
+Reports the memory used by the detection timeline before and after it is converted to
+its typed schema, with the timeline scaled up to millions of rows
+"""
+import sys
+
+import numpy as np
+
+from src.schema import memory_report, to_timeline_schema
+from src.utils import read_data
+
+
+def scale(df, rows: int):
+    """
+    Returns `rows` rows of `df`, repeating it as many times as required
+    """
+    assert isinstance(rows, int) and rows > 0
+    return df.iloc[np.arange(rows) % len(df)].reset_index(drop=True)
+
+
+def run(rows: int = 2_000_000):
+    """
+    Prints the memory report for a timeline scaled to `rows` rows
+    """
+    df = scale(read_data('Worldwide_Case_Detection_Timeline_Cleaned.csv'), rows)
+    report = memory_report(df, to_timeline_schema(df))
+
+    print(f"Timeline with {rows:,} rows (MB)")
+    print((report / 2 ** 20).round(1).to_string())
+    before, after = report.loc['Total']
+    print(f"Memory reduced by {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000)
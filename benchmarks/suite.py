@@ -0,0 +1,226 @@
+"""
+Benchmark suite of the pipeline on synthetic data (see `benchmarks.synthetic`).
+
+Every case is run on freshly generated datasets at each requested scale, with all the
+in-process and on-disk memos cleared before every run: a few times untraced for its best
+wall time and once under tracemalloc for its peak memory. The results are compared with the baseline stored in
+`benchmarks/baselines/<rows>.json` and cases slower or heavier than the baseline by more
+than the threshold are reported as regressions.
+
+    python -m benchmarks.suite [--rows N ...] [--only CASE ...] [--threshold 0.25] [--save-baseline]
+
+Exits with status 1 when there are regressions. Baselines depend on the machine they were
+recorded on, so record them again with `--save-baseline` when changing machines.
+"""
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import inspect
+import argparse
+import importlib
+import tempfile
+import warnings
+import contextlib
+import tracemalloc
+
+from benchmarks import synthetic
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+# Relative slowdown or memory growth over the baseline reported as a regression
+THRESHOLD = 0.25
+# Differences below these are noise
+MIN_SECONDS = 0.05
+MIN_BYTES = 2 ** 20
+
+
+def stub_resolver(name: str):
+    """
+    Geocoder standing in for the online one, which resolves every name to (0, 0)
+    """
+    return 0.0, 0.0
+
+
+def cases() -> dict:
+    """
+    Returns the benchmark cases, from their name to a function of the datasets
+    `{'worldwide', 'worldwide_raw', 'daily', 'timeline'}`
+    """
+    from src import analysis
+    from src.clean import clean_data
+    from src.render import DATASET_PARAMETERS, discover
+    from src.utils import add_lat_long, get_highest_cases, parse_symptoms
+
+    all_cases = {
+        'clean_data': lambda data: clean_data(synthetic.TIMELINE),
+        'clean_data[streamed]': lambda data: clean_data(synthetic.TIMELINE, chunksize=100_000),
+        'add_lat_long': lambda data: add_lat_long(data['worldwide_raw'], resolver=stub_resolver),
+        'parse_symptoms': lambda data: parse_symptoms(data['timeline']),
+        'get_highest_cases': lambda data: get_highest_cases(data['worldwide']),
+        'basic_analysis': lambda data: analysis.basic_analysis(data['daily'], data['worldwide'], data['timeline']),
+    }
+
+    # Every figure builder and analysis function, the way the batch renderer finds them
+    def figure_case(module_name, name, parameters):
+        func = getattr(importlib.import_module(module_name), name)
+        names = [parameter for parameter in inspect.signature(func).parameters if parameter in DATASET_PARAMETERS]
+        return lambda data: func(**{parameter: data[DATASET_PARAMETERS[parameter]] for parameter in names},
+                                 **parameters)
+
+    for module_name, name, parameters in discover():
+        label = name + ''.join(f'[{value}]' for value in parameters.values())
+        all_cases[label] = figure_case(module_name, name, parameters)
+    return all_cases
+
+
+def load_datasets() -> dict:
+    """
+    Reads the datasets of the current directory
+    """
+    from src.utils import read_data
+
+    return {'worldwide': read_data(synthetic.WORLDWIDE_CLEANED),
+            'worldwide_raw': read_data(synthetic.WORLDWIDE),
+            'daily': read_data(synthetic.DAILY),
+            'timeline': read_data(synthetic.TIMELINE_CLEANED)}
+
+
+def reset():
+    """
+    Clears the memos of the pipeline, so that every case starts cold
+    """
+    from src import cache, derived, symptoms
+    from src.geocode import CACHE_FILE
+    from src.cube import CUBE_DIR
+    from src.timeline import MATRIX_DIR
+
+    cache.clear()
+    derived.invalidate()
+    symptoms._counts.clear()
+    for directory in [CUBE_DIR, MATRIX_DIR]:
+        shutil.rmtree(os.path.join(os.getcwd(), 'data', directory), ignore_errors=True)
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(os.path.join(os.getcwd(), 'data', CACHE_FILE))
+
+
+def measure(case, data: dict, repeat: int = 3) -> dict:
+    """
+    Runs a case untraced `repeat` times for its best wall time, which leaves out the first
+    use imports of the plotting libraries, and once traced for its peak memory
+    """
+    import matplotlib.pyplot as plt
+
+    results = {'wall': float('inf')}
+    for traced in [False] * repeat + [True]:
+        reset()
+        with warnings.catch_warnings(), contextlib.redirect_stdout(io.StringIO()):
+            warnings.simplefilter('ignore')
+            if traced:
+                tracemalloc.start()
+            start = time.perf_counter()
+            case(data)
+            wall = time.perf_counter() - start
+            if traced:
+                results['peak'] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            else:
+                results['wall'] = min(results['wall'], wall)
+        plt.close('all')
+    return results
+
+
+def run_scale(rows: int, only: list = None, root: str = None) -> dict:
+    """
+    Generates the datasets of a scale and measures every case on them
+
+    Parameters
+    ----------
+    rows: int
+        The number of rows of the detection timeline
+    only: list
+        Optional names of the cases to run
+    root: str
+        The directory to generate the datasets in, a temporary one by default
+    Returns
+    -------
+        dict: The wall time and peak memory of every case
+    """
+    from src import artifacts
+
+    cwd = os.getcwd()
+    root = root or tempfile.mkdtemp(prefix='monkeypox-bench-')
+    synthetic.generate(root, rows)
+    artifacts.set_mode('off')
+    os.chdir(root)
+    try:
+        data = load_datasets()
+        results = {}
+        for name, case in cases().items():
+            if not only or name in only:
+                results[name] = measure(case, data)
+                print(f"{name:<45}{results[name]['wall']:>10.3f}{results[name]['peak'] / 2 ** 20:>12.1f}")
+        return results
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def baseline_path(rows: int) -> str:
+    return os.path.join(BASELINE_DIR, f'{rows}.json')
+
+
+def regressions(results: dict, baseline: dict, threshold: float = THRESHOLD) -> list:
+    """
+    Returns the cases whose wall time or peak memory grew by more than `threshold` over the
+    baseline, as `(case, metric, baseline, result)` tuples
+    """
+    found = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for metric, noise in [('wall', MIN_SECONDS), ('peak', MIN_BYTES)]:
+            before, after = baseline[name][metric], result[metric]
+            if after > before * (1 + threshold) and after - before > noise:
+                found.append((name, metric, before, after))
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline on synthetic data')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000], help='rows of the detection timeline')
+    parser.add_argument('--only', nargs='*', default=None, help='names of the cases to run')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD, help='relative growth reported as regression')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the new baseline')
+    args = parser.parse_args(argv)
+
+    failed = False
+    for rows in args.rows:
+        print(f"\n{rows} rows\n{'case':<45}{'wall (s)':>10}{'peak (MB)':>12}")
+        results = run_scale(rows, args.only)
+
+        path = baseline_path(rows)
+        if args.save_baseline:
+            os.makedirs(BASELINE_DIR, exist_ok=True)
+            baseline = {}
+            if os.path.exists(path):
+                with open(path) as f:
+                    baseline = json.load(f)
+            with open(path, 'w') as f:
+                json.dump(dict(baseline, **results), f, indent=1, sort_keys=True)
+            continue
+        if not os.path.exists(path):
+            print(f"No baseline for {rows} rows, record one with --save-baseline")
+            continue
+
+        with open(path) as f:
+            found = regressions(results, json.load(f), args.threshold)
+        for name, metric, before, after in found:
+            print(f"REGRESSION {name} {metric}: {before:.4g} -> {after:.4g}")
+        failed |= bool(found)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+"""
+Synthetic datasets with the schemas and value distributions of the real ones in `data/`,
+at any scale.
+
+The detection timeline is resampled row by row (with replacement) from the real raw and
+cleaned timelines, which are aligned row for row, so the joint distribution of the columns
+is kept and both synthetic files stay consistent with each other. Rows are written in
+chunks from the factorized real columns, so tens of millions of rows take little memory.
+The worldwide and daily country tables get one row per country: the real countries, then
+resampled rows under numbered names (e.g. `Portugal 2`).
+
+    python -m benchmarks.synthetic ROOT [--rows N] [--countries N] [--seed N]
+
+writes the files under `ROOT/data`, next to the files the pipeline needs alongside them,
+so that the pipeline can run with `ROOT` as its working directory.
+"""
+import os
+import sys
+import shutil
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from src.clean import open_raw
+from src.utils import read_data
+
+TIMELINE = 'Worldwide_Case_Detection_Timeline.csv'
+TIMELINE_CLEANED = 'Worldwide_Case_Detection_Timeline_Cleaned.csv'
+WORLDWIDE = 'Monkey_Pox_Cases_Worldwide.csv'
+WORLDWIDE_CLEANED = 'Monkey_Pox_Cases_Worldwide_Cleaned.csv'
+DAILY = 'Daily_Country_Wise_Confirmed_Cases.csv'
+# Files read by the pipeline which are copied as they are
+SUPPORT_FILES = ['country_centroids.csv', 'symptom_rules.csv']
+
+# Number of rows generated and written at a time
+CHUNK_ROWS = 1_000_000
+
+
+def _factorized(df: pd.DataFrame) -> dict:
+    return {column: pd.factorize(df[column]) for column in df.columns}
+
+
+def _resample(columns: dict, rows: np.ndarray) -> pd.DataFrame:
+    # Missing values keep their -1 code, which `from_codes` turns back into nulls
+    return pd.DataFrame({column: pd.Categorical.from_codes(codes[rows], categories=uniques)
+                         for column, (codes, uniques) in columns.items()})
+
+
+def timelines(rows: int, seed: int = 0, chunk_rows: int = CHUNK_ROWS):
+    """
+    Generates a raw and a cleaned detection timeline of `rows` rows, in chunks
+
+    Parameters
+    ----------
+    rows: int
+        The number of rows
+    seed: int
+        The seed of the random generator
+    chunk_rows: int
+        The number of rows of each chunk
+    Returns
+    -------
+        An iterator over `(raw, cleaned)` pairs of chunks, with categorical columns
+    """
+    assert isinstance(rows, int) and rows > 0 and isinstance(chunk_rows, int) and chunk_rows > 0
+
+    raw = _factorized(open_raw(TIMELINE))
+    cleaned = _factorized(read_data(TIMELINE_CLEANED, use_cache=False))
+    size = len(next(iter(raw.values()))[0])
+    rng = np.random.default_rng(seed)
+    for start in range(0, rows, chunk_rows):
+        sample = rng.integers(0, size, min(chunk_rows, rows - start))
+        yield _resample(raw, sample), _resample(cleaned, sample)
+
+
+def _country_table(df: pd.DataFrame, countries: int, rng) -> pd.DataFrame:
+    # The real countries first, then resampled rows under numbered names
+    extra = rng.integers(0, len(df), max(countries - len(df), 0))
+    table = pd.concat([df.head(countries), df.iloc[extra]], ignore_index=True)
+    copies = table.groupby('Country').cumcount()
+    table['Country'] = table['Country'].where(copies == 0, table['Country'] + ' ' + (copies + 1).astype(str))
+    return table
+
+
+def country_tables(countries: int = None, seed: int = 0) -> dict:
+    """
+    Generates the worldwide cases (raw and cleaned) and daily cases tables
+
+    Parameters
+    ----------
+    countries: int
+        The number of countries, by default as many as in the real tables
+    seed: int
+        The seed of the random generator
+    Returns
+    -------
+        dict: The tables by file name
+    """
+    assert countries is None or (isinstance(countries, int) and countries > 0)
+
+    rng = np.random.default_rng(seed)
+    worldwide = read_data(WORLDWIDE_CLEANED, use_cache=False)
+    countries = countries or len(worldwide)
+    worldwide = _country_table(worldwide, countries, rng)
+    daily = _country_table(read_data(DAILY, use_cache=False), countries, rng)
+    # The cleaned table only adds the country codes and coordinates to the raw one
+    raw_columns = read_data(WORLDWIDE, use_cache=False).columns
+    return {WORLDWIDE: worldwide[raw_columns], WORLDWIDE_CLEANED: worldwide, DAILY: daily}
+
+
+def generate(root: str, rows: int, countries: int = None, seed: int = 0):
+    """
+    Writes synthetic datasets in `root/data`, read from the real ones in the `data` folder
+    of the current directory
+
+    Parameters
+    ----------
+    root: str
+        The directory to write to
+    rows: int
+        The number of rows of the detection timelines
+    countries: int
+        The number of countries of the country tables
+    seed: int
+        The seed of the random generator
+    """
+    assert isinstance(root, str)
+
+    source = os.path.join(os.getcwd(), 'data')
+    data = os.path.join(root, 'data')
+    os.makedirs(data, exist_ok=True)
+    os.makedirs(os.path.join(root, 'plots'), exist_ok=True)
+    for file in SUPPORT_FILES:
+        shutil.copy(os.path.join(source, file), data)
+
+    with open(os.path.join(data, TIMELINE), 'w', newline='') as raw_file, \
+            open(os.path.join(data, TIMELINE_CLEANED), 'w', newline='') as cleaned_file:
+        for i, (raw, cleaned) in enumerate(timelines(rows, seed)):
+            raw.to_csv(raw_file, index=False, header=(i == 0))
+            cleaned.to_csv(cleaned_file, index=False, header=(i == 0))
+
+    for file, table in country_tables(countries, seed).items():
+        table.to_csv(os.path.join(data, file), index=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write synthetic datasets')
+    parser.add_argument('root', help='directory to write the data folder to')
+    parser.add_argument('--rows', type=int, default=100_000, help='rows of the detection timeline')
+    parser.add_argument('--countries', type=int, default=None, help='rows of the country tables')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    generate(args.root, args.rows, args.countries, args.seed)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,49 @@
+"""
+Compares the per-row loop previously used by `US_world_timeline` against the vectorized
+daily count matrix on the detection timeline scaled to millions of rows
+"""
+import sys
+import time
+
+import numpy as np
+
+from src.timeline import daily_country_counts
+from src.utils import read_data
+
+
+def count_per_row(df):
+    """
+    Counts the cases per day in the world and the US the way `US_world_timeline` used to
+    """
+    world_counter, us_counter = {}, {}
+    for dat, cou in zip(df['Date_confirmation'].tolist(), df['Country'].tolist()):
+        world_counter[dat] = world_counter.get(dat, 0) + 1
+        if cou == 'United States':
+            us_counter[dat] = us_counter.get(dat, 0) + 1
+    return world_counter, us_counter
+
+
+def run(rows: int = 10_000_000):
+    """
+    Prints the time taken by both implementations, on string and on typed columns
+    """
+    columns = ['Date_confirmation', 'Country']
+    file = 'Worldwide_Case_Detection_Timeline_Cleaned.csv'
+    for typed in [False, True]:
+        df = read_data(file, columns=columns, typed=typed)
+        df = df.iloc[np.arange(rows) % len(df)].reset_index(drop=True)
+
+        start = time.perf_counter()
+        count_per_row(df)
+        per_row = time.perf_counter() - start
+
+        start = time.perf_counter()
+        daily_country_counts(df)
+        vectorized = time.perf_counter() - start
+
+        print(f"{rows:,} rows ({'typed' if typed else 'strings'}): per-row {per_row * 1e3:.0f} ms, "
+              f"vectorized {vectorized * 1e3:.0f} ms ({per_row / vectorized:.0f}x)")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000_000)
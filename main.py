@@ -1,91 +1,156 @@
 import warnings
+import concurrent.futures
 
 import streamlit as st
 
-from src.analysis import *
-from src.clean import *
-from src.utils import read_data
-from src.visualizations import *
+from src import artifacts, cache, instrument
+from src.analysis import hospitalization_gender, hospitalization_symptoms, hospitalization_vs_age, virus_vs_age_group
+from src.cache import load_data
+from src.visualizations import (US_world_histogram, US_world_timeline, case_trends, cases_cities, cases_map,
+                                correlation_heatmap, daily_changes, hospitalized_and_travelled, suspected_cases_bar,
+                                symptoms_distribution, symptoms_word_cloud)
 
+# Number of threads building the plotly charts. pyplot keeps a global current figure, so the
+# matplotlib and seaborn charts are built one at a time by a thread of their own. While the
+# memory of the stages is traced, all the charts are built one at a time so that the peaks
+# are measured (see `src.instrument`).
+CHART_WORKERS = 4
 
-if __name__=="__main__":
-    warnings.filterwarnings("ignore")
 
-    # This script would first clean the data and then run the visualization suite to generate
-    # all the plots
-    st.set_page_config(page_title="MonkeyPox Analysis", layout="wide")
-    st.title("MonkeyPox: EDA and Analysis")
+def dashboard_sections(df_worldwide_cases, df_daily_cases, df_detection_timeline):
+    """
+    Returns the sections of the dashboard, from their title to their columns. Each column
+    lists its charts as `(heading, kind, build)` where `kind` is `plotly` or `pyplot` and
+    `build` is a function returning the figure, so that nothing is computed until the
+    section is opened.
+    """
+    return {
+        # One map, zoomed on the regions by its buttons in the browser
+        "Geographical spread of the disease": [
+            [(None, 'plotly', lambda: cases_map(df_worldwide_cases))],
+        ],
+        "Case trends and timelines": [
+            [(None, 'plotly', lambda: case_trends(df_worldwide_cases, df_daily_cases))],
+            [(None, 'plotly', lambda: daily_changes(df_worldwide_cases, df_daily_cases))],
+        ],
+        "Most affected cities and suspected cases": [
+            [("Most affected cities", 'plotly', lambda: cases_cities(df_detection_timeline))],
+            [("Most suspected cases", 'plotly', lambda: suspected_cases_bar(df_worldwide_cases))],
+        ],
+        "Symptoms": [
+            [(None, 'pyplot', lambda: symptoms_word_cloud(df_detection_timeline))],
+            [(None, 'plotly', lambda: symptoms_distribution(df_detection_timeline))],
+        ],
+        "Correlations - Hospitalization and Travel": [
+            [(None, 'plotly', lambda: correlation_heatmap(df_worldwide_cases))],
+            [(None, 'plotly', lambda: hospitalized_and_travelled(df_worldwide_cases))],
+        ],
+        "Understand effects of gender, age on Hospitalizations": [
+            [(None, 'pyplot', lambda: hospitalization_gender(df_detection_timeline)),
+             (None, 'pyplot', lambda: hospitalization_vs_age(df_detection_timeline))],
+            [(None, 'pyplot', lambda: virus_vs_age_group(df_detection_timeline)),
+             (None, 'pyplot', lambda: hospitalization_symptoms(df_detection_timeline))],
+        ],
+        "Comparison of US vs World": [
+            [(None, 'pyplot', lambda: US_world_timeline(df_detection_timeline)),
+             (None, 'pyplot', lambda: US_world_histogram(df_worldwide_cases)[0])],
+            [(None, 'pyplot', lambda: US_world_histogram(df_worldwide_cases)[1]),
+             (None, 'pyplot', lambda: US_world_histogram(df_worldwide_cases)[2])],
+        ],
+    }
 
-    # Data Cleaning
-    # The code below is commented as cleaned data is already present in the data folder.
-    # Uncomment them if you want to see them run
-    
-    # clean_data("Worldwide_Case_Detection_Timeline.csv")
-    # add_geospatial_attributes("Monkey_Pox_Cases_Worldwide.csv")
-    
-    # Load the cleaned data
-    df_worldwide_cases = read_data('Monkey_Pox_Cases_Worldwide_Cleaned.csv')
-    df_daily_cases = read_data('Daily_Country_Wise_Confirmed_Cases.csv')
-    df_detection_timeline = read_data('Worldwide_Case_Detection_Timeline_Cleaned.csv')
-
-    
-    # Generate all plots for the EDA
-
-    st.header("Geographical spread of the disease")
-    col1, col2 = st.columns(2)
-    with col1:
-        st.plotly_chart(cases_on_map(df_worldwide_cases, region="north america"))
-        st.plotly_chart(cases_on_map(df_worldwide_cases, region="south america"))
-        st.plotly_chart(cases_on_map(df_worldwide_cases, region="europe"))
-    with col2:
-        st.plotly_chart(cases_on_map(df_worldwide_cases, region="asia"))
-        st.plotly_chart(cases_on_map(df_worldwide_cases, region="africa"))
 
-    st.header("Case trends and timelines")
-    col1, col2 = st.columns(2)
-    with col1:
-        st.plotly_chart(case_trends(df_worldwide_cases, df_daily_cases))
-    with col2:
-        st.plotly_chart(daily_changes(df_worldwide_cases, df_daily_cases))
+def show_sections(sections: dict):
+    """
+    Lays out the given sections with a placeholder for every chart, then fills the
+    placeholders as the charts are built in worker threads. Charts are submitted in page
+    order, so the first section shows up first.
+    """
+    placeholders = []
+    for title, columns in sections.items():
+        st.header(title)
+        for column, charts in zip(st.columns(len(columns)), columns):
+            with column:
+                for heading, kind, build in charts:
+                    if heading:
+                        st.subheader(heading)
+                    placeholder = st.empty()
+                    placeholder.info("Loading chart...")
+                    placeholders.append((placeholder, kind, build))
 
-    col1, col2 = st.columns(2)
+    sequential = instrument.traces_memory()
+    with concurrent.futures.ThreadPoolExecutor(1 if sequential else CHART_WORKERS) as plotly_pool, \
+            concurrent.futures.ThreadPoolExecutor(1) as pyplot_pool:
+        pools = {'plotly': plotly_pool, 'pyplot': plotly_pool if sequential else pyplot_pool}
+        # The charts are built in the instrumentation run of this session, if any
+        futures = {pools[kind].submit(instrument.bind(build)): (placeholder, kind)
+                   for placeholder, kind, build in placeholders}
+        # Streamlit elements are only written from the script thread
+        for future in concurrent.futures.as_completed(futures):
+            placeholder, kind = futures[future]
+            try:
+                fig = future.result()
+            except Exception as e:
+                placeholder.error(f"Could not build the chart: {e}")
+                continue
+            if kind == 'plotly':
+                placeholder.plotly_chart(fig)
+            else:
+                placeholder.pyplot(fig)
 
-    with col1:
-        st.header("Most affected cities")
-        st.plotly_chart(cases_cities(df_detection_timeline))
-    with col2:
-        st.header("Most suspected cases")
-        st.plotly_chart(suspected_cases_bar(df_worldwide_cases))
 
-    st.header("Symptoms")
-    col1, col2 = st.columns(2)
-    with col1:
-        st.pyplot(symptoms_word_cloud(df_detection_timeline))
-    with col2:
-        st.plotly_chart(symptoms_distribution(df_detection_timeline))
-    
-    st.header("Correlations - Hospitalization and Travel")
+def show_diagnostics(run: int):
+    """
+    Shows the time and memory taken by each stage of the run, the state of the caches and
+    the recorded events for download
+    """
+    st.header("Diagnostics")
+    st.dataframe(instrument.summary(run), use_container_width=True)
+    info = cache.cache_info()
+    hits = sum(stats['hits'] for stats in info['functions'].values())
+    misses = sum(stats['misses'] for stats in info['functions'].values())
+    st.caption(f"Cache: {hits} hits, {misses} misses, {info['entries']} entries taking {info['bytes'] / 2 ** 20:.1f} MB. "
+               f"Images: {artifacts.stats()}")
     col1, col2 = st.columns(2)
     with col1:
-        st.plotly_chart(correlation_heatmap(df_worldwide_cases))
+        st.download_button("Download the events (JSON lines)", instrument.to_jsonl(run), file_name="events.jsonl")
     with col2:
-        st.plotly_chart(hospitalized_and_travelled(df_worldwide_cases))
+        st.download_button("Download the Chrome trace", instrument.to_chrome_trace(run), file_name="trace.json")
 
-    st.header("Understand effects of gender, age on Hospitalizations")
-    col1, col2 = st.columns(2)
-    with col1:
-        st.pyplot(hospitalization_gender(df_detection_timeline))
-        st.pyplot(hospitalization_vs_age(df_detection_timeline))
-    with col2:
-        st.pyplot(virus_vs_age_group(df_detection_timeline))
-        st.pyplot(hospitalization_symptoms(df_detection_timeline))
 
-    st.header("Comparison of US vs World")
-    col1, col2 = st.columns(2)
-    conf_fig, hosp_fig, trav_fig = US_world_histogram(df_worldwide_cases)
-    with col1:
-        st.pyplot(US_world_timeline(df_detection_timeline))
-        st.pyplot(conf_fig)
-    with col2:
-        st.pyplot(hosp_fig)
-        st.pyplot(trav_fig)
+if __name__=="__main__":
+    warnings.filterwarnings("ignore")
+
+    # This script runs the visualization suite on the cleaned data of the data folder, which
+    # `src.clean` and `src.ingest` write
+    st.set_page_config(page_title="MonkeyPox Analysis", layout="wide")
+    st.title("MonkeyPox: EDA and Analysis")
+
+    # The images in `plots/` are written in the background so that serving the charts never
+    # waits on the disk or on the image export
+    artifacts.set_mode('background')
+
+    # The time and memory taken by every stage of this run are recorded on demand, in a run
+    # of its own so that the other sessions are neither traced nor shown in its diagnostics
+    diagnostics = st.sidebar.checkbox("Diagnostics")
+    trace_memory = st.sidebar.checkbox("Trace memory (slower)", disabled=not diagnostics)
+    run = instrument.start_run(memory=trace_memory) if diagnostics else None
+    try:
+        # Load the cleaned data; loads and figures are cached across reruns and sessions
+        # (see `src.cache`), so only the first run reads the files and builds the figures
+        df_worldwide_cases = load_data('Monkey_Pox_Cases_Worldwide_Cleaned.csv')
+        df_daily_cases = load_data('Daily_Country_Wise_Confirmed_Cases.csv')
+        df_detection_timeline = load_data('Worldwide_Case_Detection_Timeline_Cleaned.csv')
+
+        # Only the sections picked in the sidebar are computed
+        sections = dashboard_sections(df_worldwide_cases, df_daily_cases, df_detection_timeline)
+        opened = st.sidebar.multiselect("Sections", list(sections), default=list(sections)[:1])
+        show_sections({title: sections[title] for title in sections if title in opened})
+
+        if diagnostics:
+            show_diagnostics(run)
+    finally:
+        # Also when streamlit stops the script for a rerun
+        if run is not None:
+            instrument.end_run(run)
+            instrument.clear(run)
@@ -0,0 +1,88 @@
+"""
+Vectorized parser for the `Age` column of the detection timeline.
+
+Ages are given as ranges (`20-69`), open ended values (`40+`) or single ages (`35`). Each
+distinct value is parsed once with a single regular expression and the results are mapped
+back to the rows through the factorized codes of the column.
+"""
+import numpy as np
+import pandas as pd
+
+from src.schema import NA_VALUES
+
+AGE_COLUMNS = ['Age_low', 'Age_high', 'Age_mid', 'Age_invalid']
+# Ages above it are data entry errors; they also would not fit the UInt8 columns
+MAX_AGE = 120
+
+# Matches a single age (`35`), a range (`20-69`) or an open ended age (`40+`)
+_AGE_PATTERN = r'^\s*(?P<low>\d+)\s*(?:-\s*(?P<high>\d+)|(?P<open>\+))?\s*$'
+
+
+def parse_age(age: pd.Series) -> pd.DataFrame:
+    """
+    Parses an `Age` column into its lower bound, upper bound and midpoint. A single age
+    gives equal bounds, an open ended age has no upper bound and its midpoint is its lower
+    bound, and the midpoint of a range is rounded up. Missing values, values which cannot
+    be parsed and ages above `MAX_AGE` are null; the latter two are also flagged in
+    `Age_invalid`.
+
+    Parameters
+    ----------
+    age: pd.Series
+        The `Age` column
+    Returns
+    -------
+        pd.DataFrame: The `Age_low`, `Age_high` and `Age_mid` columns as small nullable
+        integers and the boolean `Age_invalid` column, with the same index as `age`
+    """
+    assert isinstance(age, pd.Series)
+
+    if isinstance(age.dtype, pd.CategoricalDtype):
+        codes, uniques = age.cat.codes.to_numpy(), age.cat.categories
+    else:
+        codes, uniques = pd.factorize(age)
+    uniques = pd.Series(uniques, dtype=object).astype(str)
+    parts = uniques.str.extract(_AGE_PATTERN)
+    is_missing = uniques.str.strip().isin(NA_VALUES).to_numpy()
+
+    low = pd.to_numeric(parts['low']).to_numpy(dtype=float)
+    high = pd.to_numeric(parts['high']).to_numpy(dtype=float)
+    is_open = parts['open'].notna().to_numpy()
+    high = np.where(np.isnan(high) & ~is_open, low, high)
+    out_of_range = (low > MAX_AGE) | (high > MAX_AGE)
+    low, high = np.where(out_of_range, np.nan, low), np.where(out_of_range, np.nan, high)
+    mid = np.where(is_open, low, np.ceil((low + high) / 2))
+
+    parsed = {}
+    for column, values in zip(AGE_COLUMNS, [low, high, mid]):
+        # Code -1 (missing value) takes the trailing nan
+        parsed[column] = pd.array(np.append(values, np.nan)[codes], dtype='UInt8')
+    parsed['Age_invalid'] = np.append(np.isnan(low) & ~is_missing, False)[codes]
+    return pd.DataFrame(parsed, index=age.index)
+
+
+def ages_from_bounds(low: pd.Series, high: pd.Series) -> pd.DataFrame:
+    """
+    Rebuilds the columns of `parse_age` from the `Age_low` and `Age_high` columns of a
+    typed timeline (see `src.schema`), which has no `Age` column. Which ages could not be
+    parsed is not known anymore, so none are flagged in `Age_invalid`.
+
+    Parameters
+    ----------
+    low: pd.Series
+        The `Age_low` column
+    high: pd.Series
+        The `Age_high` column; null for open ended ages
+    Returns
+    -------
+        pd.DataFrame: The columns of `parse_age`, with the same index as `low`
+    """
+    assert isinstance(low, pd.Series) and isinstance(high, pd.Series)
+
+    low_values = low.to_numpy(dtype=float, na_value=np.nan)
+    high_values = high.to_numpy(dtype=float, na_value=np.nan)
+    mid = np.where(np.isnan(high_values), low_values, np.ceil((low_values + high_values) / 2))
+    parsed = {column: pd.array(values, dtype='UInt8')
+              for column, values in zip(AGE_COLUMNS, [low_values, high_values, mid])}
+    parsed['Age_invalid'] = np.zeros(len(low), dtype=bool)
+    return pd.DataFrame(parsed, index=low.index)
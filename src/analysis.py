@@ -1,11 +1,26 @@
 import numpy as np
 import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
 
+from src.cache import cached
+from src.cube import count_cube, query
+from src.dedup import duplicate_counts
+from src.derived import derive
+from src.instrument import instrumented
+from src.lazy import lazy_import
+from src.rules import GENDER_RULES, apply_rules
 from src.utils import *
 
+# The plotting libraries are imported when the first figure is built
+sns = lazy_import('seaborn')
+plt = lazy_import('matplotlib.pyplot')
 
+# Markers drawn for each age and hospitalisation status at most by hospitalization_vs_age
+MAX_POINTS = 50
+# Number of cases plotted by hospitalization_symptoms
+SYMPTOM_CASES = 50
+
+
+@instrumented('aggregate')
 def basic_analysis(df_daily_country_wise_confirmed_cases, df_monkey_pox_cases_worldwide,
                    df_worldwide_case_detection_timeline):
     """
@@ -23,9 +38,12 @@ def basic_analysis(df_daily_country_wise_confirmed_cases, df_monkey_pox_cases_wo
     print("Daily Country Wise confirmed cases Dataset shape", df_daily_country_wise_confirmed_cases.shape)
 
     '''Duplicates in World Case Detection Timeline Dataset'''
+    deduplicated = derive(df_worldwide_case_detection_timeline, 'deduplicated')
     print("Number of duplicate entries in the world wide case detection dataset",
-          df_worldwide_case_detection_timeline.duplicated().sum())
-    temp_Worldwide_Case_Detection_Timeline = df_worldwide_case_detection_timeline.drop_duplicates()
+          len(df_worldwide_case_detection_timeline) - len(deduplicated))
+    print(duplicate_counts(df_worldwide_case_detection_timeline, 'Country').head(10))
+    print(duplicate_counts(df_worldwide_case_detection_timeline, 'Date_confirmation').head(10))
+    temp_Worldwide_Case_Detection_Timeline = deduplicated
 
     '''Info about Worldwide_Case_Detection_Timeline'''
     print(temp_Worldwide_Case_Detection_Timeline.shape)
@@ -38,32 +56,29 @@ def basic_analysis(df_daily_country_wise_confirmed_cases, df_monkey_pox_cases_wo
     '''Printing out unique genders in our dataset'''
     print(temp_Worldwide_Case_Detection_Timeline['Gender'].unique())
     '''Dropping off the duplicates from worldwide_case_detection_timeline'''
-    temp_Worldwide_Case_Detection_Timeline = df_worldwide_case_detection_timeline.drop_duplicates()
+    temp_Worldwide_Case_Detection_Timeline = deduplicated
     print(temp_Worldwide_Case_Detection_Timeline.info())
     print(temp_Worldwide_Case_Detection_Timeline.Age.unique())
 
-    temp_Worldwide_Case_Detection_Timeline['Gender'] = temp_Worldwide_Case_Detection_Timeline['Gender'].str.strip()
-    temp_Worldwide_Case_Detection_Timeline['Gender'] = temp_Worldwide_Case_Detection_Timeline['Gender'].str.lower()
-    temp_Worldwide_Case_Detection_Timeline['Gender'] = temp_Worldwide_Case_Detection_Timeline['Gender'].replace(np.nan,
-                                                                                                                'NA')
+    temp_Worldwide_Case_Detection_Timeline = apply_rules(temp_Worldwide_Case_Detection_Timeline, GENDER_RULES,
+                                                         columns=['Gender'])
 
 
+@instrumented('derive')
 def clean_worldwide(df_worldwide_case_detection_timeline):
     """
-    Drops the duplicates in the worldwide case dataset and identifies unique genders in the dataset
+    Drops the duplicates in the worldwide case dataset and identifies unique genders in the dataset.
+    The result is computed once per dataset and shared, so it must not be modified in place
     params:df_worldwide_case_detection_timeline
     type:pandas.DataFrame
     returns a clean worldwide dataset
     """
     assert isinstance(df_worldwide_case_detection_timeline, pd.DataFrame)
-    temp_Worldwide_Case_Detection_Timeline = df_worldwide_case_detection_timeline.drop_duplicates()
-    temp_Worldwide_Case_Detection_Timeline['Gender'] = temp_Worldwide_Case_Detection_Timeline['Gender'].str.strip()
-    temp_Worldwide_Case_Detection_Timeline['Gender'] = temp_Worldwide_Case_Detection_Timeline['Gender'].str.lower()
-    temp_Worldwide_Case_Detection_Timeline['Gender'] = temp_Worldwide_Case_Detection_Timeline['Gender'].replace(np.nan,
-                                                                                                                'NA')
-    return temp_Worldwide_Case_Detection_Timeline
+    return derive(df_worldwide_case_detection_timeline, 'gender-normalized')
 
 
+@instrumented('figure')
+@cached
 def hospitalization_gender(df_worldwide_case_detection_timeline):
     """
     The function plots a graph between Hospitalization vs Gender
@@ -72,11 +87,14 @@ def hospitalization_gender(df_worldwide_case_detection_timeline):
     returns None
     """
     assert isinstance(df_worldwide_case_detection_timeline, pd.DataFrame)
-    temp_Worldwide_Case_Detection_Timeline = clean_worldwide(df_worldwide_case_detection_timeline)
+    # Count the cases from the count cube and normalize the genders the way clean_worldwide does
+    counts = query(count_cube(df_worldwide_case_detection_timeline), ['Gender', 'Hospitalised (Y/N/NA)'],
+                   deduplicated=True).dropna(subset=['Hospitalised (Y/N/NA)'])
+    counts = apply_rules(counts.astype({'Gender': object}), GENDER_RULES, columns=['Gender'])
+    counts = counts.groupby(['Gender', 'Hospitalised (Y/N/NA)'], observed=True, sort=False)['Count'].sum().reset_index()
     sns.set_style('whitegrid')
     fig, _ = plt.subplots(figsize=(12, 8))
-    ax = sns.countplot(x='Gender', hue='Hospitalised (Y/N/NA)', data=temp_Worldwide_Case_Detection_Timeline,
-                       palette='YlGn')
+    ax = sns.barplot(x='Gender', y='Count', hue='Hospitalised (Y/N/NA)', data=counts, palette='YlGn', errorbar=None)
     ax.tick_params(axis='x', rotation=90)
     for container in ax.containers:
         ax.bar_label(container)
@@ -85,6 +103,8 @@ def hospitalization_gender(df_worldwide_case_detection_timeline):
     return fig
 
 
+@instrumented('figure')
+@cached
 def virus_vs_age_group(df_worldwide_case_detection_timeline):
     """
     The function plots a graph  for Virus detected according to diff ages
@@ -93,17 +113,12 @@ def virus_vs_age_group(df_worldwide_case_detection_timeline):
     returns None
     """
     assert isinstance(df_worldwide_case_detection_timeline, pd.DataFrame)
-    temp_Worldwide_Case_Detection_Timeline = clean_worldwide(df_worldwide_case_detection_timeline)
-    temp_Worldwide_Case_Detection_Timeline['Age'] = temp_Worldwide_Case_Detection_Timeline['Age'].fillna('0')
-    temp_Worldwide_Case_Detection_Timeline['Age'] = temp_Worldwide_Case_Detection_Timeline['Age'].apply(
-        lambda x: np.array(x.split('-'), dtype=int).mean())
-    temp_Worldwide_Case_Detection_Timeline['Age'] = np.ceil(temp_Worldwide_Case_Detection_Timeline['Age']).astype(int)
-
-    temp_Worldwide_Case_Detection_Timeline.Age.value_counts().sort_values(ascending=False)
-    ages_selected = temp_Worldwide_Case_Detection_Timeline[temp_Worldwide_Case_Detection_Timeline['Age'] > 0]
+    # Count the cases of each age from the count cube, leaving out the missing ages
+    ages = query(count_cube(df_worldwide_case_detection_timeline), ['Age'], deduplicated=True).dropna()
+    ages_selected = ages[ages['Age'] > 0].astype(int)
 
     fig = plt.figure()
-    figure = sns.histplot(ages_selected, x='Age', bins=25)
+    figure = sns.histplot(ages_selected, x='Age', weights='Count', bins=25)
     patch_h = [patch.get_height() for patch in figure.patches]
     idx_tallest = np.argmax(patch_h)
     figure.patches[idx_tallest].set_facecolor('#a834a8')
@@ -112,26 +127,42 @@ def virus_vs_age_group(df_worldwide_case_detection_timeline):
     return fig
 
 
-def hospitalization_vs_age(df_worldwide_case_detection_timeline):
+@instrumented('figure')
+@cached
+def hospitalization_vs_age(df_worldwide_case_detection_timeline, kind='strip'):
     """
-    The function plots a graph  for Hospitalization vs Age
-    params:df_worldwide_case_detection_timeline
-    type:pandas.DataFrame
-    returns None
+    The function plots a graph  for Hospitalization vs Age, from the number of cases of each
+    age and hospitalisation status: a strip plot with at most MAX_POINTS markers for each of
+    them (kind='strip') or a heatmap of the counts (kind='heatmap')
+    params:df_worldwide_case_detection_timeline,kind
+    type:pandas.DataFrame,str
+    returns the figure
     """
-    assert isinstance(df_worldwide_case_detection_timeline, pd.DataFrame)
-    temp_Worldwide_Case_Detection_Timeline = clean_worldwide(df_worldwide_case_detection_timeline)
-    temp_Worldwide_Case_Detection_Timeline['Age'] = temp_Worldwide_Case_Detection_Timeline['Age'].fillna('0')
-    temp_Worldwide_Case_Detection_Timeline['Age'] = temp_Worldwide_Case_Detection_Timeline['Age'].apply(
-        lambda x: np.array(x.split('-'), dtype=int).mean())
-    temp_Worldwide_Case_Detection_Timeline['Age'] = np.ceil(temp_Worldwide_Case_Detection_Timeline['Age']).astype(int)
-    temp_Worldwide_Case_Detection_Timeline.Age.value_counts().sort_values(ascending=False)
-    figure = sns.catplot(temp_Worldwide_Case_Detection_Timeline, x='Age', y='Hospitalised (Y/N/NA)')
-    plt.title('Hospitalization according to different ages')
+    assert isinstance(df_worldwide_case_detection_timeline, pd.DataFrame) and kind in ('strip', 'heatmap')
+    # Count the cases of each age from the count cube; missing and unparseable ages are
+    # counted as 0
+    counts = query(count_cube(df_worldwide_case_detection_timeline), ['Age', 'Hospitalised (Y/N/NA)'],
+                   deduplicated=True).dropna(subset=['Hospitalised (Y/N/NA)'])
+    counts['Age'] = counts['Age'].fillna(0).astype(int)
+    counts['Hospitalised (Y/N/NA)'] = counts['Hospitalised (Y/N/NA)'].astype(object)
+    counts = counts.groupby(['Age', 'Hospitalised (Y/N/NA)'])['Count'].sum().reset_index()
+
+    if kind == 'heatmap':
+        fig = plt.figure(figsize=(12, 4))
+        ax = sns.heatmap(counts.pivot(index='Hospitalised (Y/N/NA)', columns='Age', values='Count').fillna(0),
+                         cmap='YlGn', cbar_kws={'label': 'Number of cases'})
+    else:
+        # Markers beyond MAX_POINTS would only pile up on the same spot
+        points = counts.loc[counts.index.repeat(np.minimum(counts['Count'], MAX_POINTS))]
+        fig = plt.figure()
+        ax = sns.stripplot(points, x='Age', y='Hospitalised (Y/N/NA)')
+    ax.set_title('Hospitalization according to different ages')
     plt.show()
-    return figure
+    return fig
 
 
+@instrumented('figure')
+@cached
 def hospitalization_symptoms(df_worldwide_case_detection_timeline):
     """
     The function plots a graph  for Hospitalization vs Symptoms
@@ -141,11 +172,16 @@ def hospitalization_symptoms(df_worldwide_case_detection_timeline):
     """
     assert isinstance(df_worldwide_case_detection_timeline, pd.DataFrame)
     temp_Worldwide_Case_Detection_Timeline = clean_worldwide(df_worldwide_case_detection_timeline)
-    temp_Worldwide_Case_Detection_Timeline = temp_Worldwide_Case_Detection_Timeline.sort_values('Symptoms',
-                                                                                                ascending=False).head(
-        50)
+    # Count the cases of each symptom and hospitalisation first, then keep the first 50
+    # cases in reverse alphabetical order of their symptoms
+    counts = temp_Worldwide_Case_Detection_Timeline.groupby(['Symptoms', 'Hospitalised (Y/N/NA)'], dropna=False,
+                                                             observed=True).size().reset_index(name='Count')
+    counts = counts.sort_values('Symptoms', ascending=False, kind='stable')
+    before = counts['Count'].cumsum() - counts['Count']
+    counts['Count'] = (SYMPTOM_CASES - before).clip(0, counts['Count'])
+    counts = counts[counts['Count'] > 0]
     f = plt.figure()
-    fig = sns.histplot(temp_Worldwide_Case_Detection_Timeline, x='Symptoms', hue='Hospitalised (Y/N/NA)')
+    fig = sns.histplot(counts, x='Symptoms', hue='Hospitalised (Y/N/NA)', weights='Count')
     fig.set_title('Hospitalization according to Symptoms')
     _, labels = plt.xticks()
     fig.set_xticklabels(labels, size=4, rotation=90)
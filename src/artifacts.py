@@ -0,0 +1,344 @@
+"""
+Writing of the figure images saved by `src.utils.save_fig`.
+
+Figures are written in one of three modes:
+
+- `off`: nothing is written
+- `sync`: the image is written before the figure is returned
+- `background`: a snapshot of the figure is taken and the image is written by a small
+  thread pool, so the caller never waits on the disk or on the plotly image export
+
+A snapshot is the plotly JSON of the figure or the pickle of a matplotlib figure, taken
+without its pyplot registration so that the writer threads never add figures to pyplot
+(where they would leak and become the current figure of the thread building plots). The hash
+of the plotly JSON, or of the rendered matplotlib image, is recorded per image in
+`plots/.hashes.json`, and images whose file is still the one written from identical
+contents are not written again. At most `MAX_PENDING` writes are queued in the background;
+a newer snapshot of the same image replaces the queued one and further images are dropped
+(and counted) rather than blocking. `flush` waits for the queued writes, e.g. at the end
+of a batch job.
+
+Several processes writing images at once (see `src.render`) must not record their hashes
+themselves, since each would replace the hashes file with its own copy: they write with
+`record=False` and hand the hashes to a single process which calls `record`.
+"""
+import io
+import os
+import sys
+import json
+import atexit
+import pickle
+import hashlib
+import threading
+import contextlib
+import concurrent.futures
+
+from src.instrument import bind, span
+
+MODES = ('off', 'sync', 'background')
+# Maximum number of images waiting to be written in the background
+MAX_PENDING = 32
+# Number of threads writing the images in the background
+WORKERS = 2
+
+HASHES_FILE = '.hashes.json'
+
+_mode = os.environ.get('MONKEYPOX_SAVE_FIGS', 'sync')
+_lock = threading.Lock()
+_executor = None
+# image path -> latest snapshot waiting to be written
+_pending = {}
+_futures = set()
+_hashes = {}
+_stats = {'written': 0, 'skipped': 0, 'dropped': 0, 'failed': 0}
+# Snapshots collected by `capture` instead of being written
+_captured = None
+
+
+def set_mode(mode: str):
+    """
+    Sets how figures are written
+
+    Parameters
+    ----------
+    mode: str
+        One of `off`, `sync` or `background`
+    """
+    assert mode in MODES
+    global _mode
+    _mode = mode
+
+
+def get_mode() -> str:
+    """
+    Returns how figures are written: `off`, `sync` or `background`
+    """
+    return _mode
+
+
+def _is_matplotlib(fig) -> bool:
+    # Checked without importing matplotlib: a matplotlib figure implies it was imported
+    figure = sys.modules.get('matplotlib.figure')
+    return figure is not None and isinstance(fig, figure.Figure)
+
+
+class _DetachedPickler(pickle.Pickler):
+    # Pickles matplotlib figures without the flag which registers them with pyplot again
+    # (and makes them the current figure) when they are unpickled
+    def reducer_override(self, obj):
+        if not _is_matplotlib(obj):
+            return NotImplemented
+        state = obj.__getstate__()
+        state.pop('_restore_to_pylab', None)
+        return object.__new__, (type(obj),), state
+
+
+def snapshot(fig) -> tuple:
+    """
+    Returns a snapshot of a figure, detached from it so that the figure can keep being
+    used (and rendered by the app) while its image is written
+
+    Parameters
+    ----------
+    fig: matplotlib.figure.Figure or plotly.graph_objects.Figure
+        The figure
+    Returns
+    -------
+        tuple: The kind of figure, `matplotlib` or `plotly`, and the serialized figure
+    """
+    if _is_matplotlib(fig):
+        data = io.BytesIO()
+        _DetachedPickler(data, protocol=pickle.HIGHEST_PROTOCOL).dump(fig)
+        return 'matplotlib', data.getvalue()
+    return 'plotly', fig.to_json().encode()
+
+
+def _render(kind: str, data: bytes, path: str, fig=None) -> bytes:
+    # `fig` is the live figure when it is written synchronously
+    image_format = os.path.splitext(path)[1][1:]
+    if kind == 'matplotlib':
+        image = io.BytesIO()
+        (fig or pickle.loads(data)).savefig(image, format=image_format)
+        return image.getvalue()
+    import plotly.io as pio
+    return (fig or pio.from_json(data.decode())).to_image(format=image_format)
+
+
+def _hashes_path(path: str) -> str:
+    return os.path.join(os.path.dirname(path), HASHES_FILE)
+
+
+def _load_hashes(path: str) -> dict:
+    hashes_path = _hashes_path(path)
+    if hashes_path not in _hashes:
+        try:
+            with open(hashes_path) as f:
+                _hashes[hashes_path] = json.load(f)
+        except (OSError, ValueError):
+            _hashes[hashes_path] = {}
+    return _hashes[hashes_path]
+
+
+def _file_key(path: str):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _is_current(path: str, digest: str) -> bool:
+    # The image is current if it is still the file written from an identical snapshot
+    with _lock:
+        recorded = _load_hashes(path).get(os.path.basename(path))
+    try:
+        return recorded is not None and recorded == [digest] + _file_key(path)
+    except OSError:
+        return False
+
+
+def _tmp_path(path: str) -> str:
+    # Unique per process and thread, so that concurrent writes of a file never share it
+    return f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+
+
+def record(path: str, digest: str):
+    """
+    Records the hash of an image written with `record=False` (see `write_snapshot`)
+
+    Parameters
+    ----------
+    path: str
+        The path of the image
+    digest: str
+        The hash returned when it was written
+    """
+    assert isinstance(path, str) and isinstance(digest, str)
+    with _lock:
+        hashes = _load_hashes(path)
+        hashes[os.path.basename(path)] = [digest] + _file_key(path)
+        hashes_path = _hashes_path(path)
+        tmp_path = _tmp_path(hashes_path)
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(hashes, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, hashes_path)
+        except OSError:
+            pass
+
+
+def _write(kind: str, data: bytes, path: str, fig=None, record_hash: bool = True):
+    with span('export', os.path.basename(path)):
+        return _write_image(kind, data, path, fig, record_hash)
+
+
+def _write_image(kind: str, data: bytes, path: str, fig=None, record_hash: bool = True):
+    # The pickle of a matplotlib figure is not stable across identical figures, so those
+    # are hashed on their rendered image; plotly figures are hashed on their JSON, which
+    # saves the image export when they did not change
+    image = _render(kind, data, path, fig) if kind == 'matplotlib' else None
+    digest = hashlib.sha1(image if image is not None else data).hexdigest()
+    if _is_current(path, digest):
+        with _lock:
+            _stats['skipped'] += 1
+        return None
+    if image is None:
+        image = _render(kind, data, path, fig)
+    tmp_path = _tmp_path(path)
+    with open(tmp_path, 'wb') as f:
+        f.write(image)
+    os.replace(tmp_path, path)
+    if record_hash:
+        record(path, digest)
+    with _lock:
+        _stats['written'] += 1
+    return digest
+
+
+def write_snapshot(kind: str, data: bytes, path: str, record: bool = True):
+    """
+    Writes the image of a figure snapshot unless the file is current
+
+    Parameters
+    ----------
+    kind: str
+        The kind of figure, `matplotlib` or `plotly`
+    data: bytes
+        The serialized figure (see `snapshot`)
+    path: str
+        The path of the image; its extension gives the format
+    record: bool
+        Whether to record the hash of the image; otherwise the caller passes it to `record`
+    Returns
+    -------
+        str: The hash of the image if it was written, None if it was current
+    """
+    assert kind in ('matplotlib', 'plotly') and isinstance(data, bytes) and isinstance(path, str)
+    return _write(kind, data, path, record_hash=record)
+
+
+def _write_pending(path: str):
+    with _lock:
+        kind, data = _pending.pop(path)
+    try:
+        _write(kind, data, path)
+    except Exception:
+        # A failed export must not take the app down; the next save retries it
+        with _lock:
+            _stats['failed'] += 1
+
+
+def save(fig, path: str, nested: bool = False):
+    """
+    Writes the image of a matplotlib or plotly figure according to the current mode
+
+    Parameters
+    ----------
+    fig: matplotlib.figure.Figure or plotly.graph_objects.Figure
+        The figure
+    path: str
+        The path of the image; its extension gives the format
+    nested: bool
+        Whether the figure was built for another figure, by a figure function called by
+        another one. `capture` leaves those out: their own function saves them.
+    """
+    assert isinstance(path, str)
+    global _executor
+
+    if _captured is not None:
+        if not nested:
+            _captured.append((path,) + snapshot(fig))
+        return
+    if _mode == 'off':
+        return
+    if _mode == 'sync':
+        if _is_matplotlib(fig):
+            _write('matplotlib', None, path, fig)
+        else:
+            _write('plotly', fig.to_json().encode(), path, fig)
+        return
+
+    kind, data = snapshot(fig)
+
+    with _lock:
+        if path in _pending:
+            # The queued write picks up the newer snapshot
+            _pending[path] = (kind, data)
+            return
+        if len(_pending) >= MAX_PENDING:
+            _stats['dropped'] += 1
+            return
+        _pending[path] = (kind, data)
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='save_fig')
+        # The export is recorded in the instrumentation run of the caller, if any
+        future = _executor.submit(bind(_write_pending), path)
+        _futures.add(future)
+        future.add_done_callback(_futures.discard)
+
+
+@contextlib.contextmanager
+def capture():
+    """
+    Context manager which collects the figures saved within it instead of writing them,
+    e.g. to write them from another process. Figures saved by nested figure functions are
+    left out, so that each image is captured by the call of its own function only.
+
+    Yields
+    ------
+        list: The `(path, kind, data)` snapshots of the saved figures
+    """
+    global _captured
+    previous, _captured = _captured, []
+    try:
+        yield _captured
+    finally:
+        _captured = previous
+
+
+def flush(timeout: float = None) -> bool:
+    """
+    Waits for the images queued in the background to be written
+
+    Parameters
+    ----------
+    timeout: float
+        Maximum number of seconds to wait, or None to wait for all of them
+    Returns
+    -------
+        bool: Whether all the queued images were written
+    """
+    with _lock:
+        futures = list(_futures)
+    _, not_done = concurrent.futures.wait(futures, timeout=timeout)
+    return not not_done
+
+
+def stats() -> dict:
+    """
+    Returns the number of images written, skipped because they were current, dropped
+    because the queue was full, and failed, plus the number still queued
+    """
+    with _lock:
+        return dict(_stats, pending=len(_pending))
+
+
+# Scripts running in the background mode still get all their images
+atexit.register(flush)
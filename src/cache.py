@@ -0,0 +1,128 @@
+"""
+Process-wide cache of data loads and figures for the dashboard.
+
+Streamlit re-runs `main.py` from the top on every interaction, but imported modules live
+as long as the server process, so results cached here are shared by every rerun and every
+session. Entries are keyed on the function, a cheap fingerprint of its dataframe arguments
+(see `src.derived.fingerprint`) and its other arguments, and evicted least recently used
+first once they take more than `MAX_BYTES`. Cached values are shared and must not be
+modified by the callers.
+"""
+import os
+import sys
+import functools
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from src.derived import fingerprint
+from src.utils import read_data
+
+# Memory budget of the cached values, in bytes
+MAX_BYTES = 256 * 2 ** 20
+# Estimated size of a figure, whose actual memory use is not cheap to measure
+FIGURE_BYTES = 2 * 2 ** 20
+
+_lock = threading.RLock()
+# key -> (value, size in bytes), least recently used first
+_entries = OrderedDict()
+_stats = {}
+
+
+def _arg_key(value):
+    if isinstance(value, pd.DataFrame):
+        return ('DataFrame', fingerprint(value))
+    if isinstance(value, (list, tuple)):
+        return tuple(_arg_key(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _arg_key(item)) for key, item in value.items()))
+    return value
+
+
+def _size(value) -> int:
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(np.sum(value.memory_usage(index=True, deep=True)))
+    if isinstance(value, tuple):
+        return sum(_size(item) for item in value)
+    if type(value).__module__.split('.')[0] in ('matplotlib', 'plotly', 'seaborn'):
+        return FIGURE_BYTES
+    return sys.getsizeof(value)
+
+
+def cached(func=None, key=None):
+    """
+    Decorator which caches the results of a function. It can be used bare (`@cached`) or
+    with a custom key function (`@cached(key=...)`) which receives the arguments of the
+    call and returns a hashable key for them.
+
+    Parameters
+    ----------
+    func: callable
+        The function to cache
+    key: callable
+        Optional function computing the key of a call from its arguments
+    """
+    assert func is None or callable(func)
+    assert key is None or callable(key)
+
+    def decorate(func):
+        name = f"{func.__module__}.{func.__qualname__}"
+        _stats.setdefault(name, {'hits': 0, 'misses': 0})
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if key is not None:
+                call_key = (name, key(*args, **kwargs))
+            else:
+                call_key = (name, _arg_key(args), _arg_key(kwargs))
+
+            with _lock:
+                if call_key in _entries:
+                    _stats[name]['hits'] += 1
+                    _entries.move_to_end(call_key)
+                    return _entries[call_key][0]
+                _stats[name]['misses'] += 1
+
+            value = func(*args, **kwargs)
+            with _lock:
+                _entries[call_key] = (value, _size(value))
+                # Evict the least recently used values, but keep the one just computed
+                while len(_entries) > 1 and sum(size for _, size in _entries.values()) > MAX_BYTES:
+                    _entries.popitem(last=False)
+            return value
+        return wrapper
+
+    return decorate(func) if func is not None else decorate
+
+
+def cache_info() -> dict:
+    """
+    Returns the hits and misses of every cached function along with the number and total
+    estimated size of the cached values
+    """
+    with _lock:
+        return {'functions': {name: dict(stats) for name, stats in _stats.items()},
+                'entries': len(_entries),
+                'bytes': sum(size for _, size in _entries.values())}
+
+
+def clear():
+    """
+    Drops every cached value and resets the counters
+    """
+    with _lock:
+        _entries.clear()
+        for stats in _stats.values():
+            stats.update(hits=0, misses=0)
+
+
+def _data_file_key(file: str, columns: list = None, use_cache: bool = True, typed: bool = False):
+    # The size and modification time of the file invalidate the cached data when it changes
+    stat = os.stat(os.path.join(os.getcwd(), 'data', file))
+    return (file, None if columns is None else tuple(columns), use_cache, typed, stat.st_size, stat.st_mtime_ns)
+
+
+# `read_data` whose results are shared until the file changes
+load_data = cached(read_data, key=_data_file_key)
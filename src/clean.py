@@ -1,39 +1,120 @@
+import os
+import zipfile
+import contextlib
+
 import pandas as pd
 
+from src.geocode import nominatim_resolver
+from src.instrument import instrumented
+from src.rules import TIMELINE_RULES, apply_rules
 from src.utils import read_data, write_data, add_lat_long
 
-def clean_data(file: str):
-    """
-    Cleans the Worldwide_Case_Detection_Timeline.csv by removing the nans with
-    NA, and performing integration for the required columns
+# Every raw column is read as a string, the cleaning rules decide what they hold
+RAW_CSV_OPTIONS = {'encoding': 'unicode_escape', 'dtype': str}
 
-    Writes the saved the data to a Worldwide_Case_Detection_Timeline_Cleaned.csv
+@instrumented('load')
+def open_raw(file: str, chunksize: int = None):
+    """
+    Reads a raw data file with every column as a string. The file can either be a CSV or
+    a `.csv.zip` archive containing a CSV of the same name.
 
     Parameters
     ----------
     file: str
-        Name of the file to be cleaned
+        Name of the file in the data folder
+    chunksize: int
+        If given, return an iterator over dataframes of at most `chunksize` rows
+    Returns
+    -------
+        pd.DataFrame or an iterator of pd.DataFrame
     """
-    assert isinstance(file, str)
+    assert isinstance(file, str) and (chunksize is None or (isinstance(chunksize, int) and chunksize > 0))
 
-    df = read_data(file)
+    path = os.path.join(os.getcwd(), 'data', file)
+    if not file.endswith('.zip'):
+        return pd.read_csv(path, **RAW_CSV_OPTIONS, chunksize=chunksize)
 
-    # All the columns are string so we can replace nans with NA
-    df = df.fillna('NA')
+    # The archive may contain other files as well, so pick the member named after it
+    archive = zipfile.ZipFile(path)
+    handle = archive.open(os.path.basename(file)[:-len('.zip')])
+    if chunksize is None:
+        with archive, handle:
+            return pd.read_csv(handle, **RAW_CSV_OPTIONS)
 
-    # Replace all values starting with 'm/M' as male and 'f/F' as female
-    df['Gender'] = df['Gender'].apply(lambda x: 'M' if (x.startswith('m') or x.startswith('M')) else x)
-    df['Gender'] = df['Gender'].apply(lambda x: 'F' if (x.startswith('f') or x.startswith('F')) else x)
+    def chunks():
+        with archive, handle:
+            yield from pd.read_csv(handle, **RAW_CSV_OPTIONS, chunksize=chunksize)
+    return chunks()
 
-    # Replace the spelling mistake in San Francisco's name
-    df.replace(to_replace='San Francsico', value='San Francisco', inplace=True)
+@instrumented('clean')
+def clean_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Applies the cleaning rules of the detection timeline (`src.rules.TIMELINE_RULES`) to the
+    raw detection timeline. Every rule works value by value so the rules give the same
+    result on the whole data or on any chunk of it.
 
-    # All the other columns either contain a valid string or NAs
+    Parameters
+    ----------
+    df: pd.DataFrame
+        The raw detection timeline, or a chunk of it
+    Returns
+    -------
+        pd.DataFrame: The cleaned dataframe
+    """
+    assert isinstance(df, pd.DataFrame) and 'Gender' in df.columns
+
+    # Missing values become nulls, genders M or F and misspelled names are fixed; all the
+    # other columns either contain a valid string or nulls
+    return apply_rules(df, TIMELINE_RULES)
+
+@instrumented('clean')
+def clean_data(file: str, chunksize: int = None):
+    """
+    Cleans the Worldwide_Case_Detection_Timeline.csv by turning every missing value
+    marker into a real null, and performing integration for the required columns
+
+    Writes the saved the data to a Worldwide_Case_Detection_Timeline_Cleaned.csv
+
+    With `chunksize` the file is streamed: it is read, cleaned and appended to the output
+    `chunksize` rows at a time, so memory stays flat however large the input is. The
+    output is byte-identical to cleaning the whole file at once.
+
+    Parameters
+    ----------
+    file: str
+        Name of the file to be cleaned, either the CSV or its `.csv.zip` archive
+    chunksize: int
+        Number of rows to clean at a time, or None to clean the whole file in memory
+    """
+    assert isinstance(file, str)
 
     output_file = file.split('.')[0] + "_Cleaned.csv"
-    write_data(df, output_file)
 
-def add_geospatial_attributes(file: str):
+    if chunksize is None:
+        write_data(clean_frame(open_raw(file)), output_file)
+        return
+
+    # Write to a temporary file so that readers never see a partially written output
+    output_path = os.path.join(os.getcwd(), 'data', output_file)
+    tmp_path = output_path + '.tmp'
+    chunks = open_raw(file, chunksize=chunksize)
+    try:
+        with open(tmp_path, 'w', newline='') as f:
+            header = True
+            for chunk in chunks:
+                clean_frame(chunk).to_csv(f, index=False, header=header)
+                header = False
+            if header:
+                # The file has no rows, and some pandas versions give no chunk at all for it
+                clean_frame(open_raw(file)).to_csv(f, index=False)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, output_path)
+
+@instrumented('clean')
+def add_geospatial_attributes(file: str, resolver=nominatim_resolver):
     """
     Adds the latitude and longitude for each country to the dataset and saves the data to
     a new file suffixed with `_Cleaned`
@@ -42,10 +123,13 @@ def add_geospatial_attributes(file: str):
     ----------
     file: str
         The name of the file to read data from
+    resolver: callable
+        The online geocoder used for countries which are not in the offline gazetteer,
+        or None to stay offline
     """
     assert isinstance(file, str)
     df = read_data(file)
-    df = add_lat_long(df)
+    df = add_lat_long(df, resolver=resolver)
     output_file = file.split('.')[0] + "_Cleaned.csv"
     write_data(df, output_file)
 
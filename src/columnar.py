@@ -0,0 +1,194 @@
+"""
+Binary columnar (Parquet) copies of the CSV files in the data folder.
+
+Each CSV gets a sibling `<file>.parquet` which carries the size, modification time and
+content hash of the CSV it was built from. `read_data` only serves the columnar copy
+while that key still matches the CSV on disk, so editing or replacing a CSV invalidates
+its cache automatically.
+"""
+import os
+import json
+import hashlib
+import functools
+import importlib.util
+
+import pandas as pd
+
+from src.lazy import lazy_import
+
+# pyarrow is imported at the first read or write of a columnar copy; the cache is simply
+# disabled without it
+pa = lazy_import('pyarrow')
+pq = lazy_import('pyarrow.parquet')
+
+# Key under which the source fingerprint is stored in the parquet schema metadata
+_KEY = b'monkeypox.source'
+# Version of the way `read_data` parses the CSVs; copies made by another version are stale
+READ_VERSION = 2
+
+
+@functools.lru_cache(maxsize=1)
+def available() -> bool:
+    """
+    Whether the columnar cache can be used, i.e. pyarrow is installed
+    """
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+def columnar_path(csv_path: str) -> str:
+    """
+    Returns the path of the columnar copy for a given CSV file
+
+    Parameters
+    ----------
+    csv_path: str
+        The path to the CSV file
+    Returns
+    -------
+        str: The path of the parquet file stored next to the CSV
+    """
+    assert isinstance(csv_path, str)
+    return csv_path + '.parquet'
+
+
+def content_hash(path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    Returns the sha1 hex digest of a file, read in chunks
+
+    Parameters
+    ----------
+    path: str
+        The path to the file
+    chunk_size: int
+        Number of bytes read at a time
+    Returns
+    -------
+        str: The hex digest
+    """
+    assert isinstance(path, str) and isinstance(chunk_size, int)
+
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_key(csv_path: str) -> dict:
+    """
+    Returns the fingerprint (size, mtime and content hash) of a CSV file, with the version
+    of the parsing of the data read from it
+
+    Parameters
+    ----------
+    csv_path: str
+        The path to the CSV file
+    Returns
+    -------
+        dict: The fingerprint of the file
+    """
+    assert isinstance(csv_path, str)
+
+    stat = os.stat(csv_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': content_hash(csv_path),
+            'version': READ_VERSION}
+
+
+def is_current(key: dict, csv_path: str) -> bool:
+    """
+    Whether a CSV file still matches a key returned by `source_key`: it was read by the
+    current version, and its size and modification time match, or only the modification
+    time differs (e.g. the file was touched or checked out again) and its content hash
+    matches
+
+    Parameters
+    ----------
+    key: dict
+        The stored key
+    csv_path: str
+        The path to the CSV file
+    Returns
+    -------
+        bool: Whether the file is unchanged
+    """
+    assert isinstance(key, dict) and isinstance(csv_path, str)
+
+    stat = os.stat(csv_path)
+    if key.get('version') != READ_VERSION or key['size'] != stat.st_size:
+        return False
+    return key['mtime_ns'] == stat.st_mtime_ns or key['sha1'] == content_hash(csv_path)
+
+
+def _write_table(table, path: str, key: dict):
+    """
+    Atomically writes an arrow table to `path` with the source key in its metadata
+    """
+    metadata = dict(table.schema.metadata or {})
+    metadata[_KEY] = json.dumps(key).encode()
+    table = table.replace_schema_metadata(metadata)
+
+    tmp_path = path + '.tmp'
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def store(df: pd.DataFrame, csv_path: str):
+    """
+    Stores the columnar copy of a dataframe which was read from / written to `csv_path`.
+    Failures to write the cache (read-only disk, unsupported column types) are ignored
+    since the CSV remains the source of truth.
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        The dataframe holding the contents of the CSV
+    csv_path: str
+        The path to the CSV file
+    """
+    assert isinstance(df, pd.DataFrame) and isinstance(csv_path, str)
+    if not available():
+        return
+
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        _write_table(table, columnar_path(csv_path), source_key(csv_path))
+    except (OSError, pa.ArrowException):
+        pass
+
+
+def load(csv_path: str, columns: list = None):
+    """
+    Loads the columnar copy of a CSV file if it is still valid
+
+    The copy is valid when the size and modification time of the CSV match the stored key.
+    If only the modification time differs (e.g. the file was touched or checked out again)
+    the content hash decides, and a matching copy gets its key refreshed.
+
+    Parameters
+    ----------
+    csv_path: str
+        The path to the CSV file
+    columns: list
+        Optional subset of columns to read
+    Returns
+    -------
+        pd.DataFrame: The cached data, or None if there is no valid columnar copy
+    """
+    assert isinstance(csv_path, str)
+    cache_path = columnar_path(csv_path)
+    if not available() or not os.path.exists(cache_path):
+        return None
+
+    try:
+        metadata = pq.read_schema(cache_path).metadata or {}
+        key = json.loads(metadata[_KEY])
+        if not is_current(key, csv_path):
+            return None
+        stat = os.stat(csv_path)
+        if key['mtime_ns'] != stat.st_mtime_ns:
+            key['mtime_ns'] = stat.st_mtime_ns
+            _write_table(pq.read_table(cache_path), cache_path, key)
+
+        return pq.read_table(cache_path, columns=columns).to_pandas()
+    except (OSError, KeyError, ValueError, pa.ArrowException):
+        return None
@@ -0,0 +1,207 @@
+"""
+Prebuilt country index mapping country names to their ISO alpha-2 / alpha-3 codes and
+continent.
+
+The index is built once from pycountry_convert, the bundled gazetteer and a table of
+aliases. Lookups over a column resolve each distinct name only once and map the results
+back to the rows, so normalizing a whole timeline costs as much as its distinct countries.
+"""
+import os
+import re
+import difflib
+import warnings
+import functools
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+# Names used in the datasets (or commonly elsewhere) which the ISO tables do not know
+ALIASES = {
+    'England': 'GB',
+    'Scotland': 'GB',
+    'Wales': 'GB',
+    'Northern Ireland': 'GB',
+    'UK': 'GB',
+    'Great Britain': 'GB',
+    'USA': 'US',
+    'US': 'US',
+    'United States of America': 'US',
+    'Kosovo': 'XK',
+    'Russian Federation': 'RU',
+    'Czechia': 'CZ',
+    'Turkiye': 'TR',
+    'Ivory Coast': 'CI',
+    'DRC': 'CD',
+    'DR Congo': 'CD',
+    'Congo Kinshasa': 'CD',
+    'Republic of Congo': 'CG',
+    'Congo Brazzaville': 'CG',
+    'Swaziland': 'SZ',
+    'Macedonia': 'MK',
+    'Burma': 'MM',
+    'Holland': 'NL',
+    'Vatican': 'VA',
+    'Macao': 'MO',
+    'Korea': 'KR',
+    'Republic of Korea': 'KR',
+    'UAE': 'AE',
+    'Saint Martin': 'MF',
+}
+
+# Codes which are missing from the ISO based tables
+_EXTRA_ALPHA3 = {'XK': 'XKX'}
+_EXTRA_CONTINENTS = {'XK': 'EU'}
+
+# How similar an unknown name must be to a known one to be taken as a misspelling of it
+MATCH_CUTOFF = 0.85
+
+INDEX_COLUMNS = ['Alpha2', 'Alpha3', 'Continent']
+
+
+def name_key(name: str) -> str:
+    """
+    Returns the key used to look up a place name: UTF-8 text which was decoded as latin-1
+    (e.g. `CuraÃ§ao`) is repaired, accents are stripped, `&` is spelled out and only the
+    lowercase letters and digits of the words other than `the` are kept, so that e.g.
+    `Bosnia And Herzegovina` and `Bosnia and Herzegovina` match.
+
+    Parameters
+    ----------
+    name: str
+        The place name
+    Returns
+    -------
+        str: The lookup key
+    """
+    assert isinstance(name, str)
+
+    try:
+        name = name.encode('latin-1').decode('utf-8')
+    except UnicodeError:
+        pass
+    name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode()
+    words = re.findall(r'[a-z0-9]+', name.lower().replace('&', ' and '))
+    return ''.join(word for word in words if word != 'the')
+
+
+@functools.lru_cache(maxsize=1)
+def country_index() -> tuple:
+    """
+    Returns the country index: one row per alpha-2 code with its alpha-3 code and
+    continent code, plus the dict from name key to alpha-2 code used to look names up.
+    The index is built on first use and shared afterwards.
+
+    Returns
+    -------
+        tuple: The `(codes, names)` pair of the index dataframe and the name dict
+    """
+    from pycountry_convert import (country_alpha2_to_continent_code, map_country_alpha2_to_country_alpha3,
+                                   map_country_name_to_country_alpha2)
+
+    alpha3 = {**map_country_alpha2_to_country_alpha3(), **_EXTRA_ALPHA3}
+    continents = dict(_EXTRA_CONTINENTS)
+    for alpha2 in alpha3:
+        try:
+            continents.setdefault(alpha2, country_alpha2_to_continent_code(alpha2))
+        except KeyError:
+            # e.g. Antarctica and the minor outlying islands have no continent
+            pass
+
+    names = {}
+    for name, alpha2 in map_country_name_to_country_alpha2().items():
+        names[name_key(name)] = alpha2
+    # `NA` is the code of Namibia, so it must not be read as a missing value
+    gazetteer = pd.read_csv(os.path.join(os.getcwd(), 'data', 'country_centroids.csv'), keep_default_na=False)
+    for name, alpha2 in gazetteer[['Country', 'Alpha2']].itertuples(index=False):
+        names.setdefault(name_key(name), alpha2)
+    for name, alpha2 in ALIASES.items():
+        names[name_key(name)] = alpha2
+    # The codes themselves are accepted as names too
+    for alpha2, code in alpha3.items():
+        names.setdefault(alpha2.lower(), alpha2)
+        names.setdefault(code.lower(), alpha2)
+
+    codes = pd.DataFrame({'Alpha3': pd.Series(alpha3), 'Continent': pd.Series(continents)})
+    codes.index.name = 'Alpha2'
+    return codes, names
+
+
+def to_alpha2(name: str):
+    """
+    Returns the alpha-2 code of a country name, allowing aliases and small misspellings
+
+    Parameters
+    ----------
+    name: str
+        The name of the country
+    Returns
+    -------
+        str: The alpha-2 code, or None if the name is unknown
+    """
+    assert isinstance(name, str)
+
+    _, names = country_index()
+    key = name_key(name)
+    if key in names:
+        return names[key]
+    match = difflib.get_close_matches(key, names.keys(), n=1, cutoff=MATCH_CUTOFF)
+    return names[match[0]] if match else None
+
+
+def lookup_countries(countries: pd.Series, report: bool = True) -> pd.DataFrame:
+    """
+    Looks up the alpha-2 code, alpha-3 code and continent code of every row of a column of
+    country names. Each distinct name is resolved once and the results are mapped back
+    through the factorized codes of the column.
+
+    Parameters
+    ----------
+    countries: pd.Series
+        The column with the country names
+    report: bool
+        Whether to warn about the names which could not be matched
+    Returns
+    -------
+        pd.DataFrame: The categorical `Alpha2`, `Alpha3` and `Continent` columns, null where
+        the country is unknown, with the same index as `countries`
+    """
+    assert isinstance(countries, pd.Series)
+
+    codes, _ = country_index()
+    if isinstance(countries.dtype, pd.CategoricalDtype):
+        # Categorical columns (see `src.schema`) are already factorized
+        row_codes, uniques = countries.cat.codes.to_numpy(), countries.cat.categories
+    else:
+        row_codes, uniques = pd.factorize(countries)
+    alpha2 = pd.Series([to_alpha2(str(name)) for name in uniques], dtype=object)
+
+    unmatched = [name for name, code in zip(uniques, alpha2) if code is None]
+    if report and unmatched:
+        warnings.warn(f"Could not match the countries: {', '.join(map(str, unmatched))}")
+
+    resolved = codes.reindex(alpha2.to_numpy()).rename_axis('Alpha2').reset_index()
+    columns = {}
+    for column in INDEX_COLUMNS:
+        # Factorize the per-name results and take their codes back to the rows; the
+        # trailing -1 is taken by the rows with a missing name (code -1)
+        value_codes, categories = pd.factorize(resolved[column])
+        value_codes = np.append(value_codes, -1)[row_codes]
+        columns[column] = pd.Categorical.from_codes(value_codes, categories=categories)
+    return pd.DataFrame(columns, index=countries.index)
+
+
+def unmatched_countries(countries: pd.Series) -> list:
+    """
+    Returns the distinct country names which cannot be matched to the index
+
+    Parameters
+    ----------
+    countries: pd.Series
+        The column with the country names
+    Returns
+    -------
+        list: The unmatched names
+    """
+    assert isinstance(countries, pd.Series)
+    return [name for name in countries.dropna().unique() if to_alpha2(str(name)) is None]
@@ -0,0 +1,204 @@
+"""
+Pre-aggregated count cube over the detection timeline.
+
+The cube holds the number of cases for every combination of the dimensions below that
+occurs in the timeline, plus whether the rows are duplicates of an earlier row. It is built
+in a single pass by combining the codes of every dimension into one integer key (or by
+grouping the codes themselves when there are too many combinations for 64 bits), and
+persisted as Parquet in `data/cubes/` keyed on the fingerprint of the timeline. Charts
+which count cases query the cube, so their cost depends on the number of distinct
+combinations rather than the number of cases.
+"""
+import os
+import glob
+
+import numpy as np
+import pandas as pd
+
+from src import columnar, dedup
+from src.derived import derive, fingerprint, register
+from src.instrument import instrumented
+
+DIMENSIONS = ['Date_confirmation', 'Country', 'City', 'Gender', 'Age', 'Hospitalised (Y/N/NA)',
+              'Travel_history (Y/N/NA)', 'Duplicate']
+
+CUBE_DIR = 'cubes'
+# Number of persisted cubes kept on disk, most recently written first
+MAX_PERSISTED = 8
+# Bound of the combined keys of the dimensions, beyond which the cube is grouped without them
+MAX_KEY = 2 ** 63
+
+
+def _codes(column: pd.Series):
+    # Categorical columns (see `src.schema`) are already factorized
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.cat.codes.to_numpy(), column.cat.categories
+    return pd.factorize(column)
+
+
+@instrumented('aggregate')
+def build_cube(df_detection_timeline: pd.DataFrame) -> pd.DataFrame:
+    """
+    Builds the count cube of a detection timeline. `Age` is the midpoint of the age range
+    of the case (see `src.age`) and `Duplicate` flags the rows which repeat an earlier row.
+
+    Parameters
+    ----------
+    df_detection_timeline: pd.DataFrame
+        The DataFrame which contains the case detection timeline
+    Returns
+    -------
+        pd.DataFrame: One row per combination of the dimensions, with the number of cases
+        in `Count`
+    """
+    assert isinstance(df_detection_timeline, pd.DataFrame)
+
+    dimensions = {column: df_detection_timeline[column] for column in DIMENSIONS[:-1] if column != 'Age'}
+    dimensions['Age'] = derive(df_detection_timeline, 'age-parsed')['Age_mid']
+    # A positional mask, since the index of the timeline need not be unique
+    dimensions['Duplicate'] = pd.Series(dedup.duplicated(derive(df_detection_timeline, 'row-hashes')))
+
+    codes, categories = zip(*[_codes(dimensions[column]) for column in DIMENSIONS])
+    # Code 0 is used for missing values
+    codes = [dimension_codes.astype(np.int64) + 1 for dimension_codes in codes]
+    radixes = [len(uniques) + 1 for uniques in categories]
+
+    if np.prod(np.array(radixes, dtype=float)) < MAX_KEY:
+        # Combine the codes of all the dimensions into a single mixed radix key
+        key = np.zeros(len(df_detection_timeline), dtype=np.int64)
+        for dimension_codes, radix in zip(codes, radixes):
+            key = key * radix + dimension_codes
+
+        keys, counts = np.unique(key, return_counts=True)
+        combinations = {}
+        for column, radix in reversed(list(zip(DIMENSIONS, radixes))):
+            combinations[column] = keys % radix
+            keys = keys // radix
+    else:
+        # Too many combinations for a 64 bit key: the codes are grouped as they are, slower
+        groups = pd.DataFrame(dict(zip(DIMENSIONS, codes))).value_counts(sort=False).sort_index()
+        combinations = {column: groups.index.get_level_values(column).to_numpy() for column in DIMENSIONS}
+        counts = groups.to_numpy()
+
+    cube = pd.DataFrame({column: pd.Categorical.from_codes(combinations[column] - 1, categories=uniques)
+                         for column, uniques in zip(DIMENSIONS, categories)})
+    # Numeric and boolean dimensions keep their own dtypes, which round trip through Parquet
+    cube['Age'] = cube['Age'].astype('UInt8')
+    cube['Duplicate'] = cube['Duplicate'].astype(bool)
+    cube['Count'] = counts
+    return cube
+
+
+def _cube_path(digest: str) -> str:
+    return os.path.join(os.getcwd(), 'data', CUBE_DIR, digest + '.parquet')
+
+
+def store_cube(cube: pd.DataFrame, digest: str):
+    """
+    Persists a cube under the fingerprint of its timeline and prunes the oldest cubes.
+    Failures are ignored since the cube can always be rebuilt.
+
+    Parameters
+    ----------
+    cube: pd.DataFrame
+        The count cube
+    digest: str
+        The fingerprint of the timeline (see `src.derived.fingerprint`)
+    """
+    assert isinstance(cube, pd.DataFrame) and isinstance(digest, str)
+    if not columnar.available():
+        return
+
+    path = _cube_path(digest)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        cube.to_parquet(path + '.tmp', index=False)
+        os.replace(path + '.tmp', path)
+        persisted = sorted(glob.glob(os.path.join(os.path.dirname(path), '*.parquet')), key=os.path.getmtime)
+        for old in persisted[:-MAX_PERSISTED]:
+            os.remove(old)
+    except (OSError, ValueError):
+        pass
+
+
+def load_cube(digest: str):
+    """
+    Loads the persisted cube of a timeline
+
+    Parameters
+    ----------
+    digest: str
+        The fingerprint of the timeline (see `src.derived.fingerprint`)
+    Returns
+    -------
+        pd.DataFrame: The count cube, or None if it was not persisted
+    """
+    assert isinstance(digest, str)
+
+    path = _cube_path(digest)
+    if not columnar.available() or not os.path.exists(path):
+        return None
+    try:
+        return pd.read_parquet(path)
+    except (OSError, ValueError):
+        return None
+
+
+@register('count-cube')
+def _count_cube(df: pd.DataFrame) -> pd.DataFrame:
+    digest = fingerprint(df)
+    cube = load_cube(digest)
+    if cube is None:
+        cube = build_cube(df)
+        store_cube(cube, digest)
+    return cube
+
+
+def count_cube(df_detection_timeline: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns the count cube of a detection timeline, from memory or disk if it was built
+    before. The cube is shared and must not be modified.
+
+    Parameters
+    ----------
+    df_detection_timeline: pd.DataFrame
+        The DataFrame which contains the case detection timeline
+    Returns
+    -------
+        pd.DataFrame: The count cube
+    """
+    assert isinstance(df_detection_timeline, pd.DataFrame)
+    return derive(df_detection_timeline, 'count-cube')
+
+
+@instrumented('aggregate')
+def query(cube: pd.DataFrame, by: list, where: dict = None, deduplicated: bool = False) -> pd.DataFrame:
+    """
+    Counts the cases in a cube grouped by some of its dimensions
+
+    Parameters
+    ----------
+    cube: pd.DataFrame
+        The count cube
+    by: list
+        The dimensions to group the counts by
+    where: dict
+        Optional filters, from dimension to the value or list of values to keep
+    deduplicated: bool
+        Whether to leave out the duplicate rows of the timeline
+    Returns
+    -------
+        pd.DataFrame: The `by` columns and the number of cases in `Count`; missing values
+        form their own groups
+    """
+    assert isinstance(cube, pd.DataFrame) and isinstance(by, list) and set(by) <= set(DIMENSIONS)
+    assert where is None or (isinstance(where, dict) and set(where) <= set(DIMENSIONS))
+
+    mask = np.ones(len(cube), dtype=bool)
+    if deduplicated:
+        mask &= ~cube['Duplicate'].to_numpy()
+    for column, values in (where or {}).items():
+        values = values if isinstance(values, list) else [values]
+        mask &= cube[column].isin(values).to_numpy()
+
+    return cube[mask].groupby(by, observed=True, dropna=False, sort=False)['Count'].sum().reset_index()
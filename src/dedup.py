@@ -0,0 +1,215 @@
+"""
+Row-hash deduplication index of the detection timeline.
+
+Every row is reduced to a 64-bit hash of its values (`row_hashes`) and duplicates are the
+rows whose hash was seen before (`duplicated`), a vectorized hash table probe instead of a
+comparison of every column. Two distinct rows share a hash with a probability of about
+n^2 / 2^65, i.e. 1e-4 for 50M rows.
+
+The hashes are computed once per dataframe, as part of its fingerprint (see
+`src.derived.fingerprint`), and those of the files in `INDEXED_FILES` are stored next to
+them in `<file>.rowhash` (raw little-endian uint64, one per row), with the key of the CSV
+they belong to and the dtypes of its columns in `<file>.rowhash.json`. `read_data` uses the
+stored hashes while the CSV is unchanged, and `src.ingest` extends them with the rows it
+appends (`append_index`), so loading and deduplicating the timeline never hashes it again.
+"""
+import io
+import os
+import json
+import contextlib
+
+import numpy as np
+import pandas as pd
+
+from src import columnar
+
+INDEXED_FILES = ['Worldwide_Case_Detection_Timeline_Cleaned.csv']
+INDEX_SUFFIX = '.rowhash'
+
+
+def row_hashes(df: pd.DataFrame) -> np.ndarray:
+    """
+    Returns a 64-bit hash of the values of every row of a dataframe; equal rows have equal
+    hashes whatever their index
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        The dataframe
+    Returns
+    -------
+        np.ndarray: One uint64 per row
+    """
+    assert isinstance(df, pd.DataFrame)
+    if len(df.columns) == 0:
+        return np.zeros(len(df), dtype=np.uint64)
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+
+def duplicated(hashes: np.ndarray, seen: np.ndarray = None) -> np.ndarray:
+    """
+    Flags the rows which repeat an earlier row, like `pd.DataFrame.duplicated`
+
+    Parameters
+    ----------
+    hashes: np.ndarray
+        The row hashes
+    seen: np.ndarray
+        Optional hashes of rows which come before, e.g. those of the rows already ingested
+    Returns
+    -------
+        np.ndarray: A boolean mask of the duplicate rows
+    """
+    mask = pd.Series(hashes).duplicated().to_numpy()
+    if seen is not None and len(seen):
+        mask = mask | pd.Series(hashes).isin(pd.Index(seen)).to_numpy()
+    return mask
+
+
+def duplicate_counts(df: pd.DataFrame, by: str) -> pd.Series:
+    """
+    Counts the duplicate rows of a dataframe per value of a column, e.g. per country or
+    per confirmation date
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        The dataframe
+    by: str
+        The column to count the duplicates by
+    Returns
+    -------
+        pd.Series: The number of duplicate rows of every value with some, most first
+    """
+    assert isinstance(df, pd.DataFrame) and by in df.columns
+
+    # Imported here as the derived transforms fingerprint the dataframes with `row_hashes`
+    from src.derived import derive
+
+    mask = duplicated(derive(df, 'row-hashes'))
+    return df.loc[mask, by].value_counts(dropna=False).rename('Duplicates')
+
+
+def is_indexed(file: str) -> bool:
+    """
+    Whether the row hashes of a data file are stored next to it
+    """
+    return os.path.basename(file) in INDEXED_FILES
+
+
+def _index_path(csv_path: str) -> str:
+    return csv_path + INDEX_SUFFIX
+
+
+def _read_meta(csv_path: str):
+    try:
+        with open(_index_path(csv_path) + '.json') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_meta(csv_path: str, meta: dict):
+    path = _index_path(csv_path) + '.json'
+    with open(path + '.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(path + '.tmp', path)
+
+
+def load_index(csv_path: str):
+    """
+    Memory maps the stored row hashes of a CSV file if they are still valid, i.e. the CSV
+    did not change since (see `src.columnar.load`)
+
+    Parameters
+    ----------
+    csv_path: str
+        The path to the CSV file
+    Returns
+    -------
+        np.ndarray: The row hashes, or None
+    """
+    assert isinstance(csv_path, str)
+
+    meta = _read_meta(csv_path)
+    if meta is None or not columnar.is_current(meta['key'], csv_path):
+        return None
+    try:
+        if meta['rows'] == 0:
+            return np.zeros(0, dtype=np.uint64)
+        return np.memmap(_index_path(csv_path), dtype='<u8', mode='r', shape=(meta['rows'],))
+    except (OSError, ValueError):
+        return None
+
+
+def store_index(hashes: np.ndarray, df: pd.DataFrame, csv_path: str):
+    """
+    Stores the row hashes of a dataframe read from a CSV file next to it. Failures are
+    ignored since the hashes can always be computed again.
+
+    Parameters
+    ----------
+    hashes: np.ndarray
+        The row hashes of `df`
+    df: pd.DataFrame
+        The dataframe holding the contents of the CSV
+    csv_path: str
+        The path to the CSV file
+    """
+    assert isinstance(df, pd.DataFrame) and len(hashes) == len(df)
+
+    path = _index_path(csv_path)
+    try:
+        np.asarray(hashes, dtype='<u8').tofile(path + '.tmp')
+        os.replace(path + '.tmp', path)
+        _write_meta(csv_path, {'key': columnar.source_key(csv_path), 'rows': len(df),
+                               'dtypes': {column: str(dtype) for column, dtype in df.dtypes.items()}})
+    except OSError:
+        pass
+
+
+def append_index(csv_path: str, df: pd.DataFrame):
+    """
+    Extends the stored row hashes of a CSV file with rows which were just appended to it.
+    The stored hashes must have been valid before the rows were appended (see
+    `load_index`). If they were not, or the new rows change the dtype of a column of the
+    file (e.g. the first text in a column which was empty), the stored hashes are dropped
+    and computed at the next load.
+
+    Parameters
+    ----------
+    csv_path: str
+        The path to the CSV file
+    df: pd.DataFrame
+        The rows appended to the CSV
+    Returns
+    -------
+        np.ndarray: A boolean mask of the appended rows which repeat an earlier row, or None
+        if there are no stored hashes
+    """
+    assert isinstance(csv_path, str) and isinstance(df, pd.DataFrame)
+
+    meta = _read_meta(csv_path)
+    if meta is None or not os.path.exists(_index_path(csv_path)):
+        return None
+    seen = np.fromfile(_index_path(csv_path), dtype='<u8', count=meta['rows'])
+
+    # The rows as `read_data` reads them back from the whole file, with its dtypes
+    try:
+        df = pd.read_csv(io.BytesIO(df.to_csv(index=False).encode()), encoding='unicode_escape',
+                         low_memory=False, dtype=meta['dtypes'])
+    except (ValueError, TypeError, OverflowError):
+        # The dtypes of the whole file change, and so do the hashes of its earlier rows
+        with contextlib.suppress(OSError):
+            os.remove(_index_path(csv_path) + '.json')
+        return None
+    hashes = row_hashes(df)
+    try:
+        with open(_index_path(csv_path), 'r+b') as f:
+            f.truncate(meta['rows'] * 8)
+            f.seek(0, os.SEEK_END)
+            f.write(np.asarray(hashes, dtype='<u8').tobytes())
+        _write_meta(csv_path, dict(meta, key=columnar.source_key(csv_path), rows=meta['rows'] + len(df)))
+    except OSError:
+        return None
+    return duplicated(hashes, seen)
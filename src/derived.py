@@ -0,0 +1,233 @@
+"""
+Memoized derived datasets.
+
+Transforms which several analyses apply to the same dataset (dropping duplicates,
+normalizing genders, parsing ages, ...) are registered here by name with `@register`.
+`derive(df, name)` computes a transform once per input fingerprint and hands the same
+result to every caller afterwards, so the results must be treated as read-only: take a
+(shallow) copy before adding or changing columns.
+
+Entries are evicted least recently used first once they take more than `MAX_BYTES`, and
+`invalidate` drops them explicitly, e.g. after a dataframe was modified in place.
+"""
+import hashlib
+import weakref
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from src import dedup
+from src.age import ages_from_bounds, parse_age
+from src.instrument import span
+from src.rules import GENDER_RULES, apply_rules
+
+# Memory budget of the memoized results, in bytes
+MAX_BYTES = 512 * 2 ** 20
+
+_transforms = {}
+# (fingerprint, name) -> (result, size in bytes), least recently used first
+_results = OrderedDict()
+# id of a live dataframe -> (weak reference, fingerprint)
+_fingerprints = {}
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+# Transforms can be derived from several threads (see `main.py`); a result being computed
+# holds the lock of its key, so that it is computed only once
+_lock = threading.RLock()
+_computing = {}
+
+
+def register(name: str):
+    """
+    Decorator which registers a function `df -> derived data` as the transform `name`
+
+    Parameters
+    ----------
+    name: str
+        The name of the transform
+    """
+    assert isinstance(name, str)
+
+    def add_transform(func):
+        assert callable(func)
+        _transforms[name] = func
+        return func
+    return add_transform
+
+
+def transforms() -> list:
+    """
+    Returns the names of the registered transforms
+    """
+    return sorted(_transforms)
+
+
+def _forget(key: int):
+    with _lock:
+        _fingerprints.pop(key, None)
+
+
+def fingerprint(df: pd.DataFrame, row_hashes: np.ndarray = None) -> str:
+    """
+    Returns a fingerprint of the contents of a dataframe: a hash over its columns, dtypes,
+    index and row hashes (see `src.dedup`), which are memoized as the transform
+    `row-hashes`. It is computed once per dataframe object and remembered for as long as
+    the dataframe is alive, so dataframes are expected not to be modified in place (call
+    `invalidate` if they are).
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        The dataframe
+    row_hashes: np.ndarray
+        Optional row hashes of `df` computed beforehand, e.g. stored ones
+    Returns
+    -------
+        str: The hex digest of the contents
+    """
+    assert isinstance(df, pd.DataFrame)
+
+    key = id(df)
+    with _lock:
+        ref, digest = _fingerprints.get(key, (None, None))
+    if ref is not None and ref() is df:
+        return digest
+
+    if row_hashes is None:
+        row_hashes = dedup.row_hashes(df)
+    digest = hashlib.sha1()
+    digest.update(repr((list(df.columns), [str(dtype) for dtype in df.dtypes], df.shape)).encode())
+    digest.update(pd.util.hash_pandas_object(df.index).to_numpy().tobytes())
+    digest.update(np.asarray(row_hashes).tobytes())
+    digest = digest.hexdigest()
+
+    with _lock:
+        _store((digest, 'row-hashes'), row_hashes)
+        _fingerprints[key] = (weakref.ref(df), digest)
+    weakref.finalize(df, _forget, key)
+    return digest
+
+
+def _size(result) -> int:
+    if isinstance(result, (pd.DataFrame, pd.Series)):
+        return int(np.sum(result.memory_usage(index=True, deep=False)))
+    # Memory mapped arrays live on disk
+    if isinstance(result, np.ndarray) and not isinstance(result, np.memmap):
+        return result.nbytes
+    if isinstance(result, tuple):
+        return sum(_size(item) for item in result)
+    return 0
+
+
+def _store(key: tuple, result):
+    _results[key] = (result, _size(result))
+    # Evict the least recently used results, but always keep the one just stored
+    while len(_results) > 1 and sum(size for _, size in _results.values()) > MAX_BYTES:
+        _results.popitem(last=False)
+        _stats['evictions'] += 1
+
+
+def _hit(key: tuple):
+    _stats['hits'] += 1
+    _results.move_to_end(key)
+    return _results[key][0]
+
+
+def derive(df: pd.DataFrame, name: str):
+    """
+    Returns the result of the transform `name` applied to `df`, computing it only if it
+    was not computed for a dataframe with the same fingerprint before. The result is shared
+    and must not be modified.
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        The input dataframe
+    name: str
+        The name of a registered transform
+    Returns
+    -------
+        The derived data
+    """
+    assert isinstance(df, pd.DataFrame) and name in _transforms
+
+    key = (fingerprint(df), name)
+    with _lock:
+        if key in _results:
+            return _hit(key)
+        key_lock = _computing.setdefault(key, threading.Lock())
+    with key_lock:
+        with _lock:
+            # Another thread may have computed it in the meantime
+            if key in _results:
+                return _hit(key)
+            _stats['misses'] += 1
+
+        try:
+            with span('derive', name, rows=len(df)):
+                result = _transforms[name](df)
+            with _lock:
+                _store(key, result)
+        finally:
+            # Also when the transform fails, so that the key does not keep its lock forever
+            with _lock:
+                _computing.pop(key, None)
+    return result
+
+
+def invalidate(df: pd.DataFrame = None):
+    """
+    Drops the memoized results of a dataframe, or all of them
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        The dataframe whose results to drop, or None to drop everything
+    """
+    assert df is None or isinstance(df, pd.DataFrame)
+
+    with _lock:
+        if df is None:
+            _results.clear()
+            _fingerprints.clear()
+            return
+
+        digest = fingerprint(df)
+        for key in [key for key in _results if key[0] == digest]:
+            del _results[key]
+        _forget(id(df))
+
+
+def cache_info() -> dict:
+    """
+    Returns the number of hits, misses and evictions, and the number and size of the
+    memoized results
+    """
+    with _lock:
+        return dict(_stats, entries=len(_results), bytes=sum(size for _, size in _results.values()))
+
+
+@register('row-hashes')
+def _row_hashes(df: pd.DataFrame) -> np.ndarray:
+    # Only computed here once evicted: fingerprinting a dataframe memoizes its row hashes
+    return dedup.row_hashes(df)
+
+
+@register('deduplicated')
+def _deduplicated(df: pd.DataFrame) -> pd.DataFrame:
+    # Same rows as `df.drop_duplicates()`, found by probing the row hashes
+    return df[~dedup.duplicated(derive(df, 'row-hashes'))]
+
+
+@register('gender-normalized')
+def _gender_normalized(df: pd.DataFrame) -> pd.DataFrame:
+    return apply_rules(derive(df, 'deduplicated'), GENDER_RULES, columns=['Gender'])
+
+
+@register('age-parsed')
+def _age_parsed(df: pd.DataFrame) -> pd.DataFrame:
+    if 'Age' not in df.columns:
+        # A typed timeline only has the bounds of the ages (see `src.schema`)
+        return ages_from_bounds(df['Age_low'], df['Age_high'])
+    return parse_age(df['Age'])
@@ -0,0 +1,151 @@
+"""
+Geocoding of country names to the latitude and longitude of their centre.
+
+Names are resolved by three backends, in order:
+
+1. an offline gazetteer of country centroids bundled in `data/country_centroids.csv`
+2. a persistent on-disk cache of names looked up online before (`data/geocode_cache.json`),
+   including those which could not be resolved; delete it to look them up again
+3. an online resolver, Nominatim by default
+
+The online resolver is any callable mapping a name to a `(lat, lon)` tuple or None, so it
+can be replaced by a local stub, or disabled by passing `resolver=None`.
+"""
+import os
+import json
+import functools
+
+import numpy as np
+import pandas as pd
+
+from src.countries import name_key, to_alpha2
+
+GAZETTEER_FILE = 'country_centroids.csv'
+CACHE_FILE = 'geocode_cache.json'
+
+
+def _data_path(file: str) -> str:
+    return os.path.join(os.getcwd(), 'data', file)
+
+
+@functools.lru_cache(maxsize=None)
+def _load_gazetteer(path: str) -> dict:
+    # `NA` is the code of Namibia, so it must not be read as a missing value
+    gazetteer = pd.read_csv(path, keep_default_na=False)
+    centroids = {}
+    for country, alpha2, lat, lon in gazetteer[['Country', 'Alpha2', 'lat', 'lon']].itertuples(index=False):
+        centroids[name_key(country)] = (float(lat), float(lon))
+        # The centroid of a sovereign country takes precedence over its constituent countries
+        centroids.setdefault(alpha2.lower(), (float(lat), float(lon)))
+    return centroids
+
+
+def gazetteer() -> dict:
+    """
+    Returns the bundled gazetteer as a dict from name key (or lowercase alpha-2 code) to
+    the `(lat, lon)` of the country centroid
+    """
+    return _load_gazetteer(_data_path(GAZETTEER_FILE))
+
+
+def load_cache() -> dict:
+    """
+    Returns the names looked up online before, as a dict from name to `(lat, lon)`, or to
+    None if the name could not be resolved
+    """
+    path = _data_path(CACHE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return {name: None if location is None else tuple(location) for name, location in json.load(f).items()}
+
+
+def save_cache(cache: dict):
+    """
+    Writes the online lookups to the on-disk cache. Failures are ignored since the cache
+    only saves network calls.
+
+    Parameters
+    ----------
+    cache: dict
+        A dict from name to `(lat, lon)`, or to None for the names which could not be resolved
+    """
+    assert isinstance(cache, dict)
+
+    path = _data_path(CACHE_FILE)
+    try:
+        with open(path + '.tmp', 'w') as f:
+            json.dump(cache, f, indent=1, sort_keys=True)
+        os.replace(path + '.tmp', path)
+    except OSError:
+        pass
+
+
+@functools.lru_cache(maxsize=1)
+def _nominatim():
+    from geopy.geocoders import Nominatim
+    return Nominatim(user_agent='Vis')
+
+
+def nominatim_resolver(name: str):
+    """
+    Geocodes a name with Nominatim. This needs network access.
+
+    Parameters
+    ----------
+    name: str
+        The place name
+    Returns
+    -------
+        tuple: The `(lat, lon)` of the place, or None if it could not be resolved
+    """
+    assert isinstance(name, str)
+    try:
+        location = _nominatim().geocode(name)
+    except Exception:
+        return None
+    return None if location is None else (location.latitude, location.longitude)
+
+
+def geocode(names, resolver=nominatim_resolver) -> dict:
+    """
+    Resolves each distinct name to the latitude and longitude of its centre. Names are
+    looked up in the gazetteer first, then in the on-disk cache and only then online.
+    New online results, including the names which could not be resolved, are added to the
+    cache, so each name is only sent once.
+
+    Parameters
+    ----------
+    names: iterable of str
+        The names to geocode
+    resolver: callable
+        The online resolver, or None to stay offline
+    Returns
+    -------
+        dict: A dict from name to `(lat, lon)`, or `(nan, nan)` if it could not be resolved
+    """
+    assert resolver is None or callable(resolver)
+
+    centroids = gazetteer()
+    cache = None
+    locations = {}
+    for name in set(names):
+        assert isinstance(name, str)
+        location = centroids.get(name_key(name))
+        if location is None:
+            # Aliases and misspellings are resolved through the country index
+            alpha2 = to_alpha2(name)
+            location = None if alpha2 is None else centroids.get(alpha2.lower())
+        if location is None:
+            if cache is None:
+                cache = load_cache()
+                cached_names = len(cache)
+            if name not in cache and resolver is not None:
+                resolved = resolver(name)
+                cache[name] = None if resolved is None else tuple(resolved)
+            location = cache.get(name)
+        locations[name] = location if location is not None else (np.nan, np.nan)
+
+    if cache is not None and len(cache) > cached_names:
+        save_cache(cache)
+    return locations
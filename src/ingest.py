@@ -0,0 +1,313 @@
+"""
+Incremental ingest of the detection timeline.
+
+The raw timeline only ever grows by new rows at its end, so instead of cleaning the whole
+history again, `ingest` remembers how far it read (a byte offset into the raw CSV, with
+hashes of the bytes around it to detect a file which was rewritten rather than appended
+to) and only cleans the rows after it. They are appended to the cleaned CSV, and the
+aggregates kept alongside the watermark - cases per country, per day and country, and per
+symptom - are updated with the counts of the new rows. Their row hashes are appended to the
+deduplication index of the cleaned timeline (see `src.dedup`), which tells how many of them
+repeat rows already ingested.
+
+The watermark and the aggregates are stored together in `<cleaned file>.ingest.json`,
+replaced atomically once the new rows are appended: it is the commit point of an ingest,
+and rows appended by an interrupted ingest are truncated by the next one. Without a valid
+state, the timeline is rebuilt from scratch.
+
+`update_geospatial_attributes` does the same for the worldwide cases table, which is
+replaced daily: only the countries which are not in the cleaned table yet are geocoded.
+"""
+import os
+import io
+import json
+import hashlib
+
+import pandas as pd
+
+from src import dedup
+from src.clean import RAW_CSV_OPTIONS, clean_frame
+from src.derived import derive
+from src.geocode import nominatim_resolver
+from src.instrument import instrumented, span
+from src.symptoms import count_symptoms
+from src.utils import add_lat_long, read_data, write_data
+
+TIMELINE = 'Worldwide_Case_Detection_Timeline.csv'
+WORLDWIDE = 'Monkey_Pox_Cases_Worldwide.csv'
+STATE_SUFFIX = '.ingest.json'
+# Number of bytes hashed at the start of the raw file and before the watermark
+CHECK_BYTES = 4096
+GEO_COLUMNS = ['Alpha2', 'Alpha3', 'Continent', 'lat', 'lon']
+
+
+def _path(file: str) -> str:
+    return os.path.join(os.getcwd(), 'data', file)
+
+
+def cleaned_name(file: str) -> str:
+    """
+    Returns the name of the cleaned file of a raw file, as written by `clean_data`
+    """
+    return file.split('.')[0] + "_Cleaned.csv"
+
+
+def _state_path(file: str) -> str:
+    return _path(cleaned_name(file)) + STATE_SUFFIX
+
+
+def load_state(file: str = TIMELINE):
+    """
+    Returns the ingest state of a raw file: the watermark and the aggregates, or None if
+    it was never ingested
+    """
+    try:
+        with open(_state_path(file)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_state(file: str, state: dict):
+    path = _state_path(file)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(path + '.tmp', path)
+
+
+def _hash_range(path: str, start: int, end: int) -> str:
+    with open(path, 'rb') as f:
+        f.seek(max(start, 0))
+        return hashlib.sha1(f.read(max(end - max(start, 0), 0))).hexdigest()
+
+
+def _watermark(path: str, offset: int) -> dict:
+    return {'offset': offset,
+            'head': _hash_range(path, 0, min(CHECK_BYTES, offset)),
+            'tail': _hash_range(path, offset - CHECK_BYTES, offset)}
+
+
+def _appended_to(path: str, watermark: dict) -> bool:
+    # The file still starts with the bytes which were ingested
+    offset = watermark['offset']
+    return os.path.getsize(path) >= offset and _watermark(path, offset) == watermark
+
+
+def _read_rows(path: str, offset: int) -> tuple:
+    # The complete rows after `offset`, with the header, and the offset after them
+    with open(path, 'rb') as f:
+        header = f.readline()
+        f.seek(max(offset, len(header)))
+        rows = f.read()
+    rows = rows[:rows.rfind(b'\n') + 1]
+    return header + rows, max(offset, len(header)) + len(rows)
+
+
+def _as_read(df: pd.DataFrame) -> pd.DataFrame:
+    # The cleaned rows the way `read_data` reads them back from the cleaned file
+    return pd.read_csv(io.BytesIO(df.to_csv(index=False).encode()), encoding='unicode_escape', low_memory=False)
+
+
+def aggregate(df: pd.DataFrame) -> dict:
+    """
+    Counts the cases of cleaned timeline rows per country, per day and country, and per
+    symptom. The counts of two sets of rows add up to the counts of their union (see
+    `merge`).
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        Cleaned rows of the detection timeline
+    Returns
+    -------
+        dict: `country_totals` {country: cases}, `daily_counts` {date: {country: cases}}
+        and `symptom_counts` {symptom: cases}
+    """
+    assert isinstance(df, pd.DataFrame)
+
+    daily = {}
+    for (date, country), count in df.groupby(['Date_confirmation', 'Country']).size().items():
+        daily.setdefault(str(date), {})[country] = int(count)
+    symptoms = count_symptoms(df['Symptoms'])
+    return {'country_totals': {country: int(count) for country, count in df['Country'].value_counts().items()},
+            'daily_counts': daily,
+            'symptom_counts': dict(zip(symptoms['Symptoms'], symptoms['Count'].astype(int).tolist()))}
+
+
+def _add(total: dict, delta: dict) -> dict:
+    for key, value in delta.items():
+        if isinstance(value, dict):
+            _add(total.setdefault(key, {}), value)
+        else:
+            total[key] = total.get(key, 0) + value
+    return total
+
+
+def merge(aggregates: dict, delta: dict) -> dict:
+    """
+    Adds the aggregates of new rows (see `aggregate`) to running aggregates, in place
+    """
+    assert isinstance(aggregates, dict) and isinstance(delta, dict)
+    return _add(aggregates, delta)
+
+
+@instrumented('clean')
+def rebuild(file: str = TIMELINE) -> dict:
+    """
+    Cleans a whole raw timeline, like `clean_data`, and records its watermark and
+    aggregates for the following ingests
+
+    Parameters
+    ----------
+    file: str
+        The name of the raw timeline
+    Returns
+    -------
+        dict: The number of rows cleaned, the watermark, the number of duplicate rows and
+        whether it was rebuilt
+    """
+    assert isinstance(file, str)
+
+    path = _path(file)
+    rows, offset = _read_rows(path, 0)
+    df = clean_frame(pd.read_csv(io.BytesIO(rows), **RAW_CSV_OPTIONS))
+    write_data(df, cleaned_name(file))
+    # Reading the cleaned timeline back also builds its deduplication index
+    cleaned = read_data(cleaned_name(file))
+    _save_state(file, {'source': file, 'watermark': _watermark(path, offset), 'rows': len(df),
+                       'cleaned_size': os.path.getsize(_path(cleaned_name(file))),
+                       'aggregates': aggregate(cleaned)})
+    return {'rows': len(df), 'offset': offset, 'rebuilt': True,
+            'duplicates': int(dedup.duplicated(derive(cleaned, 'row-hashes')).sum())}
+
+
+@instrumented('clean')
+def ingest(file: str = TIMELINE) -> dict:
+    """
+    Cleans the rows appended to a raw timeline since the last ingest, appends them to the
+    cleaned timeline and adds their counts to the aggregates. Rows still being written
+    (without their final newline) are left for the next ingest. The whole timeline is
+    rebuilt if it was never ingested or was not only appended to.
+
+    Parameters
+    ----------
+    file: str
+        The name of the raw timeline; it must be a plain CSV file
+    Returns
+    -------
+        dict: The number of new rows, the new watermark, the number of new rows which
+        repeat earlier ones (None if the cleaned timeline has no deduplication index yet)
+        and whether it was rebuilt
+    """
+    assert isinstance(file, str) and file.endswith('.csv')
+
+    path, cleaned_path = _path(file), _path(cleaned_name(file))
+    state = load_state(file)
+    if state is None or not os.path.exists(cleaned_path) or not _appended_to(path, state['watermark']) \
+            or os.path.getsize(cleaned_path) < state['cleaned_size']:
+        return rebuild(file)
+
+    rows, offset = _read_rows(path, state['watermark']['offset'])
+    if os.path.getsize(cleaned_path) > state['cleaned_size']:
+        with open(cleaned_path, 'r+b') as f:
+            # Drop what an interrupted ingest appended after the last commit
+            f.truncate(state['cleaned_size'])
+    if offset == state['watermark']['offset']:
+        return {'rows': 0, 'offset': offset, 'rebuilt': False, 'duplicates': 0}
+    # The index can only be extended if it matches the cleaned timeline before the append
+    indexed = dedup.load_index(cleaned_path) is not None
+
+    with span('load', 'ingest', rows=rows.count(b'\n') - 1):
+        df = pd.read_csv(io.BytesIO(rows), **RAW_CSV_OPTIONS)
+    df = clean_frame(df)
+    with open(cleaned_path, 'a', newline='') as f:
+        df.to_csv(f, index=False, header=False)
+    duplicates = dedup.append_index(cleaned_path, df) if indexed else None
+
+    state.update(watermark=_watermark(path, offset), rows=state['rows'] + len(df),
+                 cleaned_size=os.path.getsize(cleaned_path), aggregates=merge(state['aggregates'], aggregate(_as_read(df))))
+    _save_state(file, state)
+    return {'rows': len(df), 'offset': offset, 'rebuilt': False,
+            'duplicates': None if duplicates is None else int(duplicates.sum())}
+
+
+def aggregates(file: str = TIMELINE) -> dict:
+    """
+    Returns the aggregates of an ingested timeline as dataframes
+
+    Parameters
+    ----------
+    file: str
+        The name of the raw timeline
+    Returns
+    -------
+        dict: `country_totals` (`Country`, `Count`, most cases first), `daily_counts`
+        (one row per day between the first and the last one, one column per country) and
+        `symptom_counts` (`Symptoms`, `Count`, like `parse_symptoms`), or None if the
+        timeline was never ingested
+    """
+    state = load_state(file)
+    if state is None:
+        return None
+    counts = state['aggregates']
+
+    totals = pd.Series(counts['country_totals'], dtype='int64')
+    totals = totals.rename_axis('Country').reset_index(name='Count').sort_values('Count', ascending=False,
+                                                                                  kind='stable')
+
+    daily = pd.DataFrame.from_dict(counts['daily_counts'], orient='index').fillna(0).astype('int64')
+    daily.index = pd.to_datetime(daily.index, errors='coerce')
+    daily = daily[daily.index.notna()].sort_index()
+    if len(daily):
+        daily = daily.reindex(pd.date_range(daily.index[0], daily.index[-1], freq='D'), fill_value=0)
+    daily = daily.rename_axis(index='Date', columns='Country')
+
+    symptoms = pd.DataFrame({'Symptoms': list(counts['symptom_counts']),
+                             'Count': list(counts['symptom_counts'].values())})
+    symptoms = symptoms.sort_values('Symptoms').sort_values('Count', ascending=False, kind='stable')
+    return {'country_totals': totals.reset_index(drop=True), 'daily_counts': daily,
+            'symptom_counts': symptoms.reset_index(drop=True)}
+
+
+@instrumented('clean')
+def update_geospatial_attributes(file: str = WORLDWIDE, resolver=nominatim_resolver) -> int:
+    """
+    Writes the cleaned worldwide cases table like `add_geospatial_attributes`, reusing the
+    codes and coordinates of the countries already in the cleaned table and geocoding only
+    the new ones
+
+    Parameters
+    ----------
+    file: str
+        The name of the raw worldwide cases table
+    resolver: callable
+        The online geocoder used for the new countries which are not in the offline
+        gazetteer, or None to stay offline
+    Returns
+    -------
+        int: The number of countries which were geocoded
+    """
+    assert isinstance(file, str)
+
+    df = read_data(file)
+    known = pd.DataFrame(columns=['Country'] + GEO_COLUMNS)
+    if os.path.exists(_path(cleaned_name(file))):
+        # Read verbatim: `read_data` would decode the names once more than those of `df`,
+        # and read the codes of North America and Namibia (`NA`) as nulls
+        known = pd.read_csv(_path(cleaned_name(file)), usecols=['Country'] + GEO_COLUMNS, dtype=str,
+                            keep_default_na=False)
+    known = known.drop_duplicates('Country').set_index('Country')[GEO_COLUMNS]
+
+    new = ~df['Country'].isin(known.index)
+    located = df[~new].join(known, on='Country')
+    if new.any():
+        # The codes come back as categoricals, which would not concatenate with strings
+        geocoded = add_lat_long(df[new], resolver=resolver).astype({column: object for column in GEO_COLUMNS[:3]})
+        located = pd.concat([located, geocoded])
+    write_data(located.loc[df.index], cleaned_name(file))
+    return int(df.loc[new, 'Country'].nunique())
+
+
+if __name__ == "__main__":
+    print(ingest(TIMELINE))
+    print(update_geospatial_attributes(WORLDWIDE))
@@ -0,0 +1,355 @@
+"""
+Instrumentation of the stages of the pipeline: load, clean, derive, aggregate, figure and
+export.
+
+Functions are wrapped with `@instrumented(stage)` and blocks with `with span(stage, name)`.
+While instrumentation is enabled, each call records its wall time, CPU time of its thread,
+number of input rows and, if memory tracing is on, the peak memory allocated during it
+(through tracemalloc, which slows the code down). tracemalloc only has one peak for the
+whole process, so the peak of an event is only measured while no other thread runs events:
+events which overlap with events of other threads get no peak (None), and code measuring
+memory runs its stages one at a time (see `main.py`). The events can be
+summarized per stage, or exported as JSON lines or in the Chrome trace format which
+`chrome://tracing` and Perfetto open. While disabled, a wrapped call costs one flag check.
+
+Instrumentation is enabled for the whole process by `enable()` or by setting
+`MONKEYPOX_TRACE` (to `memory` to trace memory as well), or for a single run by
+`start_run()`: a run only records the events of the thread which started it and of the
+functions it hands to other threads through `bind`, under its own id, so that concurrent
+runs (e.g. the sessions of the dashboard) neither enable each other nor see each other's
+events.
+"""
+import os
+import json
+import time
+import itertools
+import functools
+import threading
+import contextlib
+import tracemalloc
+from collections import deque
+
+import pandas as pd
+
+STAGES = ('load', 'clean', 'derive', 'aggregate', 'figure', 'export')
+# Number of events kept, the oldest are dropped first
+MAX_EVENTS = 10_000
+
+_enabled = bool(os.environ.get('MONKEYPOX_TRACE'))
+_memory = os.environ.get('MONKEYPOX_TRACE') == 'memory'
+# Id of an active run -> whether it traces memory
+_runs = {}
+_run_ids = itertools.count(1)
+# Whether anything is recorded at all, the one flag checked while disabled
+_active = _enabled
+_events = deque(maxlen=MAX_EVENTS)
+# The stack of open events and the run of every thread
+_local = threading.local()
+_lock = threading.Lock()
+# The events running in every thread, to find those overlapping with other threads
+_open = []
+if _memory:
+    tracemalloc.start()
+
+
+def _trace_memory(memory: bool):
+    # tracemalloc runs while the process or any run traces memory; called holding `_lock`
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    elif not memory and not _memory and not any(_runs.values()) and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def enable(memory: bool = False):
+    """
+    Starts recording the events of every thread
+
+    Parameters
+    ----------
+    memory: bool
+        Whether to trace the peak memory of every event as well
+    """
+    global _enabled, _memory, _active
+    with _lock:
+        _memory = memory
+        _trace_memory(memory)
+        _enabled = _active = True
+
+
+def disable():
+    """
+    Stops recording the events of every thread, and tracing memory if it was started by
+    `enable`. Active runs keep recording.
+    """
+    global _enabled, _memory, _active
+    with _lock:
+        _enabled = _memory = False
+        _trace_memory(False)
+        _active = bool(_runs)
+
+
+def start_run(memory: bool = False) -> int:
+    """
+    Starts recording the events of the calling thread, and of the functions it passes to
+    `bind`, under a new run id. Other threads are not affected.
+
+    Parameters
+    ----------
+    memory: bool
+        Whether to trace the peak memory of every event as well
+    Returns
+    -------
+        int: The id of the run, to end it and to select its events
+    """
+    global _active
+    with _lock:
+        run = next(_run_ids)
+        _runs[run] = memory
+        _trace_memory(memory)
+        _active = True
+    _local.run = run
+    return run
+
+
+def end_run(run: int):
+    """
+    Stops recording the events of a run, and tracing memory if no one else does. Its
+    events are kept until they are cleared.
+
+    Parameters
+    ----------
+    run: int
+        The id of the run
+    """
+    global _active
+    with _lock:
+        _runs.pop(run, None)
+        _trace_memory(False)
+        _active = _enabled or bool(_runs)
+    if getattr(_local, 'run', None) == run:
+        _local.run = None
+
+
+def bind(func):
+    """
+    Returns a function running `func` in the run of the calling thread, if any, to be called
+    from another thread (e.g. of a thread pool)
+    """
+    assert callable(func)
+    run = _run()
+    if run is None:
+        return func
+
+    @functools.wraps(func)
+    def in_run(*args, **kwargs):
+        previous = getattr(_local, 'run', None)
+        _local.run = run
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.run = previous
+    return in_run
+
+
+def _run():
+    # The active run of the calling thread
+    run = getattr(_local, 'run', None)
+    return run if run in _runs else None
+
+
+def is_enabled() -> bool:
+    """
+    Whether the events of the calling thread are being recorded
+    """
+    return _enabled or _run() is not None
+
+
+def traces_memory() -> bool:
+    """
+    Whether the peak memory of the events of the calling thread is being traced
+    """
+    return (_enabled and _memory) or _runs.get(_run(), False)
+
+
+def clear(run: int = None):
+    """
+    Drops the recorded events of a run, or all of them
+
+    Parameters
+    ----------
+    run: int
+        The id of the run, or None for every event
+    """
+    with _lock:
+        if run is None:
+            _events.clear()
+            return
+        kept = [event for event in _events if event['run'] != run]
+        _events.clear()
+        _events.extend(kept)
+
+
+def events(run: int = None) -> list:
+    """
+    Returns the recorded events of a run, or all of them, oldest first
+
+    Parameters
+    ----------
+    run: int
+        The id of the run, or None for every event
+    """
+    with _lock:
+        return [event for event in _events if run is None or event['run'] == run]
+
+
+def _rows(args) -> int:
+    # The number of rows of the first dataframe or series argument
+    for arg in args:
+        if isinstance(arg, (pd.DataFrame, pd.Series)):
+            return len(arg)
+    return None
+
+
+@contextlib.contextmanager
+def _record(stage: str, name: str, rows: int, run: int):
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    memory = (_memory or _runs.get(run, False)) and tracemalloc.is_tracing()
+    base = 0
+    if memory:
+        # The peak of the enclosing event so far is kept before measuring this one
+        base, peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+        tracemalloc.reset_peak()
+    event = {'stage': stage, 'name': name, 'rows': rows, 'run': run, 'thread': threading.get_ident(),
+             'depth': len(stack), 'start': time.time(), 'peak': 0}
+    if memory:
+        with _lock:
+            # The events of other threads and this one reset each other's peak
+            overlapping = [other for other in _open if other['thread'] != event['thread']]
+            for other in overlapping + ([event] if overlapping else []):
+                other['overlaps'] = True
+            _open.append(event)
+    stack.append(event)
+    wall, cpu = time.perf_counter(), time.thread_time()
+    try:
+        yield event
+    finally:
+        event['wall'] = time.perf_counter() - wall
+        event['cpu'] = time.thread_time() - cpu
+        stack.pop()
+        if memory:
+            with _lock:
+                _open.remove(event)
+        if memory and event.pop('overlaps', False):
+            event['peak'] = None
+        elif memory and tracemalloc.is_tracing():
+            # Peaks are absolute while the event runs, then relative to its start
+            peak = max(event['peak'], tracemalloc.get_traced_memory()[1])
+            event['peak'] = max(peak - base, 0)
+            if stack:
+                stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+        else:
+            event['peak'] = None
+        with _lock:
+            _events.append(event)
+
+
+def span(stage: str, name: str = None, rows: int = None):
+    """
+    Context manager recording an event around a block
+
+    Parameters
+    ----------
+    stage: str
+        The stage of the pipeline, one of `STAGES`
+    name: str
+        The name of the event, the stage by default
+    rows: int
+        The number of input rows
+    """
+    assert stage in STAGES
+    if not _active:
+        return contextlib.nullcontext()
+    run = _run()
+    if run is None and not _enabled:
+        return contextlib.nullcontext()
+    return _record(stage, name or stage, rows, run)
+
+
+def instrumented(stage: str, name: str = None):
+    """
+    Decorator recording an event for every call of a function. The number of input rows is
+    taken from the first dataframe or series argument.
+
+    Parameters
+    ----------
+    stage: str
+        The stage of the pipeline, one of `STAGES`
+    name: str
+        The name of the events, the name of the function by default
+    """
+    assert stage in STAGES
+
+    def decorate(func):
+        event_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _active:
+                return func(*args, **kwargs)
+            run = _run()
+            if run is None and not _enabled:
+                return func(*args, **kwargs)
+            with _record(stage, event_name, _rows(args), run):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def summary(run: int = None) -> pd.DataFrame:
+    """
+    Returns the number of calls, total wall and CPU time, largest peak memory and input
+    rows of every recorded stage and name, of a run or of every event, slowest first
+    """
+    df = pd.DataFrame(events(run), columns=['stage', 'name', 'rows', 'wall', 'cpu', 'peak'])
+    df = df.groupby(['stage', 'name'], sort=False).agg(calls=('wall', 'size'), wall=('wall', 'sum'),
+                                                       cpu=('cpu', 'sum'), peak=('peak', 'max'),
+                                                       rows=('rows', 'max'))
+    return df.sort_values('wall', ascending=False).reset_index()
+
+
+def to_jsonl(run: int = None) -> str:
+    """
+    Returns the recorded events of a run, or all of them, as JSON lines
+    """
+    return ''.join(json.dumps(event) + '\n' for event in events(run))
+
+
+def to_chrome_trace(run: int = None) -> str:
+    """
+    Returns the recorded events of a run, or all of them, in the Chrome trace event format
+    """
+    pid = os.getpid()
+    trace = [{'name': event['name'], 'cat': event['stage'], 'ph': 'X', 'pid': pid, 'tid': event['thread'],
+              'ts': event['start'] * 1e6, 'dur': event['wall'] * 1e6,
+              'args': {key: event[key] for key in ('rows', 'cpu', 'peak')}}
+             for event in events(run)]
+    return json.dumps({'traceEvents': trace, 'displayTimeUnit': 'ms'})
+
+
+def export(path: str):
+    """
+    Writes the recorded events to a file: in the Chrome trace format if it ends with
+    `.json`, as JSON lines otherwise
+
+    Parameters
+    ----------
+    path: str
+        The path of the file
+    """
+    assert isinstance(path, str)
+    with open(path, 'w') as f:
+        f.write(to_chrome_trace() if path.endswith('.json') else to_jsonl())
@@ -0,0 +1,43 @@
+"""
+Lazy imports of the heavy plotting and IO libraries.
+
+`lazy_import('plotly.express')` returns a stand-in module which imports the real one at the
+first attribute access, so modules can keep their usual `px.bar(...)` style while only
+paying for plotly, seaborn, matplotlib, wordcloud or pyarrow when a function actually uses
+them. `benchmarks/import_time.py` tracks what importing the app costs.
+"""
+import sys
+import types
+import importlib
+
+
+class LazyModule(types.ModuleType):
+    """
+    Module which is imported at the first access to one of its attributes
+    """
+
+    def __getattr__(self, attr):
+        # Only called for the attributes missing from the stand-in itself; the lookup of an
+        # imported module in `sys.modules` is cheap enough to be repeated
+        return getattr(importlib.import_module(self.__name__), attr)
+
+    def __dir__(self):
+        return dir(importlib.import_module(self.__name__))
+
+
+def lazy_import(name: str) -> types.ModuleType:
+    """
+    Returns the module `name` if it was already imported, or a stand-in which imports it at
+    first use
+
+    Parameters
+    ----------
+    name: str
+        The full name of the module, e.g. `matplotlib.pyplot`
+    Returns
+    -------
+        The module or its lazy stand-in
+    """
+    assert isinstance(name, str)
+    module = sys.modules.get(name)
+    return module if module is not None else LazyModule(name)
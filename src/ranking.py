@@ -0,0 +1,211 @@
+"""
+Top-K rankings of countries and cities.
+
+`top_k` selects the positions of the k largest values with `np.argpartition`, in linear
+time, and only sorts those k, so a ranking never sorts a whole table. A `RankingIndex`
+keeps the totals of several metrics by key - the confirmed, suspected, hospitalized and
+travelled cases of every country and the number of cases of every city - and their ordered
+top-K views, which are computed on first use and dropped when the totals change. Country
+metrics are replaced by a newer worldwide table (`update_countries`) and city counts are
+added up from the rows appended to the detection timeline (`add_cities`), so an index
+follows new data without starting over. Input dataframes are never modified.
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+from src.cube import count_cube, query
+from src.derived import derive, register
+from src.instrument import instrumented
+
+# Metric name -> column of the worldwide cases table
+COUNTRY_METRICS = {'confirmed': 'Confirmed_Cases', 'suspected': 'Suspected_Cases', 'hospitalized': 'Hospitalized',
+                   'travelled': 'Travel_History_Yes'}
+CITIES = 'cities'
+
+
+def top_k(values, k: int) -> np.ndarray:
+    """
+    Returns the positions of the `k` largest values, largest first. Equal values keep
+    their order and missing values come last.
+
+    Parameters
+    ----------
+    values: array-like
+        The values to rank
+    k: int
+        The number of positions to return
+    Returns
+    -------
+        np.ndarray: At most `k` positions into `values`
+    """
+    assert isinstance(k, (int, np.integer)) and k >= 0
+
+    values = np.asarray(values)
+    if values.dtype.kind == 'f':
+        values = np.where(np.isnan(values), -np.inf, values)
+    k = min(k, len(values))
+    if k == 0:
+        return np.array([], dtype=np.intp)
+
+    # The k-th largest value, then everything above it and the first values equal to it
+    threshold = values[np.argpartition(values, len(values) - k)[len(values) - k]]
+    above = np.flatnonzero(values > threshold)
+    candidates = np.concatenate([above, np.flatnonzero(values == threshold)[:k - len(above)]])
+    return candidates[np.lexsort((candidates, -values[candidates]))]
+
+
+class RankingIndex:
+    """
+    Totals of several metrics by key, with their ordered top-K views
+    """
+
+    def __init__(self):
+        # metric -> totals by key, in the order the keys were first seen
+        self._totals = {}
+        # (metric, k) -> top-K view
+        self._views = {}
+        self._lock = threading.Lock()
+
+    def metrics(self) -> list:
+        """
+        Returns the names of the metrics of the index
+        """
+        return list(self._totals)
+
+    def _set(self, metric: str, totals: pd.Series):
+        with self._lock:
+            self._totals[metric] = totals
+            self._views = {key: view for key, view in self._views.items() if key[0] != metric}
+
+    def update_countries(self, df_worldwide_cases: pd.DataFrame):
+        """
+        Replaces the country metrics with the values of a worldwide cases table; countries
+        which are not in it keep their previous values
+
+        Parameters
+        ----------
+        df_worldwide_cases: pd.DataFrame
+            The DataFrame which contains country-wise data of cases
+        """
+        assert isinstance(df_worldwide_cases, pd.DataFrame) and 'Country' in df_worldwide_cases.columns
+
+        for metric, column in COUNTRY_METRICS.items():
+            if column not in df_worldwide_cases.columns:
+                continue
+            values = pd.Series(df_worldwide_cases[column].to_numpy(), index=df_worldwide_cases['Country'].to_numpy())
+            values = values[~values.index.duplicated(keep='last')]
+            previous = self._totals.get(metric)
+            if previous is not None:
+                values = pd.concat([previous[~previous.index.isin(values.index)], values])
+            self._set(metric, values)
+
+    def add_counts(self, metric: str, counts: pd.Series):
+        """
+        Adds counts by key to the totals of an additive metric
+
+        Parameters
+        ----------
+        metric: str
+            The name of the metric
+        counts: pd.Series
+            The counts to add, by key
+        """
+        assert isinstance(metric, str) and isinstance(counts, pd.Series)
+
+        totals = counts
+        previous = self._totals.get(metric)
+        if previous is not None:
+            # `add` sorts the keys; keep them in the order they were first seen
+            order = previous.index.append(counts.index[~counts.index.isin(previous.index)])
+            totals = previous.add(counts, fill_value=0).reindex(order)
+        self._set(metric, totals.astype(np.int64))
+
+    def add_cities(self, df_detection_timeline: pd.DataFrame):
+        """
+        Adds the cases of some rows of the detection timeline to the city counts, e.g. the
+        rows appended since the last update
+
+        Parameters
+        ----------
+        df_detection_timeline: pd.DataFrame
+            Rows of the case detection timeline
+        """
+        assert isinstance(df_detection_timeline, pd.DataFrame) and 'City' in df_detection_timeline.columns
+        self.add_counts(CITIES, df_detection_timeline['City'].dropna().astype(str).value_counts(sort=False))
+
+    @instrumented('aggregate', 'top')
+    def top(self, metric: str, k: int = 10) -> pd.Series:
+        """
+        Returns the keys with the highest totals of a metric
+
+        Parameters
+        ----------
+        metric: str
+            The name of the metric
+        k: int
+            The number of keys
+        Returns
+        -------
+            pd.Series: The totals of the top `k` keys, largest first. The view is shared
+            and must not be modified.
+        """
+        assert metric in self._totals, f"unknown metric {metric}"
+
+        with self._lock:
+            view = self._views.get((metric, k))
+            if view is None:
+                totals = self._totals[metric]
+                view = self._views[(metric, k)] = totals.iloc[top_k(totals.to_numpy(), k)]
+        return view
+
+
+@register('country-ranking')
+def _country_ranking(df: pd.DataFrame) -> RankingIndex:
+    index = RankingIndex()
+    index.update_countries(df)
+    return index
+
+
+@register('city-ranking')
+def _city_ranking(df: pd.DataFrame) -> RankingIndex:
+    # The city counts come from the count cube of the timeline
+    counts = query(count_cube(df), ['City']).dropna()
+    index = RankingIndex()
+    index.add_counts(CITIES, pd.Series(counts['Count'].to_numpy(), index=counts['City'].astype(str).to_numpy()))
+    return index
+
+
+def country_ranking(df_worldwide_cases: pd.DataFrame) -> RankingIndex:
+    """
+    Returns the ranking index of the country metrics of a worldwide cases table, built once
+    per table. The index is shared and must not be updated.
+
+    Parameters
+    ----------
+    df_worldwide_cases: pd.DataFrame
+        The DataFrame which contains country-wise data of cases
+    Returns
+    -------
+        RankingIndex: The index of the metrics in `COUNTRY_METRICS`
+    """
+    assert isinstance(df_worldwide_cases, pd.DataFrame)
+    return derive(df_worldwide_cases, 'country-ranking')
+
+
+def city_ranking(df_detection_timeline: pd.DataFrame) -> RankingIndex:
+    """
+    Returns the ranking index of the city counts of a detection timeline, built once per
+    timeline. The index is shared and must not be updated.
+
+    Parameters
+    ----------
+    df_detection_timeline: pd.DataFrame
+        The DataFrame which contains the case detection timeline
+    Returns
+    -------
+        RankingIndex: The index of the `cities` metric
+    """
+    assert isinstance(df_detection_timeline, pd.DataFrame)
+    return derive(df_detection_timeline, 'city-ranking')
@@ -0,0 +1,279 @@
+"""
+Headless batch renderer of every plot of the project.
+
+    python -m src.render [--root DIR] [--workers N] [--export-workers N] [--only NAME ...]
+
+The figure functions are discovered in `src.visualizations` and `src.analysis`: every public
+function whose parameters are all datasets (recognized by their parameter names) or have
+their choices listed in `PARAMETERS`. The datasets are loaded and their derived data (see
+`src.derived`) computed once, then the figures are built across a pool of processes which
+inherit them. Matplotlib images are written by the process which built them, while plotly
+images go through a separate pool for the (much slower) kaleido export. Each image is
+written by the job of the function which saves it, and the hashes of the written images
+are recorded by the parent process only. The wall time and the peak traced memory of every
+figure are reported.
+
+`--root` points at a directory with the `data` and `plots` folders of a data snapshot.
+"""
+import os
+import sys
+import json
+import time
+import inspect
+import argparse
+import warnings
+import importlib
+import itertools
+import tracemalloc
+import multiprocessing
+import concurrent.futures
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.figure
+import matplotlib.pyplot as plt
+
+from src import artifacts, cache
+from src.derived import derive
+from src.utils import parse_symptoms, read_data
+
+MODULES = ['src.visualizations', 'src.analysis']
+
+DATASETS = {
+    'worldwide': 'Monkey_Pox_Cases_Worldwide_Cleaned.csv',
+    'daily': 'Daily_Country_Wise_Confirmed_Cases.csv',
+    'timeline': 'Worldwide_Case_Detection_Timeline_Cleaned.csv',
+}
+# Parameter name -> dataset passed for it
+DATASET_PARAMETERS = {
+    'df_worldwide_cases': 'worldwide',
+    'df_daily_cases': 'daily',
+    'df_detection_timeline': 'timeline',
+    'df_worldwide_case_detection_timeline': 'timeline',
+}
+# Dataset -> its derived data (see `src.derived`), computed before the figures are built
+TRANSFORMS = {
+    'worldwide': ['country-ranking'],
+    'daily': ['daily-matrix'],
+    'timeline': ['row-hashes', 'deduplicated', 'gender-normalized', 'age-parsed', 'count-cube', 'city-ranking',
+                 'daily-country-counts'],
+}
+# Parameter name -> values to render the figures for. The region maps are not rendered:
+# they are views of the world map (see `src.visualizations.cases_on_map`), exported once.
+PARAMETERS = {}
+# Image names of the figures which are not saved by `save_fig`
+OUTPUT_NAMES = {
+    'hospitalization_gender': ['Hospitalized patients based on Gender.png'],
+    'virus_vs_age_group': ['Virus Age Group.png'],
+    'hospitalization_vs_age': ['Hospitalization Age.png'],
+    'hospitalization_symptoms': ['Symptoms_Hosp.png'],
+    'US_world_histogram': ['Confirmed Histogram.png', 'Hospitalized Histogram.png', 'Travel Histogram.png'],
+}
+
+# The datasets of the batch, shared with the worker processes
+_datasets = {}
+
+
+def discover() -> list:
+    """
+    Returns the figure jobs: one `(module, function, parameters)` triple per figure
+    function and combination of its `PARAMETERS` values. Parameters given a dataset are
+    left out of the triple.
+    """
+    jobs = []
+    for module_name in MODULES:
+        module = importlib.import_module(module_name)
+        for name, func in inspect.getmembers(module, inspect.isfunction):
+            if func.__module__ != module_name or name.startswith('_'):
+                continue
+            required = [parameter.name for parameter in inspect.signature(func).parameters.values()
+                        if parameter.default is inspect.Parameter.empty]
+            if not all(parameter in DATASET_PARAMETERS or parameter in PARAMETERS for parameter in required):
+                continue
+            choices = [parameter for parameter in required if parameter in PARAMETERS]
+            for values in itertools.product(*[PARAMETERS[parameter] for parameter in choices]):
+                jobs.append((module_name, name, dict(zip(choices, values))))
+    return jobs
+
+
+def load_datasets():
+    """
+    Loads the datasets from the `data` folder of the current directory and computes their
+    derived data, so that the worker processes share them
+    """
+    _datasets.clear()
+    for key, file in DATASETS.items():
+        _datasets[key] = read_data(file)
+    for key, names in TRANSFORMS.items():
+        for name in names:
+            derive(_datasets[key], name)
+    parse_symptoms(_datasets['timeline'])
+
+
+def _figures(result) -> list:
+    if isinstance(result, tuple):
+        return [figure for item in result for figure in _figures(item)]
+    if isinstance(result, matplotlib.figure.Figure) or type(result).__module__.startswith('plotly'):
+        return [result]
+    # e.g. seaborn grids
+    if isinstance(getattr(result, 'figure', None), matplotlib.figure.Figure):
+        return [result.figure]
+    return []
+
+
+def render_job(job: tuple) -> dict:
+    """
+    Builds the figures of a job and writes its matplotlib images
+
+    Parameters
+    ----------
+    job: tuple
+        The `(module, function, parameters)` triple of the job
+    Returns
+    -------
+        dict: The report of the job, with the plotly snapshots left to export and the
+        hashes of the images written, to record
+    """
+    module_name, name, parameters = job
+    if not _datasets:
+        load_datasets()
+    func = getattr(importlib.import_module(module_name), name)
+
+    arguments = {parameter: _datasets[DATASET_PARAMETERS[parameter]]
+                 for parameter in inspect.signature(func).parameters if parameter in DATASET_PARAMETERS}
+
+    # A figure a previous job of this worker built within its own would come from the cache
+    # without being saved
+    cache.clear()
+    with artifacts.capture() as saved, warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = func(**arguments, **parameters)
+        wall = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    figures = _figures(result)
+    if not saved:
+        saved = [(os.path.join(os.getcwd(), 'plots', output), *artifacts.snapshot(figure))
+                 for output, figure in zip(OUTPUT_NAMES.get(name, []), figures)]
+
+    exports, written = [], []
+    for path, kind, data in saved:
+        if kind == 'matplotlib':
+            digest = artifacts.write_snapshot(kind, data, path, record=False)
+            if digest:
+                written.append((path, digest))
+        else:
+            exports.append((path, kind, data))
+    for figure in figures:
+        if isinstance(figure, matplotlib.figure.Figure):
+            plt.close(figure)
+
+    label = name + ''.join(f'[{value}]' for value in parameters.values())
+    return {'figure': label, 'figures': len(figures), 'images': [path for path, _, _ in saved],
+            'wall': wall, 'peak': peak, 'exports': exports, 'written': written}
+
+
+def export(path: str, kind: str, data: bytes) -> tuple:
+    """
+    Writes the image of a plotly snapshot
+
+    Returns
+    -------
+        tuple: The time taken, in seconds, the error message if the export failed and the
+        hash of the image if it was written, to record
+    """
+    start = time.perf_counter()
+    digest = None
+    try:
+        digest = artifacts.write_snapshot(kind, data, path, record=False)
+        error = None
+    except Exception as e:
+        error = f"{os.path.basename(path)}: {str(e).strip().splitlines()[0]}"
+    return time.perf_counter() - start, error, digest
+
+
+def render_all(workers: int = None, export_workers: int = None, only: list = None) -> list:
+    """
+    Renders all the figures found by `discover` from the data in the current directory
+
+    Parameters
+    ----------
+    workers: int
+        Number of processes building the figures, all the cores by default
+    export_workers: int
+        Number of processes exporting the plotly images
+    only: list
+        Optional names of the functions to render
+    Returns
+    -------
+        list: The report of each figure function, without the functions which returned
+        no figure
+    """
+    workers = workers or os.cpu_count()
+    export_workers = export_workers or max(1, workers // 2)
+    jobs = [job for job in discover() if not only or job[1] in only]
+
+    load_datasets()
+    # Forked workers inherit the datasets and their derived data, others load them once
+    method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+    context = multiprocessing.get_context(method)
+
+    # Export future -> report of its figure, and the path of its image
+    reports, pending, export_jobs = [], {}, {}
+    with concurrent.futures.ProcessPoolExecutor(workers, mp_context=context) as render_pool, \
+            concurrent.futures.ProcessPoolExecutor(export_workers, mp_context=context) as export_pool:
+        for future in concurrent.futures.as_completed([render_pool.submit(render_job, job) for job in jobs]):
+            report = future.result()
+            for path, digest in report.pop('written'):
+                artifacts.record(path, digest)
+            for export_job in report.pop('exports'):
+                export_future = export_pool.submit(export, *export_job)
+                pending[export_future], export_jobs[export_future] = report, export_job[0]
+            report.update(export=0.0, errors=[])
+            reports.append(report)
+        for future in concurrent.futures.as_completed(pending):
+            seconds, error, digest = future.result()
+            if digest:
+                artifacts.record(export_jobs[future], digest)
+            pending[future]['export'] += seconds
+            if error:
+                pending[future]['errors'].append(error)
+
+    return sorted([report for report in reports if report['figures']], key=lambda report: report['figure'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Render all the plots of the project')
+    parser.add_argument('--root', default=os.getcwd(), help='directory with the data and plots folders')
+    parser.add_argument('--workers', type=int, default=None, help='processes building the figures')
+    parser.add_argument('--export-workers', type=int, default=None, help='processes exporting plotly images')
+    parser.add_argument('--only', nargs='*', default=None, help='names of the figure functions to render')
+    parser.add_argument('--report', default=None, help='file to write the report to, as JSON')
+    args = parser.parse_args(argv)
+
+    report_path = os.path.abspath(args.report) if args.report else None
+    os.chdir(args.root)
+    start = time.perf_counter()
+    reports = render_all(args.workers, args.export_workers, args.only)
+    total = time.perf_counter() - start
+
+    print(f"{'figure':<40} {'build (s)':>10} {'peak (MB)':>10} {'export (s)':>11}")
+    for report in reports:
+        print(f"{report['figure']:<40} {report['wall']:>10.3f} {report['peak'] / 2 ** 20:>10.1f} "
+              f"{report['export']:>11.3f}")
+    print(f"{len(reports)} figures in {total:.2f}s")
+    errors = [error for report in reports for error in report['errors']]
+    for error in errors:
+        print(f"Export failed for {error}", file=sys.stderr)
+
+    if report_path:
+        with open(report_path, 'w') as f:
+            json.dump({'total': total, 'figures': reports}, f, indent=1)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+"""
+Declarative cleaning rules.
+
+The cleaning of the datasets is written as lists of rules, each applying to one column or
+to every text column (`EVERY`), in order:
+
+- `missing(column, markers)`: cells whose stripped value is a missing value marker become null
+- `normalize(column, *steps)`: string normalizers, among `strip`, `lower`, `upper` and `title`
+- `prefix_map(column, {prefix: value})`: values starting with a prefix become its value,
+  the first matching prefix wins
+- `value_map(column, {value: replacement})`: exact replacements
+- `regex(column, pattern, replacement)`: regular expression substitutions
+- `fill(column, value)`: nulls become a value
+
+`apply_rules` factorizes each column, runs its rules over its distinct values only (and one
+null) and maps the results back through the codes, so cleaning costs grow with the number
+of distinct values rather than rows, and adding rules stays cheap. Every rule only looks at
+a single value, so the rules give the same result on a whole dataset or on any chunk of it.
+"""
+import collections
+
+import numpy as np
+import pandas as pd
+
+from src.schema import NA_VALUES
+
+EVERY = '*'
+NORMALIZERS = ('strip', 'lower', 'upper', 'title')
+
+Rule = collections.namedtuple('Rule', ['kind', 'column', 'arguments'])
+
+
+def missing(column: str = EVERY, markers: list = NA_VALUES) -> Rule:
+    return Rule('missing', column, tuple(markers))
+
+
+def normalize(column: str, *steps: str) -> Rule:
+    assert steps and set(steps) <= set(NORMALIZERS), f"normalizers are {NORMALIZERS}"
+    return Rule('normalize', column, steps)
+
+
+def prefix_map(column: str, prefixes: dict) -> Rule:
+    return Rule('prefix', column, tuple(prefixes.items()))
+
+
+def value_map(column: str, values: dict) -> Rule:
+    return Rule('value', column, tuple(values.items()))
+
+
+def regex(column: str, pattern: str, replacement: str) -> Rule:
+    return Rule('regex', column, (pattern, replacement))
+
+
+def fill(column: str, value) -> Rule:
+    return Rule('fill', column, value)
+
+
+# Cleaning of the detection timeline (see `src.clean`)
+TIMELINE_RULES = [
+    # Missing values are written as empty cells rather than a sentinel string
+    missing(EVERY),
+    # Values starting with 'm/M' are male and 'f/F' female
+    prefix_map('Gender', {'m': 'M', 'M': 'M', 'f': 'F', 'F': 'F'}),
+    # The spelling mistake in San Francisco's name
+    value_map(EVERY, {'San Francsico': 'San Francisco'}),
+]
+
+# Genders as the analyses count them (see `src.analysis`): the cleaning of the timeline,
+# then lowercase labels with missing genders counted as 'NA'
+GENDER_RULES = TIMELINE_RULES + [
+    normalize('Gender', 'strip', 'lower'),
+    fill('Gender', 'NA'),
+]
+
+
+def _is_text(column: pd.Series) -> bool:
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return _is_text(pd.Series(column.cat.categories))
+    return pd.api.types.is_object_dtype(column.dtype) or pd.api.types.is_string_dtype(column.dtype)
+
+
+def compile_rules(rules: list, df: pd.DataFrame, columns: list = None) -> dict:
+    """
+    Returns the rules applying to each text column of a dataframe, in order
+
+    Parameters
+    ----------
+    rules: list
+        The rules
+    df: pd.DataFrame
+        The dataframe
+    columns: list
+        Optional subset of the columns to clean
+    Returns
+    -------
+        dict: The list of rules of every column which has some
+    """
+    assert isinstance(rules, list) and all(isinstance(rule, Rule) for rule in rules)
+
+    compiled = {}
+    for column in columns if columns is not None else df.columns:
+        if not _is_text(df[column]):
+            continue
+        column_rules = [rule for rule in rules if rule.column in (EVERY, column)]
+        if column_rules:
+            compiled[column] = column_rules
+    return compiled
+
+
+def _strings(values: pd.Series) -> np.ndarray:
+    # Which values are strings; the string rules leave the other values as they are
+    return values.map(lambda value: isinstance(value, str)).to_numpy(dtype=bool)
+
+
+def _apply(values: pd.Series, rule: Rule) -> pd.Series:
+    # `values` holds the distinct values of a column, as Python objects
+    if rule.kind == 'value':
+        return values.replace(dict(rule.arguments))
+    if rule.kind == 'fill':
+        return values.fillna(rule.arguments)
+
+    result = values.copy()
+    strings = _strings(values)
+    text = values[strings].astype(str)
+    if rule.kind == 'missing':
+        result[strings] = text.mask(text.str.strip().isin(rule.arguments))
+    elif rule.kind == 'normalize':
+        for step in rule.arguments:
+            text = getattr(text.str, step)()
+        result[strings] = text
+    elif rule.kind == 'prefix':
+        matched = np.zeros(len(text), dtype=bool)
+        for prefix, value in rule.arguments:
+            hit = text.str.startswith(prefix).to_numpy(dtype=bool) & ~matched
+            text[hit] = value
+            matched |= hit
+        result[strings] = text
+    elif rule.kind == 'regex':
+        result[strings] = text.str.replace(rule.arguments[0], rule.arguments[1], regex=True)
+    else:
+        raise ValueError(f"unknown rule {rule.kind}")
+    return result
+
+
+def _clean_column(column: pd.Series, rules: list) -> pd.Series:
+    categorical = isinstance(column.dtype, pd.CategoricalDtype)
+    if categorical:
+        codes, uniques = column.cat.codes.to_numpy(), column.cat.categories
+    else:
+        codes, uniques = pd.factorize(column)
+
+    # The distinct values, then a null standing for the missing cells
+    values = pd.Series(np.append(uniques.to_numpy(dtype=object), np.nan), dtype=object)
+    cleaned = values
+    for rule in rules:
+        cleaned = _apply(cleaned, rule)
+    if cleaned.equals(values):
+        return column
+
+    # Values which became equal are merged, and the codes are mapped through them
+    cleaned_codes, cleaned_uniques = pd.factorize(cleaned)
+    codes = cleaned_codes[np.where(codes < 0, len(uniques), codes)]
+    if categorical:
+        return pd.Series(pd.Categorical.from_codes(codes, categories=cleaned_uniques), index=column.index,
+                         name=column.name)
+    dtype = column.dtype if pd.api.types.is_string_dtype(column.dtype) else object
+    cleaned = pd.array(np.append(cleaned_uniques.to_numpy(dtype=object), np.nan), dtype=dtype)
+    return pd.Series(cleaned.take(np.where(codes < 0, len(cleaned_uniques), codes)), index=column.index,
+                     name=column.name)
+
+
+def apply_rules(df: pd.DataFrame, rules: list, columns: list = None) -> pd.DataFrame:
+    """
+    Applies cleaning rules to a dataframe
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        The dataframe to clean; it is not modified
+    rules: list
+        The rules, applied in order
+    columns: list
+        Optional subset of the columns to clean
+    Returns
+    -------
+        pd.DataFrame: The cleaned dataframe, sharing the columns which did not change
+    """
+    assert isinstance(df, pd.DataFrame)
+
+    df = df.copy(deep=False)
+    for column, column_rules in compile_rules(rules, df, columns).items():
+        df[column] = _clean_column(df[column], column_rules)
+    return df
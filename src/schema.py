@@ -0,0 +1,113 @@
+"""
+Typed, compact schema for the detection timeline dataset.
+
+The raw and cleaned timelines load as nine columns of Python strings with missing values
+spelled out as the sentinel 'NA'. `to_timeline_schema` converts them to categoricals, a
+datetime64 confirmation date and a pair of small integer age bounds with real nulls.
+"""
+import os
+
+import pandas as pd
+
+# Strings which are used to mark a missing value in the datasets
+NA_VALUES = ['NA', 'N/A', 'NaN', 'nan', '']
+
+FLAG_COLUMNS = ['Hospitalised (Y/N/NA)', 'Isolated (Y/N/NA)', 'Travel_history (Y/N/NA)']
+CATEGORICAL_COLUMNS = ['Country', 'City', 'Gender'] + FLAG_COLUMNS
+AGE_BOUND_COLUMNS = ['Age_low', 'Age_high']
+
+# The files the timeline schema applies to
+_TIMELINE_FILES = ['Worldwide_Case_Detection_Timeline.csv', 'Worldwide_Case_Detection_Timeline_Cleaned.csv']
+
+
+def normalize_missing(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Replaces the sentinel strings used for missing values with real nulls
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        The dataframe to normalize
+    Returns
+    -------
+        pd.DataFrame: A dataframe in which every missing value is null
+    """
+    assert isinstance(df, pd.DataFrame)
+
+    # Imported here as the cleaning rules depend on the missing value markers defined above
+    from src.rules import apply_rules, missing
+
+    return apply_rules(df, [missing()])
+
+
+def to_timeline_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Converts a detection timeline dataframe to its typed schema:
+    `Country`, `City`, `Gender` and the Y/N/NA flags as categoricals, `Date_confirmation`
+    as datetime64 and `Age` as the `Age_low` / `Age_high` pair of small integers.
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        The detection timeline, as read from the CSV file
+    Returns
+    -------
+        pd.DataFrame: The typed dataframe
+    """
+    assert isinstance(df, pd.DataFrame) and 'Date_confirmation' in df.columns
+
+    # Imported here as the age parser depends on the missing value markers defined above
+    from src.age import parse_age
+
+    df = normalize_missing(df)
+    df['Date_confirmation'] = pd.to_datetime(df['Date_confirmation'], format='%Y-%m-%d', errors='coerce')
+    for column in CATEGORICAL_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype('category')
+
+    if 'Age' in df.columns:
+        position = df.columns.get_loc('Age')
+        ages = parse_age(df['Age'])
+        df = df.drop(columns=['Age'])
+        for offset, column in enumerate(AGE_BOUND_COLUMNS):
+            df.insert(position + offset, column, ages[column])
+    return df
+
+
+def schema_for(file: str):
+    """
+    Returns the function which converts a dataset to its typed schema
+
+    Parameters
+    ----------
+    file: str
+        The name of the file in the data folder
+    Returns
+    -------
+        The conversion function or None if the file has no typed schema
+    """
+    assert isinstance(file, str)
+    return to_timeline_schema if os.path.basename(file) in _TIMELINE_FILES else None
+
+
+def memory_report(before: pd.DataFrame, after: pd.DataFrame) -> pd.DataFrame:
+    """
+    Compares the memory used by each column of a dataframe before and after it was typed
+
+    Parameters
+    ----------
+    before: pd.DataFrame
+        The dataframe as read from the CSV file
+    after: pd.DataFrame
+        The typed dataframe
+    Returns
+    -------
+        pd.DataFrame: Bytes used per column before and after, with a `Total` row
+    """
+    assert isinstance(before, pd.DataFrame) and isinstance(after, pd.DataFrame)
+
+    columns = list(before.columns) + [column for column in after.columns if column not in before.columns]
+    report = pd.DataFrame({'Before': before.memory_usage(index=False, deep=True),
+                           'After': after.memory_usage(index=False, deep=True)}).reindex(columns)
+    report.loc['Total'] = report.sum()
+    return report.fillna(0).astype(int)
@@ -0,0 +1,122 @@
+"""
+Canonicalization of the free-text `Symptoms` column.
+
+The synonym rules live in `data/symptom_rules.csv`, one rule per row in priority order:
+`regex` rules match anywhere in a symptom, ignoring case, and `literal` rules match a whole
+symptom exactly. All the rules are compiled into a single matcher which is only run over
+the distinct symptoms, and the results are memoized across calls.
+"""
+import os
+import re
+import functools
+import threading
+
+import numpy as np
+import pandas as pd
+
+RULES_FILE = 'symptom_rules.csv'
+
+# Separators between the symptoms listed in a single cell
+SEPARATOR = re.compile(r", | , | ,|;")
+
+# Canonical symptom of every symptom seen so far, shared across calls
+_canonical = {}
+# Counts of the symptoms of every distinct `Symptoms` column seen so far
+_counts = {}
+_MAX_COUNTS = 32
+# The symptoms are counted from several threads (see `main.py`)
+_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=None)
+def _load_rules(path: str):
+    rules = pd.read_csv(path, keep_default_na=False)
+    assert set(rules['kind']) <= {'regex', 'literal'}
+
+    # One named group per rule, tried in the order of the table
+    alternatives = []
+    for i, (kind, pattern) in enumerate(rules[['kind', 'pattern']].itertuples(index=False)):
+        if kind == 'regex':
+            alternatives.append(f"(?P<rule{i}>(?i:{pattern}))")
+        else:
+            alternatives.append(f"(?P<rule{i}>{re.escape(pattern)}\\Z)")
+    return re.compile('|'.join(alternatives)), rules['canonical'].tolist()
+
+
+def rules():
+    """
+    Returns the compiled matcher of the symptom rules and the canonical symptom of each rule
+    """
+    return _load_rules(os.path.join(os.getcwd(), 'data', RULES_FILE))
+
+
+def canonicalize(symptom: str) -> str:
+    """
+    Returns the canonical name of a single symptom
+
+    Parameters
+    ----------
+    symptom: str
+        The symptom as written in the dataset
+    Returns
+    -------
+        str: The canonical, title cased symptom
+    """
+    assert isinstance(symptom, str)
+
+    with _lock:
+        symptom_name = _canonical.get(symptom)
+    if symptom_name is None:
+        matcher, canonical = rules()
+        match = matcher.match(symptom)
+        if match is not None:
+            symptom_name = canonical[int(match.lastgroup[len('rule'):])].title()
+        else:
+            symptom_name = symptom.title()
+        with _lock:
+            _canonical[symptom] = symptom_name
+    return symptom_name
+
+
+def count_symptoms(symptoms: pd.Series) -> pd.DataFrame:
+    """
+    Splits every cell of a `Symptoms` column into its symptoms, canonicalizes them and
+    counts the occurences of each canonical symptom. Only the distinct cells are split and
+    canonicalized; their number of occurences is counted through the factorized codes.
+
+    Parameters
+    ----------
+    symptoms: pd.Series
+        The `Symptoms` column
+    Returns
+    -------
+        pd.DataFrame: The `Symptoms` and their `Count`, most common first
+    """
+    assert isinstance(symptoms, pd.Series)
+
+    if isinstance(symptoms.dtype, pd.CategoricalDtype):
+        codes, cells = symptoms.cat.codes.to_numpy(), symptoms.cat.categories
+    else:
+        codes, cells = pd.factorize(symptoms)
+    occurences = np.bincount(codes[codes >= 0], minlength=len(cells))
+
+    key = tuple(zip(cells, occurences.tolist()))
+    with _lock:
+        counts = _counts.get(key)
+    if counts is None:
+        totals = {}
+        for cell, count in key:
+            if count == 0 or cell == 'NA':
+                continue
+            for symptom in SEPARATOR.split(cell):
+                symptom = canonicalize(symptom)
+                totals[symptom] = totals.get(symptom, 0) + count
+
+        counts = pd.DataFrame({'Symptoms': list(totals.keys()), 'Count': list(totals.values())})
+        counts = counts.sort_values('Symptoms').sort_values('Count', ascending=False, kind='stable')
+        counts = counts.reset_index(drop=True)
+        with _lock:
+            if key not in _counts and len(_counts) >= _MAX_COUNTS:
+                _counts.pop(next(iter(_counts)))
+            _counts[key] = counts
+    return counts.copy()
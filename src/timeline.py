@@ -0,0 +1,296 @@
+"""
+Vectorized daily case counts of the detection timeline and of the daily cases table.
+
+The timeline is reduced once to a dense date x country matrix of case counts with
+`np.bincount` over the combined date and country codes. Comparisons of any set of
+countries against the world total are then slices and sums of that matrix.
+
+The wide daily cases table is turned once into a dense country x date matrix of running
+totals with a datetime axis (`daily_matrix`), persisted in `data/matrices/` and memory
+mapped from there. Windows of it for a few countries (`window`) are slices of that matrix,
+so they take time in the size of the window rather than of the table, and are only turned
+into long form for plotting.
+"""
+import os
+import glob
+import json
+import contextlib
+import collections
+
+import numpy as np
+import pandas as pd
+
+from src.derived import derive, fingerprint, register
+from src.instrument import instrumented
+
+WORLD = 'World'
+
+MATRIX_DIR = 'matrices'
+# Whether the matrices are persisted and memory mapped rather than kept in memory
+MEMMAP = True
+# Number of persisted matrices kept on disk, most recently written first
+MAX_PERSISTED = 8
+
+# `totals[i, j]` is the number of cases of `countries[i]` up to and including `dates[j]`
+DailyMatrix = collections.namedtuple('DailyMatrix', ['totals', 'countries', 'dates'])
+
+
+def _codes(column: pd.Series):
+    # Categorical columns (see `src.schema`) are already factorized
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.cat.codes.to_numpy(), column.cat.categories
+    return pd.factorize(column)
+
+
+@instrumented('aggregate')
+def daily_country_counts(df_detection_timeline: pd.DataFrame) -> pd.DataFrame:
+    """
+    Counts the confirmed cases of each country on each day
+
+    Parameters
+    ----------
+    df_detection_timeline: pd.DataFrame
+        The DataFrame which contains the case detection timeline
+    Returns
+    -------
+        pd.DataFrame: The case counts with one row per day, every day between the first
+        and the last confirmation included, and one column per country, plus a column
+        labelled NaN for the cases without a country if there are any
+    """
+    assert isinstance(df_detection_timeline, pd.DataFrame)
+    assert 'Date_confirmation' in df_detection_timeline.columns and 'Country' in df_detection_timeline.columns
+
+    # Only the distinct dates are parsed, then turned into day offsets from the first day
+    date_codes, dates = _codes(df_detection_timeline['Date_confirmation'])
+    dates = pd.to_datetime(pd.Index(dates), errors='coerce')
+    country_codes, countries = _codes(df_detection_timeline['Country'])
+
+    known_dates = ~dates.isna()
+    if not known_dates.any():
+        return pd.DataFrame(0, index=pd.DatetimeIndex([], name='Date'), columns=pd.Index(countries, name='Country'))
+    first, last = dates[known_dates].min(), dates[known_dates].max()
+    offsets = np.where(known_dates, np.asarray((dates - first).days), -1).astype(np.int64)
+
+    days = np.append(offsets, -1)[date_codes]
+    valid = days >= 0
+    # The cases without a country are counted in a column of their own, after the countries
+    unknown = country_codes < 0
+    if (valid & unknown).any():
+        country_codes = np.where(unknown, len(countries), country_codes)
+        countries = pd.Index(countries).append(pd.Index([np.nan]))
+    n_days, n_countries = (last - first).days + 1, len(countries)
+
+    counts = np.bincount(days[valid] * n_countries + country_codes[valid],
+                         minlength=n_days * n_countries).reshape(n_days, n_countries)
+    return pd.DataFrame(counts,
+                        index=pd.date_range(first, last, freq='D', name='Date'),
+                        columns=pd.Index(countries, name='Country'))
+
+
+@register('daily-country-counts')
+def _daily_country_counts(df: pd.DataFrame) -> pd.DataFrame:
+    return daily_country_counts(df)
+
+
+@instrumented('aggregate')
+def compare_with_world(df_detection_timeline: pd.DataFrame, countries: list, cumulative: bool = False,
+                       population: dict = None) -> pd.DataFrame:
+    """
+    Returns the daily cases of the given countries next to the daily cases of the world
+
+    Parameters
+    ----------
+    df_detection_timeline: pd.DataFrame
+        The DataFrame which contains the case detection timeline
+    countries: list
+        The countries to compare with the world
+    cumulative: bool
+        Whether to return the running total of cases instead of the daily cases
+    population: dict
+        If given, the cases are returned per million people using these populations; it
+        must contain the population of every country in `countries` and of `World`
+    Returns
+    -------
+        pd.DataFrame: One row per day, with a `World` column and one column per country
+    """
+    assert isinstance(df_detection_timeline, pd.DataFrame) and isinstance(countries, list)
+    assert population is None or (isinstance(population, dict) and set(countries + [WORLD]) <= set(population))
+
+    counts = derive(df_detection_timeline, 'daily-country-counts')
+    # Countries without any case get a column of zeros
+    comparison = counts.reindex(columns=countries, fill_value=0)
+    comparison.insert(0, WORLD, counts.to_numpy().sum(axis=1))
+
+    if cumulative:
+        comparison = comparison.cumsum()
+    if population is not None:
+        comparison = comparison / (pd.Series(population)[comparison.columns] / 1e6)
+    comparison.columns.name = None
+    return comparison
+
+
+@instrumented('aggregate')
+def build_daily_matrix(df_daily_cases: pd.DataFrame) -> DailyMatrix:
+    """
+    Builds the matrix of running totals of the daily cases table
+
+    Parameters
+    ----------
+    df_daily_cases: pd.DataFrame
+        The dataframe which contains daily country wise number of cases info, with a
+        `Country` column and one column per date
+    Returns
+    -------
+        DailyMatrix: The running totals with one row per country, in the order of the table
+        (repeated countries are added up), and one column per date, in date order
+    """
+    assert isinstance(df_daily_cases, pd.DataFrame) and 'Country' in df_daily_cases.columns
+
+    columns = df_daily_cases.columns.drop('Country')
+    dates = pd.to_datetime(columns, errors='coerce')
+    order = np.argsort(dates[~dates.isna()].to_numpy(), kind='stable')
+    columns, dates = columns[~dates.isna()][order], dates[~dates.isna()][order]
+
+    codes, countries = pd.factorize(df_daily_cases['Country'])
+    cases = df_daily_cases[columns].fillna(0).to_numpy(dtype=np.int64)
+    valid = codes >= 0
+    if valid.all() and len(countries) == len(codes):
+        counts = cases
+    else:
+        counts = np.zeros((len(countries), len(columns)), dtype=np.int64)
+        np.add.at(counts, codes[valid], cases[valid])
+    return DailyMatrix(np.cumsum(counts, axis=1), pd.Index(countries, name='Country'),
+                       pd.DatetimeIndex(dates, name='Date'))
+
+
+def _matrix_path(digest: str) -> str:
+    return os.path.join(os.getcwd(), 'data', MATRIX_DIR, digest)
+
+
+def store_daily_matrix(matrix: DailyMatrix, digest: str):
+    """
+    Persists a matrix under the fingerprint of its table and prunes the oldest matrices.
+    Failures are ignored since the matrix can always be rebuilt.
+
+    Parameters
+    ----------
+    matrix: DailyMatrix
+        The matrix of running totals
+    digest: str
+        The fingerprint of the daily cases table (see `src.derived.fingerprint`)
+    """
+    assert isinstance(matrix, DailyMatrix) and isinstance(digest, str)
+
+    path = _matrix_path(digest)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.json', 'w') as f:
+            json.dump({'countries': list(matrix.countries), 'dates': [str(date.date()) for date in matrix.dates]}, f)
+        # The totals are written last, so a matrix is only found once complete
+        with open(path + '.npy.tmp', 'wb') as f:
+            np.save(f, np.ascontiguousarray(matrix.totals))
+        os.replace(path + '.npy.tmp', path + '.npy')
+        persisted = sorted(glob.glob(os.path.join(os.path.dirname(path), '*.npy')), key=os.path.getmtime)
+        for old in persisted[:-MAX_PERSISTED]:
+            os.remove(old)
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(old[:-len('.npy')] + '.json')
+    except (OSError, ValueError):
+        pass
+
+
+def load_daily_matrix(digest: str):
+    """
+    Memory maps the persisted matrix of a daily cases table
+
+    Parameters
+    ----------
+    digest: str
+        The fingerprint of the daily cases table (see `src.derived.fingerprint`)
+    Returns
+    -------
+        DailyMatrix: The read-only matrix of running totals, or None if it was not persisted
+    """
+    assert isinstance(digest, str)
+
+    path = _matrix_path(digest)
+    try:
+        with open(path + '.json') as f:
+            axes = json.load(f)
+        totals = np.load(path + '.npy', mmap_mode='r')
+    except (OSError, ValueError):
+        return None
+    return DailyMatrix(totals, pd.Index(axes['countries'], dtype=object, name='Country'),
+                       pd.DatetimeIndex(axes['dates'], name='Date'))
+
+
+@register('daily-matrix')
+def _daily_matrix(df: pd.DataFrame) -> DailyMatrix:
+    if not MEMMAP:
+        return build_daily_matrix(df)
+    digest = fingerprint(df)
+    matrix = load_daily_matrix(digest)
+    if matrix is None:
+        matrix = build_daily_matrix(df)
+        store_daily_matrix(matrix, digest)
+        matrix = load_daily_matrix(digest) or matrix
+    return matrix
+
+
+def daily_matrix(df_daily_cases: pd.DataFrame) -> DailyMatrix:
+    """
+    Returns the matrix of running totals of a daily cases table, from memory or disk if
+    it was built before. The matrix is shared and must not be modified.
+
+    Parameters
+    ----------
+    df_daily_cases: pd.DataFrame
+        The dataframe which contains daily country wise number of cases info
+    Returns
+    -------
+        DailyMatrix: The matrix of running totals (see `build_daily_matrix`)
+    """
+    assert isinstance(df_daily_cases, pd.DataFrame)
+    return derive(df_daily_cases, 'daily-matrix')
+
+
+@instrumented('aggregate')
+def window(matrix: DailyMatrix, countries, start: str = None, end: str = None) -> pd.DataFrame:
+    """
+    Returns the daily and total cases of some countries between two dates, in long form
+
+    Parameters
+    ----------
+    matrix: DailyMatrix
+        The matrix of running totals of the daily cases table
+    countries: list-like
+        The countries to keep; they are returned in the order of the table and unknown
+        countries are left out
+    start: str
+        The first date to keep, or None to start at the first date
+    end: str
+        The last date to keep, or None to end at the last date
+    Returns
+    -------
+        pd.DataFrame: `Country`, `Date`, `Cases` (on that day) and `Total Cases` (up to
+        that day), one row per country and date, sorted by date then country
+    """
+    assert isinstance(matrix, DailyMatrix)
+
+    rows = np.sort(matrix.countries.get_indexer(pd.Index(countries).unique()))
+    rows = rows[rows >= 0]
+    first = 0 if start is None else matrix.dates.searchsorted(pd.Timestamp(start), side='left')
+    last = len(matrix.dates) if end is None else matrix.dates.searchsorted(pd.Timestamp(end), side='right')
+    last = max(first, last)
+
+    # Only the selected rows and dates are read; the daily cases are the differences of
+    # the totals, starting from the total of the day before the window
+    totals = np.asarray(matrix.totals[rows, first:last])
+    before = np.asarray(matrix.totals[rows, first - 1]) if first > 0 else np.zeros(len(rows), dtype=np.int64)
+    cases = np.diff(totals, axis=1, prepend=before[:, None])
+
+    # Date-major, like melting the wide table
+    return pd.DataFrame({'Country': np.tile(matrix.countries[rows].to_numpy(), last - first),
+                         'Date': np.repeat(matrix.dates[first:last].to_numpy(), len(rows)),
+                         'Cases': cases.T.ravel(),
+                         'Total Cases': totals.T.ravel()})
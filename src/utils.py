@@ -1,31 +1,81 @@
 import os
-import re
+import functools
+import threading
 import pandas as pd
 import numpy as np
-import matplotlib
-from geopy.geocoders import Nominatim
-from pycountry_convert import country_alpha2_to_continent_code, country_name_to_country_alpha2
 
+from src import artifacts, columnar, dedup
+from src.countries import country_index, lookup_countries, to_alpha2
+from src.derived import fingerprint
+from src.geocode import geocode, nominatim_resolver
+from src.instrument import instrumented
+from src.ranking import top_k
+from src.schema import schema_for
+from src.symptoms import count_symptoms
 
-def read_data(file: str) -> pd.DataFrame:
+
+# Code columns in which `NA` is a value (Namibia, North America) rather than a missing one
+CODE_COLUMNS = ['Alpha2', 'Continent']
+
+
+def _read_csv(path: str) -> pd.DataFrame:
+    df = pd.read_csv(path, encoding='unicode_escape', low_memory=False)
+    codes = [column for column in CODE_COLUMNS if column in df.columns]
+    if codes:
+        # Only empty cells are missing codes
+        df[codes] = pd.read_csv(path, encoding='unicode_escape', usecols=codes, dtype=str, keep_default_na=False,
+                                na_values=[''])[codes]
+    return df
+
+
+@instrumented('load')
+def read_data(file: str, columns: list = None, use_cache: bool = True, typed: bool = False) -> pd.DataFrame:
     """
-    Read a file as a pandas dataframe
+    Read a file as a pandas dataframe. A binary columnar copy of the file is kept next to
+    it and used for later reads as long as the file is unchanged.
 
     Parameters
     ----------
     file: str
         The name of the file to be read
+    columns: list
+        Optional subset of columns to read
+    use_cache: bool
+        Whether to read from / populate the columnar copy of the file
+    typed: bool
+        Whether to convert the data to its typed schema (see `src.schema`), if it has one
     Returns
     -------
         pd.DataFrame: The pandas dataframe
     """
 
     assert isinstance(file, str)
+    assert columns is None or isinstance(columns, list)
     
     data_dir = os.path.join(os.getcwd(), 'data')
-    return pd.read_csv(os.path.join(data_dir, file), encoding='unicode_escape')
-
-def write_data(df: pd.DataFrame, file: str):
+    path = os.path.join(data_dir, file)
+
+    df = columnar.load(path, columns=columns) if use_cache else None
+    if df is None:
+        df = _read_csv(path)
+        if use_cache:
+            columnar.store(df, path)
+        if columns is not None:
+            df = df[columns]
+
+    if columns is None and use_cache and not typed and dedup.is_indexed(file):
+        # The stored row hashes of the file also spare hashing it again to fingerprint it
+        hashes = dedup.load_index(path)
+        if hashes is None or len(hashes) != len(df):
+            hashes = dedup.row_hashes(df)
+            dedup.store_index(hashes, df, path)
+        fingerprint(df, row_hashes=hashes)
+
+    to_schema = schema_for(file) if typed else None
+    return df if to_schema is None else to_schema(df)
+
+@instrumented('export')
+def write_data(df: pd.DataFrame, file: str, use_cache: bool = True):
     """
     Write the given dataframe to a particular file
 
@@ -35,11 +85,17 @@ def write_data(df: pd.DataFrame, file: str):
         The dataframe to write to the file
     file:
         The name of the file
+    use_cache: bool
+        Whether to also refresh the columnar copy of the file
     """
     assert isinstance(df, pd.DataFrame) and isinstance(file, str)
     
     data_dir = os.path.join(os.getcwd(), 'data')
-    df.to_csv(os.path.join(data_dir, file), index=False)
+    path = os.path.join(data_dir, file)
+    df.to_csv(path, index=False)
+    if use_cache:
+        # Store what a fresh read of the CSV would return so both paths agree
+        columnar.store(_read_csv(path), path)
 
 def get_continent(country: str):
     """
@@ -56,25 +112,24 @@ def get_continent(country: str):
 
     assert isinstance(country, str)
     
-    try:
-        cn_a2_code =  country_name_to_country_alpha2(country)
-    except:
-        cn_a2_code = 'Unknown' 
-    try:
-        cn_continent = country_alpha2_to_continent_code(cn_a2_code)
-    except:
-        cn_continent = 'Unknown' 
-    return (cn_a2_code, cn_continent)
+    codes, _ = country_index()
+    cn_a2_code = to_alpha2(country)
+    if cn_a2_code is None:
+        return ('Unknown', 'Unknown')
+    cn_continent = codes['Continent'].get(cn_a2_code)
+    return (cn_a2_code, cn_continent if isinstance(cn_continent, str) else 'Unknown')
 
 
-def geolocate(country: str):
+def geolocate(country: str, resolver=nominatim_resolver):
     """
-    Returns the latitude and longtitude for the country given its code
+    Returns the latitude and longtitude for the country given its name or code
 
     Parameters
     ----------
     country: str
-        The country code
+        The country name or code
+    resolver: callable
+        The online resolver used when the country is not known offline, or None
     Returns
     -------
         tuple: A tuple containing the lat, lon
@@ -82,26 +137,24 @@ def geolocate(country: str):
 
     assert isinstance(country, str)
     
-    geolocator = Nominatim(user_agent='Vis')
-    try:
-        # Geolocate the center of the country
-        loc = geolocator.geocode(country)
-        # And return latitude and longitude
-        return (loc.latitude, loc.longitude)
-    except:
-        # Return missing value
-        return np.nan
-
-def add_lat_long(df):
+    lat, lon = geocode([country], resolver=resolver)[country]
+    # Return missing value
+    return np.nan if np.isnan(lat) else (lat, lon)
+
+@instrumented('clean')
+def add_lat_long(df, resolver=nominatim_resolver):
     """
     Add the latitude and longitude to the dataframe based on the country names.
-    Adds two additional columns `Country-Continent` and `Lat-Long` to a dataframe.
-    The dataframe should contain a column called `Country` having the country names
+    Adds the columns `Alpha2`, `Alpha3`, `Continent`, `lat` and `lon` to a dataframe.
+    The dataframe should contain a column called `Country` having the country names.
+    Each distinct country is resolved only once and the results are joined back.
 
     Parameters
     ----------
     df: pd.DataFrame
         The dataframe to add the columns to.
+    resolver: callable
+        The online resolver used for countries which are not known offline, or None
     Returns
     -------
         pd.DataFrame: The modified dataframe with the added columns
@@ -109,12 +162,12 @@ def add_lat_long(df):
 
     assert isinstance(df, pd.DataFrame) and 'Country' in df.columns
     
-    df['Country-Continent'] = df['Country'].apply(get_continent)
-    df['Lat-Long'] = df['Country-Continent'].apply(lambda x: geolocate(x[0]))
-    df[['lat', 'lon']] = pd.DataFrame(df['Lat-Long'].to_list(), index=df.index)
-    df = df.drop(['Lat-Long'], axis=1)
-    return df
+    df = pd.concat([df, lookup_countries(df['Country'])], axis=1)
+    locations = geocode(df['Country'].dropna().unique(), resolver=resolver)
+    locations = pd.DataFrame.from_dict(locations, orient='index', columns=['lat', 'lon'])
+    return df.assign(lat=df['Country'].map(locations['lat']), lon=df['Country'].map(locations['lon']))
 
+@instrumented('aggregate')
 def get_highest_cases(df_worldwide_cases: pd.DataFrame, topK: int = 10):
     """
     Get the `topK` countries with the highest number of cases
@@ -131,13 +184,12 @@ def get_highest_cases(df_worldwide_cases: pd.DataFrame, topK: int = 10):
     """
 
     assert isinstance(df_worldwide_cases, pd.DataFrame) and 'Confirmed_Cases' in df_worldwide_cases.columns
-    # Pick the topK countries who has the most cases at the moment
-    df_worldwide_cases['Confirmed_Cases'] = df_worldwide_cases['Confirmed_Cases'].astype(int)
-    df_worldwide_cases = df_worldwide_cases.sort_values('Confirmed_Cases', ascending=False)
-    df_worldwide_cases = df_worldwide_cases.head(topK)
-
-    return df_worldwide_cases["Country"]
+    # Pick the topK countries who has the most cases at the moment, without sorting the
+    # whole table; the input may be shared (see `src.cache`), so it is not modified
+    cases = df_worldwide_cases['Confirmed_Cases'].to_numpy().astype(int)
+    return df_worldwide_cases["Country"].iloc[top_k(cases, topK)]
 
+@instrumented('aggregate')
 def parse_symptoms(df_detection_timeline: pd.DataFrame):
     """
     Cleans up the `Symptoms` column in the dataframe to remove NaNs, also to enable consistency
@@ -155,28 +207,19 @@ def parse_symptoms(df_detection_timeline: pd.DataFrame):
     """
 
     assert isinstance(df_detection_timeline, pd.DataFrame) and 'Symptoms' in df_detection_timeline.columns
-    symptoms: pd.DataFrame = df_detection_timeline[["Symptoms"]]
-    symptoms["Symptoms"].replace(np.nan,"NA",inplace = True)
-    symptoms = symptoms[symptoms["Symptoms"].isin(["NA"]) == False]
-    symptoms["Symptoms"] = symptoms["Symptoms"].str.split(", | , | ,|;")
-    symptoms = symptoms.explode("Symptoms")
-
-    # Replace similar symptoms with a single
-    symptoms.replace(regex=re.compile(r".*rash.*", flags=re.IGNORECASE), value="Rash", inplace=True)
-    symptoms.replace(regex=re.compile(r".*headache.*", flags=re.IGNORECASE), value = "Headache", inplace=True)
-    symptoms.replace(regex=re.compile(r".*pain.*", flags=re.IGNORECASE), value = "Muscle Pain", inplace=True)
-    symptoms.replace(to_replace = ["Swelling","swelling of lymph nodes","enlarged lymph nodes","Slight swallowing difficulties and an elevated temperature"], value = "swollen lymph nodes", inplace=True)
-    symptoms.replace(to_replace = ["lesions","skin manifestations","isolated skin lesions","lower abdomen skin lesions","Spots on skin","Three lesions typical of monkeypox"], value = "skin lesions", inplace=True)
-    symptoms.replace(regex=re.compile(r".*fever.*", flags=re.IGNORECASE), value = "Fever", inplace=True)
-    symptoms.replace(regex=re.compile(r".*algia.*", flags=re.IGNORECASE), value = "Myalgia", inplace=True)
-    symptoms["Symptoms"] = symptoms["Symptoms"].str.title()
-
-    return symptoms.groupby('Symptoms').size().reset_index(name='Count').sort_values('Count', ascending=False)
+
+    # Similar symptoms are replaced with a single one by the rules in `data/symptom_rules.csv`
+    return count_symptoms(df_detection_timeline['Symptoms'])
+
+# Number of figure functions being called by each thread
+_figure_calls = threading.local()
+
 
 def save_fig(name):
     """
     Decorator which can be applied to any function returning a matplotlib or plotly figure
-    to save the figure on file
+    to save the figure on file. The figure is written synchronously, in the background or
+    not at all depending on the mode of `src.artifacts`, and only when it changed.
 
     Parameters
     ----------
@@ -186,15 +229,18 @@ def save_fig(name):
 
     assert isinstance(name, str)
     def show_and_save_plots(func):
+        @functools.wraps(func)
         def plot(*args, **kwargs):
-            # Get the figure
-            fig = func(*args, **kwargs)
+            # Get the figure, noting whether it is built within another figure function
+            depth = getattr(_figure_calls, 'depth', 0)
+            _figure_calls.depth = depth + 1
+            try:
+                fig = func(*args, **kwargs)
+            finally:
+                _figure_calls.depth = depth
             # Save and show the plots
             plot_path = os.path.join(os.getcwd(), f'plots/{name}')
-            if isinstance(fig, matplotlib.figure.Figure):
-                fig.savefig(plot_path)
-            else:
-                fig.write_image(plot_path)
+            artifacts.save(fig, plot_path, nested=depth > 0)
             return fig
         return plot
     return show_and_save_plots
@@ -2,17 +2,77 @@
 Python module which contains all the data visualizations
 """
 import pandas as pd
-import plotly.express as px
-from wordcloud import WordCloud
-import matplotlib.pyplot as plt
 from statistics import mean
 
+from src.cache import cached
+from src.instrument import instrumented
+from src.lazy import lazy_import
+from src.ranking import CITIES, city_ranking, country_ranking
+from src.timeline import compare_with_world, daily_matrix, window
 from src.utils import get_highest_cases, read_data, save_fig, parse_symptoms
 
+# The plotting libraries are imported when the first figure is built
+px = lazy_import('plotly.express')
+go = lazy_import('plotly.graph_objects')
+plt = lazy_import('matplotlib.pyplot')
+wordcloud = lazy_import('wordcloud')
 
+# Regions of the cases map, from their button label to their plotly geo scope
+MAP_REGIONS = {"World": "world", "North America": "north america", "South America": "south america",
+               "Europe": "europe", "Asia": "asia", "Africa": "africa"}
+
+
+@instrumented('figure')
+@cached
+@save_fig(name="Total_cases_map.png")
+def cases_map(df_worldwide_cases: pd.DataFrame, region: str = "world", resolution: int = 110):
+    """
+    Returns a choropleth plot of number of cases in the world, with buttons zooming on the
+    regions in `MAP_REGIONS`. Countries are located by their ISO codes, so the cases of
+    countries sharing a code (e.g. England and Scotland) are added up.
+
+    Parameters
+    ----------
+    df_worldwide_cases: pd.DataFrame
+        The DataFrame which contains country-wise data of cases, with their `Alpha3` codes
+    region: str
+        The region shown first, one of the values of `MAP_REGIONS`
+    resolution: int
+        The scale of the country borders drawn by the browser: 110 (1:110m, the default)
+        or 50 (1:50m, about 5 times more geometry to download)
+    Returns
+    -------
+        A plotly figure
+    """
+    assert isinstance(df_worldwide_cases, pd.DataFrame) and 'Alpha3' in df_worldwide_cases.columns
+    assert region in MAP_REGIONS.values() and resolution in (50, 110)
+
+    df = df_worldwide_cases.dropna(subset=['Alpha3'])
+    df = df.groupby('Alpha3', sort=False).agg(Country=('Country', ', '.join), Cases=('Confirmed_Cases', 'sum'))
+    labels = {scope: label for label, scope in MAP_REGIONS.items()}
+
+    fig = go.Figure(go.Choropleth(locations=df.index, locationmode='ISO-3',
+                                  z=df['Cases'].to_numpy(dtype='int64'), text=df['Country'],
+                                  colorscale=px.colors.sequential.Blues_r,
+                                  colorbar={'title': {'text': 'Confirmed Cases'}},
+                                  hovertemplate='%{text}<br>Confirmed Cases=%{z}<extra></extra>'))
+    fig.update_geos(scope=region, resolution=resolution, showframe=False)
+    fig.update_layout(title=f"Cases in {labels[region]}",
+                      updatemenus=[{'type': 'buttons', 'direction': 'right', 'x': 0, 'y': 1.08,
+                                    'xanchor': 'left', 'showactive': True,
+                                    'active': list(MAP_REGIONS.values()).index(region),
+                                    'buttons': [{'label': label, 'method': 'relayout',
+                                                 'args': [{'geo.scope': scope, 'title.text': f"Cases in {label}"}]}
+                                                for label, scope in MAP_REGIONS.items()]}])
+    return fig
+
+@instrumented('figure')
+@cached
 def cases_on_map(df_worldwide_cases: pd.DataFrame, region: str):
     """
-    Returns a choropleth plot of number of cases in a given region
+    Returns a choropleth plot of number of cases in a given region, a view of the world
+    map of `cases_map` fixed on the region. It is not saved as an image of its own: the
+    world map is exported once and zooms on the regions by its buttons.
 
     Parameters
     ----------
@@ -27,20 +87,15 @@ def cases_on_map(df_worldwide_cases: pd.DataFrame, region: str):
     assert isinstance(df_worldwide_cases, pd.DataFrame) and isinstance(region, str)
     assert region in ["north america", "south america", "europe", "africa", "asia"]
 
-    @save_fig(name=f"Total_cases_{region.replace( ' ', '_')}.png")
-    def get_plot(df_worldwide_cases: pd.DataFrame, region:str):
-        fig = px.choropleth(df_worldwide_cases,
-                        locations='Country',
-                        locationmode='country names',
-                        color="Confirmed_Cases",
-                        scope=region,
-                        color_continuous_scale=px.colors.sequential.Blues_r,
-                        title=f"Cases in {region.title()}",
-                        labels={"Confirmed_Cases":"Confirmed Cases"})
-        return fig
-    
-    return get_plot(df_worldwide_cases, region)
+    # A copy of the shared world map, which is cached and must not be modified
+    fig = go.Figure(cases_map(df_worldwide_cases))
+    fig.update_geos(scope=region)
+    fig.update_layout(title=f"Cases in {region.title()}")
+    fig.layout.updatemenus = ()
+    return fig
 
+@instrumented('figure')
+@cached
 @save_fig(name='Case-Trends.png')
 def case_trends(df_worldwide_cases: pd.DataFrame, df_daily_cases: pd.DataFrame):
     """
@@ -61,15 +116,14 @@ def case_trends(df_worldwide_cases: pd.DataFrame, df_daily_cases: pd.DataFrame):
     
     # Find the topK countries
     countries = get_highest_cases(df_worldwide_cases)
-    df_daily_cases = df_daily_cases[df_daily_cases["Country"].isin(countries)]
 
-    # We need to unpivot the daily cases dataframe to have a date column
-    df_daily_cases = df_daily_cases.melt(id_vars='Country', var_name='Date', value_name='Cases')
-    df_daily_cases['Total Cases'] = df_daily_cases[['Country', 'Cases']].groupby('Country').cumsum()
-    df_daily_cases = df_daily_cases[df_daily_cases['Date']>'2022-05-01']
+    # Slice their totals after May 1st out of the matrix of the daily cases
+    df_daily_cases = window(daily_matrix(df_daily_cases), countries, start='2022-05-02')
     fig = px.line(df_daily_cases, x="Date", y="Total Cases", color="Country", title="The total number of cases")
     return fig
 
+@instrumented('figure')
+@cached
 @save_fig(name="Daily-Changes.png")
 def daily_changes(df_worldwide_cases: pd.DataFrame, df_daily_cases: pd.DataFrame):
     """
@@ -90,21 +144,20 @@ def daily_changes(df_worldwide_cases: pd.DataFrame, df_daily_cases: pd.DataFrame
 
     # Find the topK countries
     countries = get_highest_cases(df_worldwide_cases, topK=5)
-    df_daily_cases = df_daily_cases[df_daily_cases["Country"].isin(countries)]
 
-    # We need to unpivot the daily cases dataframe to have a date column
-    df_daily_cases = df_daily_cases.melt(id_vars='Country', var_name='Date', value_name='Cases')
-    df_daily_cases['Total Cases'] = df_daily_cases[['Country', 'Cases']].groupby('Country').cumsum()
-    df_daily_cases = df_daily_cases[df_daily_cases['Date']>'2022-08-01']
+    # Slice their daily cases after August 1st out of the matrix of the daily cases
+    df_daily_cases = window(daily_matrix(df_daily_cases), countries, start='2022-08-02')
     fig = px.bar(df_daily_cases,
                  x="Date", y="Cases", color="Country",
                   title="Daily Changes")
     return fig
 
+@instrumented('figure')
+@cached
 @save_fig("Cases-in-top-cities.png")
 def cases_cities(df_detection_timeline: pd.DataFrame):
     """
-    Returns a bar chart of number of cases detected in a city for top 5 cities
+    Returns a bar chart of number of cases detected in a city for top 10 cities
     with the highest number of cases
 
     Parameters
@@ -117,15 +170,14 @@ def cases_cities(df_detection_timeline: pd.DataFrame):
     """
     assert isinstance(df_detection_timeline, pd.DataFrame)
 
-    df_cities = df_detection_timeline[['City']]
-    df_cities = df_cities.dropna()
-    df_cities = df_cities.value_counts(['City']).reset_index(name='Total Cases')
-
-    # Pick the top 10 cities with the highest case counts
-    df = df_cities.loc[:10]
+    # Pick the top 10 cities with the highest case counts from the ranking of the timeline
+    top_cities = city_ranking(df_detection_timeline).top(CITIES, 10)
+    df = pd.DataFrame({'City': top_cities.index, 'Total Cases': top_cities.to_numpy()})
     fig = px.bar(df, x='City', y='Total Cases', title='Number of cases in city', color='City', text_auto=True)
     return fig
 
+@instrumented('figure')
+@cached
 @save_fig(name="Suspected-cases.png")
 def suspected_cases_bar(df_worldwide_cases: pd.DataFrame):
     """
@@ -142,7 +194,8 @@ def suspected_cases_bar(df_worldwide_cases: pd.DataFrame):
     """
     assert isinstance(df_worldwide_cases, pd.DataFrame)
 
-    df = df_worldwide_cases.sort_values(["Suspected_Cases"],ascending=False).head(10)
+    top_countries = country_ranking(df_worldwide_cases).top('suspected', 10)
+    df = pd.DataFrame({'Country': top_countries.index, 'Suspected_Cases': top_countries.to_numpy()})
     fig = px.bar(df,
                  x='Country', 
                  y='Suspected_Cases', 
@@ -152,6 +205,8 @@ def suspected_cases_bar(df_worldwide_cases: pd.DataFrame):
                 )
     return fig
 
+@instrumented('figure')
+@cached
 @save_fig(name="Hospitalization-Travelled.png")
 def hospitalized_and_travelled(df_worldwide_cases: pd.DataFrame):
     """
@@ -182,6 +237,8 @@ def hospitalized_and_travelled(df_worldwide_cases: pd.DataFrame):
                 )
     return fig
 
+@instrumented('figure')
+@cached
 @save_fig(name="Symptoms-pie.png")
 def symptoms_distribution(df_detection_timeline: pd.DataFrame, topK=10):
     """
@@ -211,10 +268,19 @@ def symptoms_distribution(df_detection_timeline: pd.DataFrame, topK=10):
                     )
     return fig
 
+@cached
+def _word_cloud_image(symptoms: pd.DataFrame):
+    # The layout is laid out once per symptoms table (the cache keys on its contents) and
+    # with a fixed seed, so the same counts always give the same image
+    frequencies = dict(zip(symptoms['Symptoms'], symptoms['Count'].astype(float)))
+    return wordcloud.WordCloud(background_color='white', random_state=0).generate_from_frequencies(frequencies).to_array()
+
+@instrumented('figure')
+@cached
 @save_fig(name="Symptoms-WordCloud.png")
 def symptoms_word_cloud(df_detection_timeline: pd.DataFrame):
     """
-    Returns a word cloud of all the symptoms
+    Returns a word cloud of all the symptoms, sized by their number of cases
 
     Parameters
     ----------
@@ -227,12 +293,13 @@ def symptoms_word_cloud(df_detection_timeline: pd.DataFrame):
     assert isinstance(df_detection_timeline, pd.DataFrame)
 
     symptoms: pd.DataFrame = parse_symptoms(df_detection_timeline)
-    word_cloud = WordCloud(background_color='white').generate(str(symptoms["Symptoms"].values))
     fig = plt.figure()
-    plt.imshow(word_cloud)
+    plt.imshow(_word_cloud_image(symptoms))
     plt.axis("off")
     return fig
 
+@instrumented('figure')
+@cached
 @save_fig(name="Correlation-Heatmap.png")
 def correlation_heatmap(df_worldwide_cases: pd.DataFrame):
     """
@@ -248,7 +315,7 @@ def correlation_heatmap(df_worldwide_cases: pd.DataFrame):
     """
     assert isinstance(df_worldwide_cases, pd.DataFrame)
 
-    df_worldwide_cases = df_worldwide_cases.drop(columns=['Country', 'Country-Continent', 'lat', 'lon', 'Suspected_Cases'])
+    df_worldwide_cases = df_worldwide_cases.drop(columns=['Country', 'Alpha2', 'Alpha3', 'Continent', 'lat', 'lon', 'Suspected_Cases'])
     correlation = df_worldwide_cases.corr()
     fig = px.imshow(correlation,
                     text_auto=True,
@@ -256,6 +323,44 @@ def correlation_heatmap(df_worldwide_cases: pd.DataFrame):
                     color_continuous_scale=px.colors.sequential.Blues_r)
     return fig
 
+def countries_world_timeline(df_detection_timeline: pd.DataFrame, countries: list, cumulative: bool = False,
+                             population: dict = None, labels: dict = None):
+    """
+    Returns a line chart of number of confirmed cases in the given countries and the world.
+
+    Parameters
+    ----------
+    df_detection_timeline: pd.DataFrame
+        The DataFrame which contains the case detection timeline.
+    countries: list
+        The countries to compare with the world.
+    cumulative: bool
+        Whether to plot the running total of cases instead of the daily cases.
+    population: dict
+        If given, plot the cases per million people; it must contain the population of
+        every country and of `World`.
+    labels: dict
+        Optional labels for the countries in the legend.
+    Returns
+    -------
+        A matplotlib figure.
+    """
+    assert isinstance(df_detection_timeline, pd.DataFrame) and isinstance(countries, list)
+    labels = labels or {}
+
+    comparison = compare_with_world(df_detection_timeline, countries, cumulative=cumulative, population=population)
+
+    fig = plt.figure()
+    for column in comparison.columns:
+        plt.plot(comparison.index, comparison[column], label=labels.get(column, column))
+    plt.legend()
+    fig.autofmt_xdate()
+    plt.xlabel('Dates')
+    plt.ylabel('Number of Cases' if population is None else 'Number of Cases per Million')
+    return fig
+
+@instrumented('figure')
+@cached
 @save_fig(name="Timeline.png")
 def US_world_timeline(df_detection_timeline: pd.DataFrame):
     """
@@ -269,41 +374,14 @@ def US_world_timeline(df_detection_timeline: pd.DataFrame):
     -------
         A matplotlib figure.
     """
-    df = df_detection_timeline.copy()
-    date = df['Date_confirmation'].tolist()
-    country = df['Country'].tolist()
-    world_counter = {}
-    us_counter = {}
-
-    for i in range(len(date)):
-        dat = date[i]
-        cou = country[i]
-        if dat not in world_counter.keys():
-            world_counter[dat] = 1
-        else:
-            world_counter[dat] += 1
-        if cou == 'United States':
-            if dat not in us_counter.keys():
-                us_counter[dat] = 1
-            else:
-                us_counter[dat] += 1
-
-    fig= plt.figure()
-    world_date = list(world_counter.keys())
-    world_count = list(world_counter.values())
-    plt.plot(world_date, world_count, label="World")
-    us_date = list(us_counter.keys())
-    us_count = list(us_counter.values())
-
-    plt.plot(us_date, us_count, label="US")
-    plt.legend()
-    plt.xticks(world_date[25::25])
-    plt.title('Confirmed Cases in the World and the US')
-    plt.xlabel('Dates')
-    plt.ylabel('Number of Cases')
+    assert isinstance(df_detection_timeline, pd.DataFrame)
 
+    fig = countries_world_timeline(df_detection_timeline, ['United States'], labels={'United States': 'US'})
+    plt.title('Confirmed Cases in the World and the US')
     return fig
 
+@instrumented('figure')
+@cached
 def US_world_histogram(df_worldwide_cases: pd.DataFrame):
     """
     Returns a set of histograms compare the number of confirmed cases, 
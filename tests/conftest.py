@@ -0,0 +1,60 @@
+import os
+import sys
+import shutil
+
+import matplotlib
+import pytest
+
+matplotlib.use('Agg')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+RAW = 'Worldwide_Case_Detection_Timeline.csv'
+CLEANED = 'Worldwide_Case_Detection_Timeline_Cleaned.csv'
+
+# Rows exercising the cleaning rules: missing value markers, genders and misspelled names
+EXTRA_ROWS = [
+    b'2022-05-20,United States,San Francsico,20-69,male,"rash, fever",Y,NA,N\n',
+    b'2022-05-21,Spain,Madrid,40+,Female,N/A,nan,,Y\n',
+    b'2022-05-22,Spain,, NA ,f,fever,N,Y,NaN\n',
+    b'2022-05-23,Germany,Berlin,35,M,,,N,\n',
+]
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    """
+    An empty working directory with the `data` and `plots` folders the pipeline reads and
+    writes relative to the current directory, with empty memos
+    """
+    from src import cache, derived
+
+    (tmp_path / 'data').mkdir()
+    (tmp_path / 'plots').mkdir()
+    monkeypatch.chdir(tmp_path)
+    # Memoized results may have been persisted to the workspace of an earlier test
+    derived.invalidate()
+    cache.clear()
+    return tmp_path
+
+
+@pytest.fixture
+def copy_data(workspace):
+    """
+    Copies files of the bundled `data` folder, e.g. `symptom_rules.csv`, to the workspace
+    """
+    def copy(*files):
+        for file in files:
+            shutil.copy(os.path.join(ROOT, 'data', file), workspace / 'data')
+    return copy
+
+
+@pytest.fixture(scope='session')
+def raw_timeline() -> bytes:
+    """
+    A small raw detection timeline: every 150th row of the bundled one and `EXTRA_ROWS`
+    """
+    with open(os.path.join(ROOT, 'data', RAW), 'rb') as f:
+        lines = f.readlines()
+    return b''.join([lines[0]] + lines[1::150] + EXTRA_ROWS)
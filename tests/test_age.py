@@ -0,0 +1,26 @@
+import pandas as pd
+
+from src.age import parse_age
+from src.cube import build_cube
+
+AGES = ['20-69', '40+', '35', '300', '1000-2000', '30-300', '99999999999999999999', 'abc', '5-', '', 'NA', None]
+
+
+def test_parse_age_out_of_range_and_garbage():
+    ages = parse_age(pd.Series(AGES))
+
+    assert ages['Age_low'].tolist()[:3] == [20, 40, 35]
+    assert ages['Age_high'].tolist()[:3] == [69, pd.NA, 35]
+    assert ages['Age_mid'].tolist()[:3] == [45, 40, 35]
+    # Out of range and unparseable ages are null and flagged, missing ones are only null
+    assert ages.iloc[3:, :3].isna().all().all()
+    assert ages['Age_invalid'].tolist() == [False] * 3 + [True] * 6 + [False] * 3
+
+
+def test_cube_with_out_of_range_ages():
+    timeline = pd.DataFrame({'Date_confirmation': '2022-05-01', 'Country': 'Spain', 'City': None, 'Age': AGES,
+                             'Gender': 'male', 'Symptoms': None, 'Hospitalised (Y/N/NA)': None,
+                             'Isolated (Y/N/NA)': None, 'Travel_history (Y/N/NA)': None})
+    cube = build_cube(timeline)
+    assert cube['Count'].sum() == len(AGES)
+    assert cube.loc[cube['Age'].isna(), 'Count'].sum() == len(AGES) - 3
@@ -0,0 +1,57 @@
+import os
+import json
+
+import matplotlib.pyplot as plt
+
+from src import artifacts
+
+
+def test_background_writes_leave_pyplot_alone(workspace):
+    artifacts.set_mode('background')
+    try:
+        for i in range(30):
+            fig = plt.figure()
+            plt.plot([0, i])
+            artifacts.save(fig, str(workspace / 'plots' / f'figure_{i}.png'))
+            # pyplot calls after the save act on the current figure, which must stay `fig`
+            plt.title(f'figure {i}')
+            plt.xticks(rotation=45)
+            assert plt.gcf() is fig
+            assert fig.axes[0].get_title() == f'figure {i}'
+            plt.close(fig)
+            assert plt.get_fignums() == []
+        assert artifacts.flush(timeout=60)
+    finally:
+        artifacts.set_mode('sync')
+
+    assert plt.get_fignums() == []
+    assert len(list((workspace / 'plots').glob('figure_*.png'))) == 30
+
+
+def test_unchanged_images_are_skipped(workspace):
+    path = str(workspace / 'plots' / 'line.png')
+
+    def save(values):
+        fig = plt.figure()
+        plt.plot(values)
+        artifacts.save(fig, path)
+        plt.close(fig)
+        return artifacts.stats()
+
+    artifacts.set_mode('sync')
+    before = artifacts.stats()
+    after = save([0, 1])
+    assert after['written'] == before['written'] + 1
+    written = os.stat(path).st_mtime_ns
+    with open(workspace / 'plots' / artifacts.HASHES_FILE) as f:
+        assert list(json.load(f)) == ['line.png']
+
+    # An identical figure is skipped, a different one is written
+    assert save([0, 1])['skipped'] == after['skipped'] + 1
+    assert os.stat(path).st_mtime_ns == written
+    assert save([1, 0])['written'] == after['written'] + 1
+
+    # An image changed on disk is written again, even for an identical figure
+    with open(path, 'ab') as f:
+        f.write(b'\0')
+    assert save([1, 0])['written'] == after['written'] + 2
@@ -0,0 +1,35 @@
+import matplotlib.pyplot as plt
+
+from src import cache
+from src.cache import cached
+
+
+def test_cached_evicts_least_recently_used_at_the_byte_budget(monkeypatch):
+    monkeypatch.setattr(cache, 'MAX_BYTES', 3 * cache.FIGURE_BYTES)
+    calls = []
+
+    @cached
+    def figure(i):
+        calls.append(i)
+        return plt.figure()
+
+    try:
+        cache.clear()
+        figures = [figure(i) for i in range(3)]
+        assert cache.cache_info()['bytes'] == 3 * cache.FIGURE_BYTES
+        # A hit makes 0 the most recently used, so 1 is evicted for 3
+        assert figure(0) is figures[0]
+        figure(3)
+        info = cache.cache_info()
+        assert info['entries'] == 3 and info['bytes'] <= cache.MAX_BYTES
+        assert [key[1] for key, _ in cache._entries.items()] == [(2,), (0,), (3,)]
+        assert figure(1) is not figures[1] and calls == [0, 1, 2, 3, 1]
+        assert info['functions'][f'{__name__}.{figure.__qualname__}'] == {'hits': 1, 'misses': 4}
+
+        # A value larger than the budget is still kept, alone
+        monkeypatch.setattr(cache, 'MAX_BYTES', cache.FIGURE_BYTES // 2)
+        figure(4)
+        assert cache.cache_info()['entries'] == 1
+    finally:
+        cache.clear()
+        plt.close('all')
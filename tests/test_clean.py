@@ -0,0 +1,47 @@
+import os
+import zipfile
+
+import pandas as pd
+import pytest
+
+from conftest import CLEANED, RAW
+from src import clean
+from src.clean import clean_data
+
+
+def _clean(workspace, file, chunksize=None) -> bytes:
+    clean_data(file, chunksize=chunksize)
+    return (workspace / 'data' / CLEANED).read_bytes()
+
+
+def test_streaming_clean_matches_in_memory_clean(workspace, raw_timeline):
+    (workspace / 'data' / RAW).write_bytes(raw_timeline)
+    expected = _clean(workspace, RAW)
+    assert b'San Francisco' in expected and b'Francsico' not in expected
+
+    for chunksize in (7, 37, 10_000):
+        assert _clean(workspace, RAW, chunksize) == expected
+
+    with zipfile.ZipFile(workspace / 'data' / (RAW + '.zip'), 'w') as archive:
+        archive.writestr(RAW, raw_timeline)
+    os.remove(workspace / 'data' / RAW)
+    assert _clean(workspace, RAW + '.zip', 37) == expected
+    assert not list((workspace / 'data').glob('*.tmp'))
+
+
+def test_streaming_clean_of_input_without_rows(workspace, monkeypatch, raw_timeline):
+    (workspace / 'data' / RAW).write_bytes(raw_timeline.splitlines(keepends=True)[0])
+    expected = _clean(workspace, RAW)
+    assert expected.startswith(b'Date_confirmation,') and expected.count(b'\n') == 1
+    assert _clean(workspace, RAW, 7) == expected
+
+    # Like the pandas versions which give no chunk for a file without rows
+    open_raw = clean.open_raw
+    with monkeypatch.context() as patch:
+        patch.setattr(clean, 'open_raw', lambda file, chunksize=None: iter([]) if chunksize else open_raw(file))
+        assert _clean(workspace, RAW, 7) == expected
+
+    (workspace / 'data' / RAW).write_bytes(b'')
+    with pytest.raises(pd.errors.EmptyDataError):
+        clean_data(RAW, chunksize=7)
+    assert not list((workspace / 'data').glob('*.tmp'))
@@ -0,0 +1,32 @@
+import os
+
+import pandas as pd
+
+from src import columnar
+from src.utils import read_data
+
+FILE = 'cases.csv'
+
+
+def test_edited_csv_invalidates_its_columnar_copy(workspace):
+    path = workspace / 'data' / FILE
+    path.write_text('Country,Cases\nSpain,3\nPeru,4\n')
+    assert read_data(FILE)['Cases'].tolist() == [3, 4]
+    assert columnar.load(str(path)) is not None
+
+    # Same size, modified a nanosecond later: the content hash tells them apart
+    stat = os.stat(path)
+    path.write_text('Country,Cases\nSpain,3\nPeru,5\n')
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert columnar.load(str(path)) is None
+    assert read_data(FILE)['Cases'].tolist() == [3, 5]
+
+    # Touching the file keeps the copy, whose key is refreshed
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2))
+    copy = columnar.load(str(path))
+    pd.testing.assert_frame_equal(copy, read_data(FILE))
+    assert copy['Cases'].tolist() == [3, 5]
+
+    # A changed size needs no hashing
+    path.write_text('Country,Cases\nSpain,3\nPeru,5\nChile,1\n')
+    assert read_data(FILE)['Country'].tolist() == ['Spain', 'Peru', 'Chile']
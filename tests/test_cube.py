@@ -0,0 +1,41 @@
+import pandas as pd
+
+from conftest import CLEANED
+from src import cube
+from src.cube import build_cube, query
+from src.utils import read_data
+
+
+def test_cube_from_typed_timeline(copy_data):
+    copy_data(CLEANED)
+    untyped = build_cube(read_data(CLEANED))
+    typed = build_cube(read_data(CLEANED, typed=True))
+
+    assert typed['Count'].sum() == untyped['Count'].sum()
+    for by in [['Age'], ['Country'], ['Gender', 'Hospitalised (Y/N/NA)']]:
+        expected = query(untyped, by, deduplicated=True).dropna()
+        actual = query(typed, by, deduplicated=True).dropna()
+        assert _counts(actual, by) == _counts(expected, by)
+
+
+def test_cube_of_timeline_with_repeated_index(copy_data):
+    copy_data(CLEANED)
+    df = read_data(CLEANED)
+    # The repeated rows keep their index labels
+    repeated = pd.concat([df, df.iloc[:10]])
+    built = build_cube(repeated)
+
+    assert built['Count'].sum() == len(repeated)
+    assert built.loc[built['Duplicate'], 'Count'].sum() == len(repeated) - len(repeated.drop_duplicates())
+
+
+def test_cube_without_combined_keys(copy_data, monkeypatch):
+    copy_data(CLEANED)
+    df = read_data(CLEANED)
+    expected = build_cube(df)
+    monkeypatch.setattr(cube, 'MAX_KEY', 1)
+    pd.testing.assert_frame_equal(build_cube(df), expected)
+
+
+def _counts(counts, by):
+    return dict(zip(map(tuple, counts[by].astype(str).to_numpy()), counts['Count']))
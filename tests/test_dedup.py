@@ -0,0 +1,24 @@
+import numpy as np
+
+from conftest import CLEANED, RAW
+from src import dedup, ingest
+from src.utils import read_data
+
+
+def test_ingest_extends_the_dedup_index(workspace, copy_data, raw_timeline):
+    copy_data('symptom_rules.csv')
+    raw = raw_timeline
+    path = workspace / 'data' / RAW
+    path.write_bytes(raw)
+    ingest.ingest(RAW)
+
+    # Rows repeating earlier ones, and one new row
+    with open(path, 'ab') as f:
+        f.write(b''.join(raw.splitlines(keepends=True)[1:21]) + b'2022-06-01,France,Paris,30,M,,,,\n')
+    result = ingest.ingest(RAW)
+
+    cleaned = read_data(CLEANED, use_cache=False)
+    assert result['rows'] == 21
+    assert result['duplicates'] == cleaned.duplicated().iloc[-21:].sum() == 20
+    cleaned_path = str(workspace / 'data' / CLEANED)
+    assert np.array_equal(dedup.load_index(cleaned_path), dedup.row_hashes(cleaned))
@@ -0,0 +1,25 @@
+import pandas as pd
+import pytest
+
+from src import derived
+
+
+def test_failed_transform_can_be_derived_again(monkeypatch):
+    calls = []
+
+    def flaky(df):
+        calls.append(len(df))
+        if len(calls) == 1:
+            raise RuntimeError('first call fails')
+        return df.copy()
+
+    monkeypatch.setitem(derived._transforms, 'flaky', flaky)
+    df = pd.DataFrame({'a': [1, 2, 3]})
+    with pytest.raises(RuntimeError):
+        derived.derive(df, 'flaky')
+    assert not [key for key in derived._computing if key[1] == 'flaky']
+
+    assert derived.derive(df, 'flaky').equals(df)
+    assert derived.derive(df, 'flaky').equals(df) and len(calls) == 2
+    assert not [key for key in derived._computing if key[1] == 'flaky']
+    derived.invalidate(df)
@@ -0,0 +1,23 @@
+import numpy as np
+
+from src.geocode import GAZETTEER_FILE, geocode, load_cache
+
+
+def test_online_lookups_are_cached_including_failures(copy_data):
+    copy_data(GAZETTEER_FILE)
+    calls = []
+
+    def resolver(name):
+        calls.append(name)
+        return (1.0, 2.0) if name == 'Atlantis' else None
+
+    names = ['Atlantis', 'El Dorado', 'Germany']
+    for _ in range(2):
+        locations = geocode(names, resolver=resolver)
+        assert locations['Atlantis'] == (1.0, 2.0) and np.isnan(locations['El Dorado']).all()
+        assert not np.isnan(locations['Germany']).any()
+    # Only the names missing from the gazetteer are sent, and only once
+    assert sorted(calls) == ['Atlantis', 'El Dorado']
+    assert load_cache() == {'Atlantis': (1.0, 2.0), 'El Dorado': None}
+    # The cache is read offline too
+    assert geocode(['Atlantis'], resolver=None)['Atlantis'] == (1.0, 2.0)
@@ -0,0 +1,8 @@
+from benchmarks import import_time
+
+
+def test_failed_import_fails_the_run(monkeypatch):
+    monkeypatch.setattr(import_time, 'BUDGETS', {'src.utils': 10.0, 'missing': 10.0})
+    monkeypatch.setattr(import_time, 'import_time',
+                        lambda module: (None, 'ModuleNotFoundError') if module == 'missing' else (0.1, ''))
+    assert not import_time.run(repeat=2)
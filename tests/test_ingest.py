@@ -0,0 +1,28 @@
+from conftest import CLEANED, RAW
+from src import ingest
+from src.clean import clean_data
+
+
+def test_ingest_of_appended_rows_matches_full_clean(workspace, copy_data, raw_timeline):
+    copy_data('symptom_rules.csv')
+    raw = raw_timeline
+    # The first ingest sees the file while a row is being written
+    cut = raw.index(b'\n', len(raw) // 2) + 10
+    path = workspace / 'data' / RAW
+    path.write_bytes(raw[:cut])
+    first = ingest.ingest(RAW)
+    assert first['rebuilt'] and first['offset'] == raw.rindex(b'\n', 0, cut) + 1
+
+    for start, end in [(cut, len(raw) - 100), (len(raw) - 100, len(raw))]:
+        with open(path, 'ab') as f:
+            f.write(raw[start:end])
+        assert not ingest.ingest(RAW)['rebuilt']
+    assert ingest.ingest(RAW)['rows'] == 0
+    ingested = (workspace / 'data' / CLEANED).read_bytes()
+    aggregates = ingest.load_state(RAW)['aggregates']
+
+    clean_data(RAW)
+    assert ingested == (workspace / 'data' / CLEANED).read_bytes()
+    ingest.rebuild(RAW)
+    assert aggregates == ingest.load_state(RAW)['aggregates']
+
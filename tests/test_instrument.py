@@ -0,0 +1,74 @@
+import threading
+
+from src import instrument
+
+
+def test_peaks_of_overlapping_threads_are_not_attributed():
+    instrument.clear()
+    instrument.enable(memory=True)
+    try:
+        with instrument.span('derive', 'alone'):
+            data = bytearray(2 ** 20)
+
+        started, done = threading.Barrier(2), threading.Barrier(2)
+
+        def run(name):
+            with instrument.span('figure', name):
+                started.wait()
+                data = bytearray(2 ** 20)
+                done.wait()
+                return data
+
+        threads = [threading.Thread(target=run, args=(name,)) for name in ('first', 'second')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        events = {event['name']: event for event in instrument.events()}
+    finally:
+        instrument.disable()
+        instrument.clear()
+
+    assert events['alone']['peak'] >= len(data)
+    assert events['first']['peak'] is None and events['second']['peak'] is None
+    assert all('overlaps' not in event for event in events.values())
+
+
+def test_runs_only_record_their_own_events():
+    runs = {}
+    started, done = threading.Barrier(3), threading.Barrier(3)
+
+    def session(name):
+        if name != 'untraced':
+            runs[name] = instrument.start_run()
+        try:
+            started.wait()
+            with instrument.span('figure', name):
+                pass
+            def export():
+                with instrument.span('export', name):
+                    pass
+
+            # A worker thread records in the run of the session which handed it the work
+            worker = threading.Thread(target=instrument.bind(export))
+            worker.start()
+            worker.join()
+            done.wait()
+        finally:
+            if name in runs:
+                instrument.end_run(runs[name])
+
+    threads = [threading.Thread(target=session, args=(name,)) for name in ('first', 'second', 'untraced')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    try:
+        for name in ('first', 'second'):
+            assert [(event['stage'], event['name']) for event in instrument.events(runs[name])] == \
+                [('figure', name), ('export', name)]
+        assert not [event for event in instrument.events() if event['name'] == 'untraced']
+        assert not instrument.is_enabled()
+    finally:
+        for run in runs.values():
+            instrument.clear(run)
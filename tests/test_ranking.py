@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+
+from src.ranking import RankingIndex, top_k
+
+
+def test_top_k_ties_missing_values_and_short_inputs():
+    values = [3, 7, 5, 7, 1, 5, 7]
+    # Equal values keep their order
+    assert top_k(values, 3).tolist() == [1, 3, 6]
+    assert top_k(values, 4).tolist() == [1, 3, 6, 2]
+    assert top_k(values, 0).tolist() == []
+
+    # Missing values come last, in their order
+    values = [np.nan, 2.0, np.nan, 9.0, 2.0]
+    assert top_k(values, 3).tolist() == [3, 1, 4]
+    assert top_k(values, 5).tolist() == [3, 1, 4, 0, 2]
+
+    # Fewer values than asked for
+    assert top_k([4, 8], 10).tolist() == [1, 0]
+    assert top_k([], 10).tolist() == []
+
+
+def test_top_matches_a_stable_sort():
+    rng = np.random.default_rng(0)
+    counts = pd.Series(rng.integers(0, 20, 500), index=[f'City {i}' for i in range(500)])
+    index = RankingIndex()
+    index.add_counts('cities', counts)
+
+    expected = counts.sort_values(ascending=False, kind='stable')
+    for k in (1, 10, 499, 500, 600):
+        top = index.top('cities', k)
+        assert len(top) == min(k, len(counts))
+        pd.testing.assert_series_equal(top, expected.iloc[:k], check_names=False)
@@ -0,0 +1,56 @@
+import json
+import os
+
+from src import artifacts, cache, render
+from src.derived import transforms
+from src.timeline import daily_matrix
+from src.utils import save_fig
+from src.visualizations import cases_on_map
+
+# The datasets of the batch and the symptom rules
+DATA_FILES = [*render.DATASETS.values(), 'symptom_rules.csv']
+
+
+def test_nested_figures_are_captured_by_their_own_function(copy_data):
+    copy_data(*DATA_FILES)
+    render.load_datasets()
+
+    @save_fig(name='Europe.png')
+    def europe(df):
+        return cases_on_map(df, 'europe')
+
+    with artifacts.capture() as saved:
+        europe(render._datasets['worldwide'])
+    # The world map built within is left to the job of `cases_map`
+    assert [os.path.basename(path) for path, _, _ in saved] == ['Europe.png']
+
+    # The region map is a view of the world map, which is the only image saved
+    cache.clear()
+    with artifacts.capture() as saved:
+        cases_on_map(render._datasets['worldwide'], 'europe')
+    assert [os.path.basename(path) for path, _, _ in saved] == ['Total_cases_map.png']
+
+
+def test_batch_records_the_hash_of_every_image(workspace, copy_data):
+    copy_data(*DATA_FILES)
+    reports = render.render_all(workers=2, export_workers=1,
+                                only=['virus_vs_age_group', 'hospitalization_gender', 'US_world_histogram'])
+
+    images = [os.path.basename(path) for report in reports for path in report['images']]
+    assert len(images) == len(set(images)) == 5
+    with open(workspace / 'plots' / artifacts.HASHES_FILE) as f:
+        hashes = json.load(f)
+    assert sorted(hashes) == sorted(images) == sorted(path.name for path in (workspace / 'plots').glob('*.png'))
+    assert not list((workspace / 'plots').glob('*.tmp'))
+
+
+def test_datasets_get_their_own_derived_data(workspace, copy_data, recwarn):
+    copy_data(*DATA_FILES)
+    render.load_datasets()
+
+    listed = [name for names in render.TRANSFORMS.values() for name in names]
+    assert sorted(listed) == transforms()
+    assert not [warning for warning in recwarn if issubclass(warning.category, UserWarning)]
+    matrix = daily_matrix(render._datasets['daily'])
+    assert matrix.totals.shape == (len(matrix.countries), len(matrix.dates)) and min(matrix.totals.shape) > 0
+    assert len(list((workspace / 'data' / 'matrices').glob('*.npy'))) == 1
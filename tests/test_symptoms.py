@@ -0,0 +1,69 @@
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+
+from conftest import CLEANED
+from src import symptoms
+from src.symptoms import RULES_FILE, count_symptoms
+from src.utils import read_data
+
+# Cells exercising the order of the rules, which the chain below applies one after the other
+EXTRA_CELLS = ['Rash, fever', 'headache;back pain', 'Swelling , lesions', 'fever and rash', 'arthralgia with fever',
+               'Spots on skin;myalgia', 'NA', np.nan, 'cough, Cough', 'enlarged lymph nodes ,Headache']
+
+
+def replace_chain(cells: pd.Series) -> pd.DataFrame:
+    """
+    The `str.replace` chain which `count_symptoms` replaces
+    """
+    symptoms = cells.fillna('NA').to_frame('Symptoms')
+    symptoms = symptoms[symptoms['Symptoms'] != 'NA']
+    symptoms['Symptoms'] = symptoms['Symptoms'].str.split(", | , | ,|;")
+    symptoms = symptoms.explode('Symptoms')
+
+    symptoms = symptoms.replace(regex=re.compile(r".*rash.*", flags=re.IGNORECASE), value="Rash")
+    symptoms = symptoms.replace(regex=re.compile(r".*headache.*", flags=re.IGNORECASE), value="Headache")
+    symptoms = symptoms.replace(regex=re.compile(r".*pain.*", flags=re.IGNORECASE), value="Muscle Pain")
+    symptoms = symptoms.replace(to_replace=["Swelling", "swelling of lymph nodes", "enlarged lymph nodes",
+                                            "Slight swallowing difficulties and an elevated temperature"],
+                                value="swollen lymph nodes")
+    symptoms = symptoms.replace(to_replace=["lesions", "skin manifestations", "isolated skin lesions",
+                                            "lower abdomen skin lesions", "Spots on skin",
+                                            "Three lesions typical of monkeypox"], value="skin lesions")
+    symptoms = symptoms.replace(regex=re.compile(r".*fever.*", flags=re.IGNORECASE), value="Fever")
+    symptoms = symptoms.replace(regex=re.compile(r".*algia.*", flags=re.IGNORECASE), value="Myalgia")
+    symptoms['Symptoms'] = symptoms['Symptoms'].str.title()
+    return symptoms.groupby('Symptoms').size().reset_index(name='Count')
+
+
+def _counts(counts: pd.DataFrame) -> dict:
+    return dict(zip(counts['Symptoms'], counts['Count']))
+
+
+def test_rules_match_the_replace_chain(copy_data):
+    copy_data(CLEANED, RULES_FILE)
+    cells = pd.concat([read_data(CLEANED)['Symptoms'], pd.Series(EXTRA_CELLS * 3)], ignore_index=True)
+
+    expected = _counts(replace_chain(cells))
+    assert expected['Rash'] > 0 and expected['Skin Lesions'] > 0
+    assert _counts(count_symptoms(cells)) == expected
+    # Also from the memos, and as categories
+    assert _counts(count_symptoms(cells)) == expected
+    assert _counts(count_symptoms(cells.astype('category'))) == expected
+
+    # Concurrent calls, which evict each other's counts, all get their own
+    symptoms._counts.clear()
+    results = {}
+
+    def count(i):
+        results[i] = _counts(count_symptoms(cells.iloc[:len(cells) - i]))
+
+    threads = [threading.Thread(target=count, args=(i,)) for i in range(2 * symptoms._MAX_COUNTS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results[0] == expected and len(results) == len(threads)
+    assert len(symptoms._counts) <= symptoms._MAX_COUNTS
@@ -0,0 +1,99 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+from src import derived, timeline
+from src.timeline import WORLD, compare_with_world, daily_matrix, window
+from src.utils import read_data
+
+# A small detection timeline with a missing date and country and a day without cases
+TIMELINE = pd.DataFrame({
+    'Date_confirmation': ['2022-05-01', '2022-05-01', '2022-05-02', '2022-05-04', '2022-05-04', None, '2022-05-04'],
+    'Country': ['Spain', 'Germany', 'Spain', 'Spain', 'Portugal', 'Spain', None],
+})
+
+# A small daily cases table, with its dates out of order and a repeated country
+DAILY = 'Daily_Country_Wise_Confirmed_Cases.csv'
+DAILY_CSV = ('Country,2022-05-03,2022-05-01,2022-05-02,2022-05-04\n'
+             'Spain,3,1,0,2\n'
+             'Peru,0,0,4,1\n'
+             'Spain,1,0,0,0\n'
+             'Chile,5,5,5,5\n')
+
+
+def _expected(countries) -> pd.DataFrame:
+    # The daily cases of every country, then of the world, with a row for every day
+    df = TIMELINE.dropna(subset=['Date_confirmation'])
+    days = pd.date_range('2022-05-01', '2022-05-04', freq='D', name='Date')
+    counts = pd.crosstab(pd.to_datetime(df['Date_confirmation']), df['Country']).reindex(days, fill_value=0)
+    expected = counts.reindex(columns=countries, fill_value=0)
+    expected.insert(0, WORLD, df.groupby('Date_confirmation').size().set_axis(
+        pd.to_datetime(df['Date_confirmation'].drop_duplicates().sort_values())).reindex(days, fill_value=0))
+    expected.columns.name = None
+    return expected
+
+
+def test_compare_with_world_daily_and_cumulative():
+    countries = ['Spain', 'France', 'Germany']
+    expected = _expected(countries)
+    assert expected[WORLD].tolist() == [2, 1, 0, 3]
+
+    daily = compare_with_world(TIMELINE, countries)
+    pd.testing.assert_frame_equal(daily, expected, check_dtype=False, check_freq=False)
+    cumulative = compare_with_world(TIMELINE, countries, cumulative=True)
+    pd.testing.assert_frame_equal(cumulative, expected.cumsum(), check_dtype=False, check_freq=False)
+    assert cumulative.loc['2022-05-04'].tolist() == [6, 3, 0, 1]
+
+
+def test_compare_with_world_per_capita():
+    countries = ['Spain', 'Portugal']
+    population = {WORLD: 8e9, 'Spain': 47e6, 'Portugal': 10e6, 'Germany': 83e6}
+    expected = _expected(countries).cumsum() / (pd.Series(population)[[WORLD] + countries] / 1e6)
+
+    per_capita = compare_with_world(TIMELINE, countries, cumulative=True, population=population)
+    pd.testing.assert_frame_equal(per_capita, expected, check_freq=False)
+    assert np.isclose(per_capita.loc['2022-05-04', 'Portugal'], 0.1)
+
+
+def test_window_slices_dates_and_countries():
+    df = pd.read_csv(io.StringIO(DAILY_CSV))
+    matrix = timeline.build_daily_matrix(df)
+    assert matrix.countries.tolist() == ['Spain', 'Peru', 'Chile']
+    assert matrix.totals.tolist() == [[1, 1, 5, 7], [0, 4, 4, 5], [5, 10, 15, 20]]
+
+    # Countries in the order of the table, unknown ones left out; the first day of the
+    # window gets its own cases, not the total before it
+    df = window(matrix, ['Chile', 'Atlantis', 'Spain'], start='2022-05-02', end='2022-05-03')
+    assert df.to_dict('list') == {
+        'Country': ['Spain', 'Chile', 'Spain', 'Chile'],
+        'Date': list(pd.to_datetime(['2022-05-02', '2022-05-02', '2022-05-03', '2022-05-03'])),
+        'Cases': [0, 5, 4, 5],
+        'Total Cases': [1, 10, 5, 15],
+    }
+    # Open and empty windows
+    assert len(window(matrix, ['Peru'])) == 4 and window(matrix, ['Peru'])['Cases'].sum() == 5
+    assert window(matrix, ['Peru'], start='2022-06-01').empty
+    assert window(matrix, ['Peru'], start='2022-05-03', end='2022-05-02').empty
+
+
+def test_daily_matrix_is_reused_until_the_table_changes(workspace, monkeypatch):
+    (workspace / 'data' / DAILY).write_text(DAILY_CSV)
+    matrix = daily_matrix(read_data(DAILY))
+    assert isinstance(matrix.totals, np.memmap)
+    persisted = list((workspace / 'data' / timeline.MATRIX_DIR).glob('*.npy'))
+    assert len(persisted) == 1
+
+    # Another process, or a rerun after the memo was dropped, maps the same matrix
+    derived.invalidate()
+    with monkeypatch.context() as patch:
+        patch.setattr(timeline, 'build_daily_matrix', None)
+        again = daily_matrix(read_data(DAILY))
+    assert again.totals.filename == matrix.totals.filename
+    assert np.array_equal(again.totals, matrix.totals) and again.dates.equals(matrix.dates)
+
+    # A changed table gets a matrix of its own
+    (workspace / 'data' / DAILY).write_text(DAILY_CSV.replace('Chile,5,5,5,5', 'Chile,5,5,5,15'))
+    changed = daily_matrix(read_data(DAILY))
+    assert changed.totals[2, -1] == 30
+    assert len(list((workspace / 'data' / timeline.MATRIX_DIR).glob('*.npy'))) == 2
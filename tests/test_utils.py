@@ -0,0 +1,13 @@
+from src.utils import read_data
+
+WORLDWIDE = 'Monkey_Pox_Cases_Worldwide_Cleaned.csv'
+
+
+def test_every_country_has_a_continent(copy_data):
+    copy_data(WORLDWIDE)
+    # The first read parses the CSV, the second one serves its columnar copy
+    for _ in range(2):
+        df = read_data(WORLDWIDE)
+        assert df['Continent'].notna().all(), df.loc[df['Continent'].isna(), 'Country'].tolist()
+        assert (df['Continent'] != 'Unknown').all()
+    assert set(df.loc[df['Country'].isin(['United States', 'Mexico', 'Canada']), 'Continent']) == {'NA'}